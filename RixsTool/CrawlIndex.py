@@ -0,0 +1,323 @@
+#/*##########################################################################
+# Copyright (C) 2014 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# This toolkit is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# PyMca is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# PyMca; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# PyMca follows the dual licensing model of Riverbank's PyQt and cannot be
+# used as a free plugin for a non-free program.
+#
+# Please contact the ESRF industrial unit (industry@esrf.fr) if this license
+# is a problem for you.
+#############################################################################*/
+__author__ = "Tonn Rueter - ESRF Data Analysis Unit"
+
+import sqlite3
+import json
+from hashlib import md5
+from os import access as OsAccess
+from os import makedirs as OsMakedirs
+from os import W_OK as OS_W_OK
+from os.path import join as OsPathJoin
+from os.path import isdir as OsPathIsDir
+from os.path import expanduser as OsPathExpanduser
+from os.path import abspath as OsAbsPath
+
+import numpy
+
+from RixsTool.IO import IODict, EdfFrame, SpecScanBlock, SpecColumn
+from RixsTool.Items import DataItem, SpecItem, ScanItem, ImageItem, StackItem, LazyArray, FrameStack
+
+DEBUG = 0
+
+INDEX_FILENAME = '.rixstool_index.sqlite'
+INDEX_FALLBACK_DIR = OsPathJoin('~', '.rixstool', 'index')
+
+#
+# Layout of the database. Indexes of a different layout are discarded and rebuilt
+#
+INDEX_VERSION = 2
+
+
+class ReadArray(LazyArray):
+    __doc__ = """:class:`Items.LazyArray` for data that a reader holds in memory, e.g. plain text data. The file is
+    read again once the data is accessed.
+
+    .. py:attribute:: fileName
+
+        Absolute path to the file
+
+    .. py:attribute:: position
+
+        Position of the item in the list returned by :func:`IO.InputReader.itemize`
+
+    .. py:attribute:: attribute
+
+        Either 'array' or 'scale'"""
+
+    def __init__(self, fileName, position, attribute, shape, dtype):
+        LazyArray.__init__(self, shape, dtype)
+        self.fileName = fileName
+        self.position = position
+        self.attribute = attribute
+
+    def load(self):
+        readers = IODict.inputReaderDict()
+        fileType = IODict.sniff(self.fileName, readers)
+        if fileType not in readers:
+            raise ValueError("ReadArray.load -- File '%s' can no longer be read" % self.fileName)
+        item = readers[fileType].itemize(self.fileName)[self.position]
+        if self.attribute == 'scale':
+            return item.scale()
+        return item.array
+
+
+class CrawlIndex(object):
+    __doc__ = """On-disk index of the items read from the files of a directory tree. Every file is identified by its
+    absolute path, its size and its modification time. As long as these three values do not change, the items of
+    the file are restored from the index instead of reading the file again.
+
+    The index is a SQLite database. Per default it is stored in the crawled directory itself, if the directory is
+    not writable it is placed in the users home directory.
+
+    The index only holds plain values: key, type, shape, dtype and header of every item as well as a description
+    of where its data is found in the file, i.e. the byte offset and frame number of an EDF frame or the byte range
+    and column of a SPEC scan. Data a reader holds in memory is described by the position of the item in the file.
+    Restored items read their data lazily (c.f. :class:`Items.LazyArray`). Files containing items that can not be
+    described are not indexed.
+
+    .. py:attribute:: fileName
+
+        Location of the SQLite database"""
+
+    ITEM_CLASSES = dict((itemClass.__name__, itemClass) for itemClass in
+                        [DataItem, SpecItem, ScanItem, ImageItem, StackItem])
+
+    def __init__(self, directory, fileName=None):
+        """
+        :param str directory: Root directory of the crawl
+        :param str fileName: Location of the index. Default: None, i.e. the location is determined by
+         :func:`CrawlIndex.location`
+        """
+        self.fileName = fileName if fileName else CrawlIndex.location(directory)
+        self._connection = sqlite3.connect(self.fileName)
+        version = self._connection.execute('PRAGMA user_version').fetchone()[0]
+        if version != INDEX_VERSION:
+            if DEBUG >= 1:
+                print("CrawlIndex.__init__ -- Rebuilding index '%s' of version %d" % (self.fileName, version))
+            self._connection.execute('DROP TABLE IF EXISTS files')
+            self._connection.execute('DROP TABLE IF EXISTS items')
+            self._connection.execute('PRAGMA user_version = %d' % INDEX_VERSION)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS files ('
+            'path TEXT PRIMARY KEY, size INTEGER, mtime REAL)')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS items ('
+            'path TEXT, position INTEGER, key TEXT, type TEXT, shape TEXT, dtype TEXT, header TEXT, '
+            'array TEXT, scale TEXT, frameHeaders TEXT, PRIMARY KEY (path, position))')
+        self._files = dict(
+            (path, (size, mtime)) for path, size, mtime in self._connection.execute(
+                'SELECT path, size, mtime FROM files'))
+
+    @staticmethod
+    def location(directory):
+        """
+        :param str directory: Root directory of the crawl
+        :returns: Default location of the index for the given directory
+        :rtype: str
+        """
+        directory = OsAbsPath(directory)
+        if OsAccess(directory, OS_W_OK):
+            return OsPathJoin(directory, INDEX_FILENAME)
+        fallback = OsPathExpanduser(INDEX_FALLBACK_DIR)
+        if not OsPathIsDir(fallback):
+            OsMakedirs(fallback)
+        digest = md5(directory.encode('utf-8')).hexdigest()
+        return OsPathJoin(fallback, digest + '.sqlite')
+
+    def __contains__(self, path):
+        return path in self._files
+
+    def isCurrent(self, path, size, mtime):
+        """
+        :param str path: Absolute file name
+        :param int size: File size in bytes
+        :param float mtime: Modification time of the file
+
+        :returns: True if the index holds the items of the file in its current state
+        :rtype: bool
+        """
+        return self._files.get(path) == (size, mtime)
+
+    @staticmethod
+    def describeArray(array, path, position, attribute):
+        """
+        :param array: Data of an item, either ndarray or :class:`Items.LazyArray`
+        :param str path: Absolute file name
+        :param int position: Position of the item in the file
+        :param str attribute: Either 'array' or 'scale'
+
+        :returns: Description of the location of the data. None if there is no data
+        :rtype: dict or None
+        :raises ValueError: if the data can not be described
+        """
+        if array is None:
+            return None
+        if isinstance(array, EdfFrame):
+            if array.fileName != path:
+                raise ValueError('CrawlIndex.describeArray -- Frame located in a different file')
+            return {'kind': 'edf', 'offset': array.offset, 'index': array.index, 'compressed': array.compressed,
+                    'shape': list(array.shape), 'dtype': array.dtype.str}
+        if isinstance(array, SpecColumn):
+            block = array.block
+            if block.fileName != path:
+                raise ValueError('CrawlIndex.describeArray -- Column located in a different file')
+            return {'kind': 'spec', 'start': block.start, 'stop': block.stop, 'nCols': block.nCols,
+                    'labels': list(block.labels), 'rows': block.rowCount(), 'column': array.column}
+        if isinstance(array, FrameStack):
+            return {'kind': 'stack', 'frames': [CrawlIndex.describeArray(frame, path, position, attribute)
+                                                for frame in array.frames]}
+        if isinstance(array, (numpy.ndarray, LazyArray)):
+            return {'kind': 'read', 'position': position, 'attribute': attribute,
+                    'shape': list(array.shape), 'dtype': numpy.dtype(array.dtype).str}
+        raise ValueError("CrawlIndex.describeArray -- Can not describe data of type '%s'" % type(array))
+
+    @staticmethod
+    def restoreArray(description, path, blocks):
+        """
+        :param dict description: Description as returned by :func:`CrawlIndex.describeArray`
+        :param str path: Absolute file name
+        :param dict blocks: :class:`IO.SpecScanBlock` instances of the file by their byte range. Columns of the same
+         scan share a block
+
+        :returns: Placeholder for the data
+        :rtype: LazyArray or None
+        :raises ValueError: if the description is invalid
+        """
+        if description is None:
+            return None
+        kind = description.get('kind')
+        if kind == 'edf':
+            return EdfFrame(path, description['offset'], description['shape'], description['dtype'],
+                            description['index'], description['compressed'])
+        if kind == 'spec':
+            blockKey = (description['start'], description['stop'])
+            if blockKey not in blocks:
+                blocks[blockKey] = SpecScanBlock(path, description['start'], description['stop'],
+                                                 description['nCols'], description['labels'], description['rows'])
+            return SpecColumn(blocks[blockKey], description['column'])
+        if kind == 'stack':
+            return FrameStack([CrawlIndex.restoreArray(frame, path, blocks) for frame in description['frames']])
+        if kind == 'read':
+            return ReadArray(path, description['position'], description['attribute'], description['shape'],
+                             description['dtype'])
+        raise ValueError("CrawlIndex.restoreArray -- Unknown kind of data '%s'" % str(kind))
+
+    def items(self, path):
+        """
+        :param str path: Absolute file name
+        :returns: Items of the file as stored in the index. Their data is read once it is accessed
+        :rtype: list
+        :raises ValueError: if the entries of the file are invalid
+        """
+        cursor = self._connection.execute(
+            'SELECT key, type, header, array, scale, frameHeaders FROM items WHERE path = ? ORDER BY position',
+            (path,))
+        llist = []
+        blocks = {}
+        for key, typeName, header, array, scale, frameHeaders in cursor:
+            if typeName not in CrawlIndex.ITEM_CLASSES:
+                raise ValueError("CrawlIndex.items -- Unknown item type '%s'" % typeName)
+            item = CrawlIndex.ITEM_CLASSES[typeName](
+                key=key,
+                header=json.loads(header),
+                array=self.restoreArray(json.loads(array), path, blocks),
+                fileLocation=path)
+            scale = json.loads(scale)
+            if scale is not None:
+                item.setScale(self.restoreArray(scale, path, blocks))
+            if frameHeaders is not None:
+                item.frameHeaders = json.loads(frameHeaders)
+            llist += [item]
+        return llist
+
+    def update(self, path, size, mtime, itemList):
+        """
+        :param str path: Absolute file name
+        :param int size: File size in bytes
+        :param float mtime: Modification time of the file
+        :param list itemList: Items read from the file. An empty list marks a file that does not contain any data.
+
+        Replaces the entries of a file in the index. If an item can not be described, the file is removed from the
+        index instead. Changes are written to disk by :func:`CrawlIndex.commit`.
+        """
+        self.remove(path)
+        rows = []
+        try:
+            for position, item in enumerate(itemList):
+                typeName = type(item).__name__
+                if CrawlIndex.ITEM_CLASSES.get(typeName) is not type(item):
+                    raise ValueError("CrawlIndex.update -- Can not index items of type '%s'" % typeName)
+                lazyArray = item.array if item.isLoaded() else item._lazyArray
+                array = self.describeArray(lazyArray, path, position, 'array')
+                scale = None
+                if isinstance(item, ScanItem):
+                    scale = self.describeArray(item._scale, path, position, 'scale')
+                frameHeaders = None
+                if isinstance(item, StackItem):
+                    frameHeaders = json.dumps(item.frameHeaders, default=str)
+                rows += [(path, position, item.key(), typeName, str(item.shape()), str(item.dtype()),
+                          json.dumps(item.header, default=str), json.dumps(array), json.dumps(scale), frameHeaders)]
+        except ValueError as error:
+            if DEBUG >= 1:
+                print("CrawlIndex.update -- Not indexing '%s': %s" % (path, str(error)))
+            return
+        self._connection.execute(
+            'INSERT INTO files (path, size, mtime) VALUES (?, ?, ?)', (path, size, mtime))
+        self._connection.executemany(
+            'INSERT INTO items (path, position, key, type, shape, dtype, header, array, scale, frameHeaders) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        self._files[path] = (size, mtime)
+
+    def remove(self, path):
+        """
+        :param str path: Absolute file name
+
+        Removes the entries of a file from the index.
+        """
+        if path not in self._files:
+            return
+        self._connection.execute('DELETE FROM files WHERE path = ?', (path,))
+        self._connection.execute('DELETE FROM items WHERE path = ?', (path,))
+        del(self._files[path])
+
+    def prune(self, pathList):
+        """
+        :param list pathList: Absolute file names found in the current crawl
+
+        Removes the entries of all files that are not in pathList, i.e. files that have been deleted.
+        """
+        present = set(pathList)
+        for path in [path for path in self._files if path not in present]:
+            self.remove(path)
+
+    def commit(self):
+        self._connection.commit()
+
+    def close(self):
+        self._connection.commit()
+        self._connection.close()
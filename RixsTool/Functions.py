@@ -75,7 +75,7 @@ class Fit(object):
         #
         # Function definition: y = a * x**2 + b * x + c
         #
-        expression = lambda x, a, b, c: a * x**2 + b * x + c
+        expression = 'lambda x, a, b, c: a * x**2 + b * x + c'
         function.setExpression(expression)
 
         #
@@ -0,0 +1,175 @@
+#/*##########################################################################
+# Copyright (C) 2014 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# This toolkit is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# PyMca is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# PyMca; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# PyMca follows the dual licensing model of Riverbank's PyQt and cannot be
+# used as a free plugin for a non-free program.
+#
+# Please contact the ESRF industrial unit (industry@esrf.fr) if this license
+# is a problem for you.
+#############################################################################*/
+__author__ = "Tonn Rueter - ESRF Data Analysis Unit"
+
+from math import floor, isinf, isnan
+from decimal import Decimal
+
+DEBUG = 0
+
+#
+# Separates the levels in the labels of nested groups, e.g. 'Images/sample: Cu/energy: 930'
+#
+GROUP_SEPARATOR = '/'
+
+#
+# Relative tolerance by which a value may fall short of a bin edge and still be assigned to the bin above,
+# compensates the rounding error of value / binWidth
+#
+BIN_TOLERANCE = 1e-12
+
+
+def groupName(label):
+    """
+    :param str label: Label of a group
+    :returns: Last level of a nested group label
+    :rtype: str
+    """
+    return str(label).rsplit(GROUP_SEPARATOR, 1)[-1]
+
+
+def formatValue(value):
+    """
+    :param float value: Numerical header value
+    :returns: Integral values without decimals, all other values in their shortest exact representation, such
+     that distinct values yield distinct strings
+    :rtype: str
+    """
+    if value.is_integer() and abs(value) < 1e15:
+        return '%d' % value
+    return repr(value)
+
+
+def decimals(value):
+    """
+    :param float value: Number
+    :returns: Number of decimals of the shortest representation of value, at least zero
+    :rtype: int
+    """
+    return max(0, -Decimal(repr(float(value))).normalize().as_tuple().exponent)
+
+
+class GroupingRule(object):
+    __doc__ = """Sorts items into sub groups by the value of a header field, c.f.
+    :func:`Project.RixsProject.setGroupingRules`.
+
+    .. py:attribute:: field
+
+        Name of the header field (c.f. :func:`HeaderIndex.headerFields`)
+
+    .. py:attribute:: binWidth
+
+        Numerical values are grouped in bins of this width. If None, every value forms its own group
+
+    .. py:attribute:: itemTypes
+
+        Tuple of item classes the rule applies to. If None, the rule applies to all items
+
+    .. py:attribute:: label
+
+        Prefix of the group names
+
+    .. py:attribute:: missing
+
+        Group name used for items that lack the header field"""
+
+    def __init__(self, field, binWidth=None, itemTypes=None, label=None, missing='unknown'):
+        """
+        :param str field: Name of the header field, case insensitive
+        :param float binWidth: Width of the bins for numerical values. Default: None
+        :param iterable itemTypes: Item classes the rule applies to. Default: None, i.e. all items
+        :param str label: Prefix of the group names. Default: None, i.e. the field name
+        :param str missing: Group name for items that lack the header field. Default: 'unknown'
+        """
+        if binWidth is not None and binWidth <= 0.:
+            raise ValueError('GroupingRule.__init__ -- binWidth must be positive')
+        self.field = field.lower()
+        self.binWidth = binWidth
+        self.itemTypes = tuple(itemTypes) if itemTypes else None
+        self.label = label if label else field
+        self.missing = missing
+
+    def appliesTo(self, item):
+        """
+        :param ProjectItem item: Item to be inserted into the project
+        :rtype: bool
+        """
+        return self.itemTypes is None or isinstance(item, self.itemTypes)
+
+    def groupName(self, fields):
+        """
+        :param dict fields: Parsed header fields of an item (c.f. :func:`HeaderIndex.headerFields`)
+
+        Numerical values are assigned to the bin [n * binWidth, (n+1) * binWidth), the group is named after the
+        lower bin edge rounded to the decimals of binWidth.
+
+        :returns: Name of the group the item belongs to
+        :rtype: str
+        """
+        value = fields.get(self.field)
+        if value is None or value == '':
+            value = self.missing
+        elif isinstance(value, float):
+            if self.binWidth and not (isinf(value) or isnan(value)):
+                quotient = value / self.binWidth
+                index = floor(quotient + BIN_TOLERANCE * max(1., abs(quotient)))
+                value = float(round(index * self.binWidth, decimals(self.binWidth)))
+            value = formatValue(value)
+        return ('%s: %s' % (self.label, value)).replace(GROUP_SEPARATOR, '_')
+
+
+def unitTest_GroupingRule():
+    """
+    Checks that grid values fall into their own bin for fractional bin widths and that large values keep all their
+    digits in the group names.
+    """
+    result = True
+    rule = GroupingRule('energy', binWidth=.1)
+    energies = [round(900. + .1 * idx, 1) for idx in range(500)]
+    wrong = [energy for energy in energies if rule.groupName({'energy': energy}) != 'energy: ' + formatValue(energy)]
+    print('Grouping.unitTest_GroupingRule -- %d of %d energies in the wrong bin' % (len(wrong), len(energies)))
+    result = result and not len(wrong)
+
+    cases = [
+        (GroupingRule('scan'), 1234567., 1234571.),
+        (GroupingRule('t', binWidth=60), 1760000000., 1760000060.),
+        (GroupingRule('energy', binWidth=.5), 930.25, 930.75),
+        (GroupingRule('energy', binWidth=.25), 1e6 + .25, 1e6 + .5),
+        (GroupingRule('x'), .1 + .2, .3)
+    ]
+    for rule, first, second in cases:
+        names = rule.groupName({rule.field: first}), rule.groupName({rule.field: second})
+        print('\t%s, %s' % names)
+        result = result and names[0] != names[1]
+    result = result and GroupingRule('t', binWidth=60).groupName({'t': 1760000059.}) == 't: 1760000040'
+    result = result and GroupingRule('e', binWidth=.1).groupName({'e': 900.35}) == 'e: 900.3'
+    print('\t%s' % ('Success' if result else 'Failure'))
+    return result
+
+
+if __name__ == '__main__':
+    unitTest_GroupingRule()
@@ -0,0 +1,341 @@
+#/*##########################################################################
+# Copyright (C) 2014 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# This toolkit is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# PyMca is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# PyMca; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# PyMca follows the dual licensing model of Riverbank's PyQt and cannot be
+# used as a free plugin for a non-free program.
+#
+# Please contact the ESRF industrial unit (industry@esrf.fr) if this license
+# is a problem for you.
+#############################################################################*/
+__author__ = "Tonn Rueter - ESRF Data Analysis Unit"
+
+from bisect import bisect_left, bisect_right
+import re
+
+DEBUG = 0
+
+#
+# Separates the names of the motors in the #O lines of a SPEC header
+#
+SPEC_MOTORNAMES = re.compile(r'\s{2,}')
+SPEC_MOTORTAG = re.compile(r'^([OP])(\d+)$')
+
+#
+# Matches 'name = value' respectively 'name: value' in string headers
+#
+HEADER_FIELD = re.compile(r'^\s*([^=:;]+?)\s*[=:]\s*(.*?)\s*;?\s*$')
+
+INFINITY = float('inf')
+
+
+def typedValue(value):
+    """
+    :param value: Raw header value
+
+    :returns: Value as float if it can be interpreted as number, the stripped string otherwise
+    :rtype: float or str
+    """
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, (int, float)):
+        return float(value)
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def headerFields(header):
+    """
+    :param header: Header of a :class:`Items.ProjectItem`, either a dict or a string
+
+    Extracts the fields of a header. Field names are converted to lower case. String headers are read line by line
+    as 'name = value' respectively 'name: value'. The motor names and positions given in the #O and #P lines of a
+    SPEC header are paired to fields named after the motors.
+
+    :returns: Field names and typed values (c.f. :func:`typedValue`)
+    :rtype: dict
+    """
+    fields = {}
+    if isinstance(header, dict):
+        motorNames, motorPositions = {}, {}
+        for name, value in header.items():
+            match = SPEC_MOTORTAG.match(str(name))
+            if match:
+                tag, number = match.groups()
+                if tag == 'O':
+                    motorNames[int(number)] = SPEC_MOTORNAMES.split(str(value).strip())
+                else:
+                    motorPositions[int(number)] = str(value).split()
+                continue
+            fields[str(name).strip().lower()] = typedValue(value)
+        names = sum([motorNames[number] for number in sorted(motorNames)], [])
+        positions = sum([motorPositions[number] for number in sorted(motorPositions)], [])
+        for name, value in zip(names, positions):
+            fields[name.strip().lower()] = typedValue(value)
+    elif header:
+        for line in str(header).splitlines():
+            match = HEADER_FIELD.match(line)
+            if match:
+                name, value = match.groups()
+                fields[name.lower()] = typedValue(value)
+    return fields
+
+
+class FieldIndex(object):
+    __doc__ = """Sorted secondary index over a single header field. Numbers and strings are kept in separate sorted
+    lists of (value, identifier) tuples that are searched by bisection.
+
+    New entries are collected unsorted and removed entries are only marked as removed. Both are merged into the
+    sorted lists on the next query, so that adding many items in a row costs a single sort."""
+
+    def __init__(self):
+        self._values = {}
+        self._numbers = []
+        self._strings = []
+        self._pending = {}
+        self._removed = set()
+
+    def __len__(self):
+        self._update()
+        return len(self._numbers) + len(self._strings)
+
+    def add(self, identifier, value):
+        """
+        :param int identifier: Identifier of the container
+        :param value: Typed value (c.f. :func:`typedValue`)
+        """
+        self._values[identifier] = value
+        self._pending[identifier] = value
+
+    def remove(self, identifier):
+        """
+        :param int identifier: Identifier of the container
+        """
+        del(self._values[identifier])
+        if identifier in self._pending:
+            del(self._pending[identifier])
+        else:
+            self._removed.add(identifier)
+
+    def _update(self):
+        if not (len(self._pending) or len(self._removed)):
+            return
+        removed = self._removed
+        numbers = [entry for entry in self._numbers if entry[1] not in removed] if len(removed) else self._numbers
+        strings = [entry for entry in self._strings if entry[1] not in removed] if len(removed) else self._strings
+        for identifier, value in self._pending.items():
+            if isinstance(value, float):
+                numbers.append((value, identifier))
+            else:
+                strings.append((value, identifier))
+        numbers.sort()
+        strings.sort()
+        self._numbers = numbers
+        self._strings = strings
+        self._pending = {}
+        self._removed = set()
+
+    @staticmethod
+    def limits(condition):
+        """
+        :param condition: Either a single value the field must equal or a 2-tuple (low, high) giving an inclusive
+         range. None as lower respectively upper limit leaves the range open.
+
+        :returns: Typed lower and upper limit
+        :rtype: tuple
+        :raises ValueError: if a range is not given as 2-tuple
+        """
+        if isinstance(condition, (tuple, list)):
+            if len(condition) != 2:
+                raise ValueError('FieldIndex.limits -- Range must be given as 2-tuple (low, high)')
+            low, high = condition
+        else:
+            low, high = condition, condition
+        low = typedValue(low) if low is not None else None
+        high = typedValue(high) if high is not None else None
+        return low, high
+
+    def _range(self, low, high):
+        self._update()
+        isNumber = isinstance(low, float) or isinstance(high, float)
+        entries = self._numbers if isNumber else self._strings
+        start = bisect_left(entries, (low,)) if low is not None else 0
+        stop = bisect_right(entries, (high, INFINITY)) if high is not None else len(entries)
+        return entries, start, stop
+
+    def count(self, condition):
+        """
+        :param condition: c.f. :func:`FieldIndex.limits`
+        :returns: Number of containers matching the condition
+        :rtype: int
+        """
+        entries, start, stop = self._range(*self.limits(condition))
+        return stop - start
+
+    def select(self, condition):
+        """
+        :param condition: c.f. :func:`FieldIndex.limits`
+        :returns: Identifiers of the containers matching the condition
+        :rtype: set
+        """
+        entries, start, stop = self._range(*self.limits(condition))
+        return set(identifier for value, identifier in entries[start:stop])
+
+    def filter(self, identifiers, condition):
+        """
+        :param iterable identifiers: Identifiers of containers
+        :param condition: c.f. :func:`FieldIndex.limits`
+
+        Checks the values of the given containers directly instead of searching the index. Used to narrow down
+        a small set of candidates.
+
+        :returns: Identifiers of the containers matching the condition
+        :rtype: set
+        """
+        low, high = self.limits(condition)
+        valueType = float if isinstance(low, float) or isinstance(high, float) else str
+        values = self._values
+        matches = [(identifier, values.get(identifier)) for identifier in identifiers]
+        matches = [(identifier, value) for identifier, value in matches if type(value) is valueType]
+        if low is not None:
+            matches = [(identifier, value) for identifier, value in matches if low <= value]
+        if high is not None:
+            matches = [(identifier, value) for identifier, value in matches if value <= high]
+        return set(identifier for identifier, value in matches)
+
+
+class HeaderIndex(object):
+    __doc__ = """Secondary indexes over the header fields of all items in a project. The header of an item is parsed
+    once when the item is added (c.f. :func:`headerFields`), queries are answered from the indexes without touching
+    the items or their data."""
+
+    def __init__(self):
+        self._fields = {}
+        self._itemFields = {}
+
+    def __len__(self):
+        return len(self._itemFields)
+
+    def add(self, identifier, header, fields=None):
+        """
+        :param int identifier: Identifier of the container holding the item
+        :param header: Header of the item
+        :param dict fields: Header fields if already parsed. Default: None
+        """
+        if fields is None:
+            fields = headerFields(header)
+        for name, value in fields.items():
+            if name not in self._fields:
+                self._fields[name] = FieldIndex()
+            self._fields[name].add(identifier, value)
+        self._itemFields[identifier] = list(fields.keys())
+
+    def remove(self, identifier):
+        """
+        :param int identifier: Identifier of the container holding the item
+        """
+        for name in self._itemFields.pop(identifier, []):
+            self._fields[name].remove(identifier)
+
+    def fields(self):
+        """
+        :returns: Names of all indexed header fields
+        :rtype: list
+        """
+        return sorted(self._fields.keys())
+
+    def select(self, conditions):
+        """
+        :param dict conditions: Maps field names to conditions (c.f. :func:`FieldIndex.select`)
+
+        :returns: Identifiers of the containers matching all conditions
+        :rtype: set
+        """
+        if not len(conditions):
+            return set(self._itemFields.keys())
+        candidates = []
+        for name, condition in conditions.items():
+            fieldIndex = self._fields.get(name.lower())
+            if fieldIndex is None:
+                return set()
+            candidates += [(fieldIndex.count(condition), fieldIndex, condition)]
+        # Search the index only for the most selective condition, check the others per candidate
+        candidates.sort(key=lambda candidate: candidate[0])
+        count, fieldIndex, condition = candidates[0]
+        result = fieldIndex.select(condition)
+        for count, fieldIndex, condition in candidates[1:]:
+            if not len(result):
+                break
+            result = fieldIndex.filter(result, condition)
+        return result
+
+
+def benchmark_HeaderIndex(numItems=100000, numQueries=100, window=.5):
+    """
+    Compares range queries answered by :class:`HeaderIndex` to a scan over the headers of numItems images.
+    """
+    import time
+    import numpy
+    from RixsTool.Project import RixsProject
+    from RixsTool.Items import ImageItem
+
+    energies = numpy.random.uniform(900., 950., numItems)
+    presets = numpy.random.choice([100., 300., 600.], numItems)
+    itemList = [ImageItem('image%06d.edf' % idx, {'energy': '%.3f' % energies[idx], 'preset': '%d' % presets[idx]},
+                          numpy.zeros((2, 2)), None)
+                for idx in range(numItems)]
+
+    project = RixsProject()
+    timeStart = time.time()
+    project.addItems(itemList)
+    project.query(energy=(0, 0))  # Sorts the indexes
+    timeIngest = time.time() - timeStart
+
+    lows = numpy.random.uniform(900., 950. - window, numQueries)
+
+    def scan(low, high):
+        result = []
+        for container in project['Images'].children:
+            header = container.item().header
+            if low <= float(header['energy']) <= high and float(header['preset']) == 300.:
+                result += [container]
+        return result
+
+    timeStart = time.time()
+    reference = [scan(low, low + window) for low in lows[:10]]
+    timeScan = (time.time() - timeStart) / 10
+
+    timeStart = time.time()
+    results = [project.query(energy=(low, low + window), preset=300) for low in lows]
+    timeIndex = (time.time() - timeStart) / numQueries
+
+    success = all(len(ref) == len(res) for ref, res in zip(reference, results))
+    print('HeaderIndex.benchmark -- %d images, energy range and preset query' % numItems)
+    print('\tparsing and indexing headers: %.3f s' % timeIngest)
+    print('\tscan:  %.3e s per query' % timeScan)
+    print('\tindex: %.3e s per query (speedup: %.0f)' % (timeIndex, timeScan / timeIndex))
+    print('\tresults identical: %s' % str(success))
+    return success
+
+
+if __name__ == '__main__':
+    benchmark_HeaderIndex()
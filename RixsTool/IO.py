@@ -34,183 +34,629 @@ from PyMca5.PyMcaIO.EdfFile import EdfFile
 #
 # Imports for spec file I/O
 #
-#from PyMca.PyMcaIO.specfilewrapper import specfilewrapper as SpecFile
-#from PyMca.PyMcaIO.specfilewrapper import myscandata
+from mmap import mmap as MemoryMap
+from mmap import ACCESS_READ as MMAP_ACCESS_READ
 
 #
 # Imports for file access
 #
 from os.path import split as OsPathSplit
+from os.path import splitext as OsPathSplitext
 from os import linesep as NEWLINE
 from os import access as OsAccess
 from os import R_OK as OS_R_OK
+from os import remove as OsRemove
+from os.path import exists as OsPathExists
+from os.path import abspath as OsAbsPath
+try:
+    from os import replace as OsReplace
+except ImportError:
+    from os import rename as OsReplace
+
+#
+# Imports for spectrum export and project files
+#
+from zipfile import ZipFile, ZIP_DEFLATED
+from io import BytesIO
+from multiprocessing.pool import ThreadPool
+try:
+    import h5py
+except ImportError:
+    h5py = None
 
 #
 # Utilities
 #
 import numpy as np
 import time
+import re
 
 #
 # ProjectItem to wrap data in
 #
-from RixsTool.Items import ImageItem, SpecItem, ScanItem
+from RixsTool.Items import DataItem, ImageItem, SpecItem, ScanItem, StackItem, FunctionItem, LazyArray
+from RixsTool.ItemContainer import ItemContainer
+try:
+    from collections import OrderedDict
+except ImportError:
+    from RixsTool.OrderedDict import OrderedDict
 
 DEBUG = 0
 
+#
+# EDF data types and byte orders as written in the EDF header
+#
+EDF_DATATYPES = {
+    'unsignedbyte': 'u1',
+    'unsigned8': 'u1',
+    'signedbyte': 'i1',
+    'signed8': 'i1',
+    'unsignedshort': 'u2',
+    'unsigned16': 'u2',
+    'signedshort': 'i2',
+    'signed16': 'i2',
+    'unsignedinteger': 'u4',
+    'unsignedlong': 'u4',
+    'unsigned32': 'u4',
+    'signedinteger': 'i4',
+    'signedlong': 'i4',
+    'signed32': 'i4',
+    'unsignedlong64': 'u8',
+    'unsigned64': 'u8',
+    'signedlong64': 'i8',
+    'signed64': 'i8',
+    'floatvalue': 'f4',
+    'float': 'f4',
+    'float32': 'f4',
+    'doublevalue': 'f8',
+    'double': 'f8',
+    'float64': 'f8'
+}
+EDF_BYTEORDERS = {
+    'highbytefirst': '>',
+    'lowbytefirst': '<'
+}
+EDF_BLOCKSIZE = 512
+
+#
+# Matches empty lines in plain text data
+#
+BLANKLINES = re.compile(b'\n\\s*(?=\n)')
+
+#
+# Matches a line of data respectively the column label separator in SPEC files. Lines starting with '@' hold
+# MCA data and may be continued over several lines ending in a backslash, SPEC_MCALINES matches them as a whole
+#
+SPEC_DATALINE = re.compile(b'^[^#@\\s]', re.MULTILINE)
+SPEC_MCALINES = re.compile(b'^@(?:[^\\n]*\\\\\\r?\\n)*[^\\n]*', re.MULTILINE)
+SPEC_LABELS = re.compile(r'\s{2,}')
+SPEC_FILEHEADER = re.compile(b'^#[FSE] ', re.MULTILINE)
+
+#
+# Signature at the start of every HDF5 file
+#
+HDF5_SIGNATURE = b'\x89HDF\r\n\x1a\n'
+
+
+class UnknownFileType(TypeError):
+    __doc__ = """Raised if none of the registered input readers recognizes a file (c.f. :func:`IODict.sniff`).
+    Derives from TypeError, which was raised for unknown file types before."""
+
 
 class IODict(object):
+    __doc__ = """Registry of the input readers. Files whose extension is claimed by a reader (c.f.
+    :py:attr:`InputReader.extensions`) are handed to that reader. The format of all other files is identified from
+    their first :py:attr:`SNIFF_SIZE` bytes by asking every registered reader class in turn (c.f.
+    :func:`InputReader.sniff`). Additional readers can be registered using :func:`IODict.register` or by installing
+    a package that provides a subclass of :class:`InputReader` in the entry point group 'rixstool.readers'."""
+
     EDF_TYPE = 'edf'    # -> Wrapper for edf files
     DAT_TYPE = 'dat'    # -> Wrapper for plaintext data
+    SPEC_TYPE = 'spec'  # -> Wrapper for spec files
+    HDF5_TYPE = 'hdf5'  # -> Recognized, but no reader provided by RixsTool
+    NPZ_TYPE = 'npz'    # -> Export only
 
-    # TODO: Use these type too
-    SPEC_TYPE = 'stack'  # -> Wrapper for spec files
+    SNIFF_SIZE = 512
+    ENTRY_POINT_GROUP = 'rixstool.readers'
+
+    _readerClasses = []
+    _entryPointsLoaded = False
+
+    @staticmethod
+    def register(readerClass):
+        """
+        :param type readerClass: Subclass of :class:`InputReader` with a unique fileType
+
+        Readers are asked to identify a file in the order of their registration. A reader class replaces an
+        already registered class of the same file type.
+        """
+        if not readerClass.fileType:
+            raise ValueError('IODict.register -- Reader class must define a file type')
+        for idx, registered in enumerate(IODict._readerClasses):
+            if registered.fileType == readerClass.fileType:
+                IODict._readerClasses[idx] = readerClass
+                return
+        IODict._readerClasses += [readerClass]
+
+    @staticmethod
+    def loadEntryPoints():
+        """
+        Registers the reader classes found in the entry point group 'rixstool.readers'. Entry points are only
+        loaded once.
+        """
+        if IODict._entryPointsLoaded:
+            return
+        IODict._entryPointsLoaded = True
+        try:
+            from importlib.metadata import entry_points
+            entryPoints = entry_points()
+            if hasattr(entryPoints, 'select'):
+                entryPoints = entryPoints.select(group=IODict.ENTRY_POINT_GROUP)
+            else:
+                entryPoints = entryPoints.get(IODict.ENTRY_POINT_GROUP, [])
+        except ImportError:
+            try:
+                from pkg_resources import iter_entry_points
+            except ImportError:
+                return
+            entryPoints = iter_entry_points(IODict.ENTRY_POINT_GROUP)
+        for entryPoint in entryPoints:
+            try:
+                IODict.register(entryPoint.load())
+            except Exception as error:
+                if DEBUG >= 1:
+                    print("IODict.loadEntryPoints -- Failed to load '%s': %s" % (str(entryPoint), str(error)))
 
     @staticmethod
     def inputReaderDict():
-        ddict = {
-            IODict.EDF_TYPE: EdfReader(),
-            IODict.DAT_TYPE: RawReader()
-        }
+        """
+        :returns: Instances of all registered readers ordered by their file type
+        :rtype: dict
+        """
+        IODict.loadEntryPoints()
+        ddict = OrderedDict()
+        for readerClass in IODict._readerClasses:
+            ddict[readerClass.fileType] = readerClass()
         return ddict
 
+    @staticmethod
+    def sniff(fileName, inputReaders, cache=None):
+        """
+        :param str fileName: File name including absolute path to the file
+        :param dict inputReaders: Maps file types to :class:`InputReader` instances
+        :param dict cache: Sniffed formats per directory and file extension. The format found before for the
+         same directory and extension is tried first. Default: None, i.e. no caching
+
+        :returns: File type of the reader claiming the extension of the file, else of the first reader that
+         recognizes the content of the file. None if no reader does
+        :rtype: str or None
+        """
+        directory, name = OsPathSplit(fileName)
+        ext = OsPathSplitext(name)[1].lower()
+        for fileType, reader in inputReaders.items():
+            if ext in reader.extensions:
+                return fileType
+
+        cacheKey = (directory, ext)
+        useCache = cache is not None and len(ext) > 0
+        candidates = list(inputReaders.keys())
+        if useCache and cacheKey in cache:
+            cached = cache[cacheKey]
+            if cached in candidates:
+                candidates.remove(cached)
+                candidates.insert(0, cached)
+
+        with open(fileName, 'rb') as fileHandle:
+            head = fileHandle.read(IODict.SNIFF_SIZE)
+
+        fileType = None
+        for candidate in candidates:
+            if inputReaders[candidate].sniff(head):
+                fileType = candidate
+                break
+        if fileType is None and head.startswith(HDF5_SIGNATURE):
+            fileType = IODict.HDF5_TYPE
+        if useCache and fileType is not None:
+            cache[cacheKey] = fileType
+        if DEBUG >= 1:
+            print("IODict.sniff -- '%s': %s" % (fileName, str(fileType)))
+        return fileType
+
 
 class InputReader(object):
+    __doc__ = """Base class of all input readers. Readers do not keep any state between two calls of
+    :func:`InputReader.itemize`, every call opens and closes its own file handle. A single reader instance
+    can therefore be used from multiple threads at once.
+
+    .. py:attribute:: fileType
+
+        Name of the format the reader handles, used as key in :class:`IODict`
+
+    .. py:attribute:: extensions
+
+        Lower case file extensions, including the leading dot, of files that are always handed to the reader
+        without inspecting their content
+
+    .. py:attribute:: _srcType
+
+        Callable that opens a file given its name. The returned source must provide a close method."""
+    fileType = None
+    extensions = ()
+
     def __init__(self):
         self._srcType = None
-        self.key = ''
-        self.reader = None
 
-    def __len__(self):
-        return len(self.keys())
+    @staticmethod
+    def sniff(head):
+        """
+        :param bytes head: First bytes of a file (c.f. :py:attr:`IODict.SNIFF_SIZE`)
+
+        Decides from the start of the file if the reader can handle it. Must be reimplemented in
+        every child class.
+
+        :returns: True if the file is recognized
+        :rtype: bool
+        """
+        return False
 
     def __repr__(self):
         inputType = str(self._srcType)
         return '%s %s %s' % (inputType, 'instance at', id(self))
 
-    def __initReader(self, fileName):
+    def _open(self, fileName):
         """
-        :param fileName: absolute file name
-        :type fileName: str
+        :param str fileName: absolute file name
 
-        Creates reader instance and sets the key.
+        :returns: 2-tuple containing the key, i.e. the file name without its path, and the opened source
+        :rtype: tuple
+        :raises ValueError: In case the file is inaccessible
+        :raises NotImplementedError: In case the base class is instantiated
         """
-        if isinstance(self._srcType, type(None)):
-            raise NotImplementedError('InputReader.__initReaders -- Do not instantiate base class')
+        if self._srcType is None:
+            raise NotImplementedError('InputReader._open -- Do not instantiate base class')
         if DEBUG >= 1:
-            print("InputReader.__initReaders -- reading: '%s'" % fileName)
+            print("InputReader._open -- reading: '%s'" % fileName)
         if not OsAccess(fileName, OS_R_OK):
-            return False
-        path, name = OsPathSplit(fileName)
-        self.key = name
-        self.reader = self._srcType(fileName)
-        return True
+            raise ValueError("InputReader.itemize -- Invalid file '%s'" % fileName)
+        path, key = OsPathSplit(fileName)
+        return key, self._srcType(fileName)
 
     def itemize(self, fileName):
         """
         :param fileName: File name including absolute path to the file
         :type fileName: str
 
-        Method serves as interface between the different reader types and the DataItem container class.
-        :func:`InputReader.itemize` must be reimplemented in every child class.
+        Method serves as interface between the different reader types and the DataItem container class. The file
+        is opened, handed to :func:`InputReader._itemize` and closed again, regardless of the outcome.
 
+        :returns: List of items read from the file
+        :rtype: list
         :raises ValueError: In case the file is inaccessible
         :raises NotImplementedError: In case the base class is instantiated
         """
+        timeStart = time.time()
+        key, source = self._open(fileName)
         try:
-            success = self.__initReader(fileName)
-        except NotImplementedError:
-            # Reraise error from correct function
-            raise NotImplementedError('InputReader.itemize -- Do not instantiate base class')
-        if not success:
-            raise ValueError("InputReader.itemize -- Invalid file '%s'" % fileName)
+            llist = self._itemize(fileName, key, source)
+        finally:
+            source.close()
+        timeEnd = time.time()
+        if DEBUG >= 1:
+            print('%s.itemize -- Method finished in %.3f s, %d item(s)' % (type(self).__name__,
+                                                                          (timeEnd - timeStart),
+                                                                          len(llist)))
+        return llist
+
+    def _itemize(self, fileName, key, source):
+        """
+        :param str fileName: File name including absolute path to the file
+        :param str key: Key for the items, i.e. the file name without its path
+        :param source: Opened source as returned by _srcType
+
+        Converts the content of the file into items. All state must be kept local to the call.
+        :func:`InputReader._itemize` must be reimplemented in every child class.
+        """
+        raise NotImplementedError('InputReader._itemize -- Do not instantiate base class')
+
+
+class EdfFrame(LazyArray):
+    __doc__ = """:class:`Items.LazyArray` describing a single frame of an EDF file. Uncompressed frames are
+    exposed as a read-only numpy.memmap over the binary block of the frame, compressed frames are read
+    using PyMca's EdfFile.
+
+    .. py:attribute:: fileName
+
+        Absolute path to the EDF file
+
+    .. py:attribute:: offset
+
+        Byte offset of the binary block within the file
+
+    .. py:attribute:: index
+
+        Number of the frame in the EDF file
+
+    .. py:attribute:: compressed
+
+        True if the binary block is compressed"""
+
+    def __init__(self, fileName, offset, shape, dtype, index=0, compressed=False):
+        LazyArray.__init__(self, shape, dtype)
+        self.fileName = fileName
+        self.offset = offset
+        self.index = index
+        self.compressed = compressed
+
+    def load(self):
+        if self.compressed:
+            arr = EdfFile(self.fileName, 'rb').GetData(self.index)
+            return np.ascontiguousarray(arr, arr.dtype)
+        return np.memmap(
+            self.fileName,
+            dtype=self.dtype,
+            mode='r',
+            offset=self.offset,
+            shape=self.shape)
+
+
+def _openBinary(fileName):
+    return open(fileName, 'rb')
 
 
 class EdfReader(InputReader):
+    fileType = IODict.EDF_TYPE
+    extensions = ('.edf',)
+
     def __init__(self):
         super(EdfReader, self).__init__()
-        self._srcType = EdfFile
+        self._srcType = _openBinary
 
-    def itemize(self, fileName):
-        timeStart = time.time()
-        InputReader.itemize(self, fileName)
+    @staticmethod
+    def sniff(head):
+        head = head.lstrip()
+        return head.startswith(b'{') and b'=' in head and b';' in head
+
+    @staticmethod
+    def readHeader(fileHandle):
+        """
+        :param file fileHandle: Binary file handle positioned at the start of an EDF header
+
+        Reads the EDF header at the current position of the file handle and leaves the handle positioned at the
+        start of the binary block that follows the header.
+
+        :returns: Header values and the byte offset of the binary block, None if the end of the file is reached
+        :rtype: tuple or None
+        :raises ValueError: If there is no EDF header at the current position
+        """
+        raw = fileHandle.read(EDF_BLOCKSIZE)
+        if not raw.strip(b' \t\r\n\x00'):
+            return None
+        start = raw.find(b'{')
+        if start < 0 or raw[:start].strip():
+            raise ValueError('EdfReader.readHeader -- No EDF header found')
+        end = raw.find(b'}', start)
+        while end < 0:
+            block = fileHandle.read(EDF_BLOCKSIZE)
+            if not block:
+                raise ValueError('EdfReader.readHeader -- Unterminated EDF header')
+            raw += block
+            end = raw.find(b'}', start)
+        newline = raw.find(b'\n', end)
+        while newline < 0:
+            block = fileHandle.read(EDF_BLOCKSIZE)
+            if not block:
+                newline = len(raw) - 1
+                break
+            raw += block
+            newline = raw.find(b'\n', end)
+        offset = fileHandle.tell() - len(raw) + newline + 1
+
+        header = {}
+        for line in raw[start+1:end].decode('latin-1').split(';'):
+            if '=' not in line:
+                continue
+            key, value = line.split('=', 1)
+            header[key.strip()] = value.strip()
+        fileHandle.seek(offset)
+        return header, offset
+
+    @staticmethod
+    def frameDescription(fileName, header, offset, index=0):
+        """
+        :param str fileName: Absolute path to the EDF file
+        :param dict header: EDF header of the frame
+        :param int offset: Byte offset of the binary block of the frame
+        :param int index: Number of the frame in the file
+
+        :returns: Placeholder for the frame data and the size of the binary block in bytes
+        :rtype: tuple
+        :raises ValueError: If the header does not describe the data
+        """
+        ddict = dict((key.lower(), value) for key, value in header.items())
+        try:
+            dims = [int(ddict['dim_%d' % idx]) for idx in range(1, 4) if ('dim_%d' % idx) in ddict]
+            dataType = EDF_DATATYPES[ddict['datatype'].lower()]
+        except (KeyError, ValueError):
+            raise ValueError("EdfReader.frameDescription -- Incomplete header in '%s'" % fileName)
+        byteOrder = EDF_BYTEORDERS.get(ddict.get('byteorder', 'LowByteFirst').lower(), '<')
+        dtype = np.dtype(byteOrder + dataType)
+        shape = tuple(reversed(dims))
+        size = int(ddict.get('size', int(np.prod(shape)) * dtype.itemsize))
+        compressed = ddict.get('compression', 'None').lower() not in ['none', 'nocompression']
+        frame = EdfFrame(fileName, offset, shape, dtype, index, compressed)
+        return frame, size
+
+    def indexFrames(self, fileHandle, fileName):
+        """
+        :param file fileHandle: Binary file handle of the EDF file
+        :param str fileName: Absolute path to the EDF file
+
+        Reads only the headers of all frames in the file, the binary blocks are skipped.
 
-        numImages = self.reader.GetNumImages()
+        :returns: List of 2-tuples containing the header and a :class:`EdfFrame` for every frame in the file
+        :rtype: list
+        """
+        llist = []
+        fileHandle.seek(0)
+        while True:
+            result = self.readHeader(fileHandle)
+            if result is None:
+                break
+            header, offset = result
+            frame, size = self.frameDescription(fileName, header, offset, len(llist))
+            llist += [(header, frame)]
+            fileHandle.seek(offset + size)
+        return llist
+
+    def _itemize(self, fileName, key, fileHandle):
+        frameList = self.indexFrames(fileHandle, fileName)
+
+        numImages = len(frameList)
         llist = []
         if numImages > 1:
-            raise NotImplementedError('EdfReader.itemize -- No support for edfs containing multiple images')
-            #for idx in range(numImages):
-            #    arr = reader.GetData(idx)
-            #    newItem = ImageItem(
-            #        key=key,
-            #        header=reader.GetHeader(0),
-            #        array=np.ascontiguousarray(arr, arr.dtype),
-            #        fileLocation=reader.FileName
-            #    )
-        else:
-            arr = self.reader.GetData(0)
+            #
+            # Frames are only read when accessed through the stack
+            #
+            newItem = StackItem(
+                key=key,
+                header=frameList[0][0],
+                array=[frame for header, frame in frameList],
+                fileLocation=fileName)
+            newItem.frameHeaders = [header for header, frame in frameList]
+            llist += [newItem]
+        elif numImages == 1:
+            header, frame = frameList[0]
             newItem = ImageItem(
-                key=self.key,
-                header=self.reader.GetHeader(0),
-                array=np.ascontiguousarray(arr, arr.dtype),
-                fileLocation=self.reader.FileName)
+                key=key,
+                header=header,
+                array=frame,
+                fileLocation=fileName)
             llist += [newItem]
-
-        timeEnd = time.time()
-        if DEBUG >= 1:
-            print('EdfInputReader.itemize -- Method finished in %.3f s' % (timeEnd - timeStart))
         return llist
 
 
 class RawReader(InputReader):
+    fileType = IODict.DAT_TYPE
+    extensions = ('.dat',)
+
     def __init__(self):
         super(RawReader, self).__init__()
-        self._srcType = open
+        self._srcType = _openBinary
 
-    def itemize(self, fileName):
-        #raise NotImplementedError('Shit ain\'t ready yet..')
-        timeStart = time.time()
-        InputReader.itemize(self, fileName)
+    @staticmethod
+    def sniff(head, comment=b'#'):
+        """
+        Recognizes a block of at least two lines of numbers with equal number of columns. Comments and blank
+        lines may be interspersed, but once the block started, every line must belong to it. Header lines
+        preceding the block are ignored (c.f. :func:`RawReader.parse`).
+        """
+        if b'\x00' in head:
+            # Binary data
+            return False
+        lines = head.replace(b'\r', b'\n').split(b'\n')
+        if len(lines) > 1 and len(head) >= IODict.SNIFF_SIZE:
+            # Last line might be truncated
+            lines = lines[:-1]
+        nCols, nRows = None, 0
+        for line in lines:
+            line = line.split(comment, 1)[0].strip()
+            if not line:
+                continue
+            if not RawReader._isNumeric(line):
+                if nCols is None:
+                    # Header line
+                    continue
+                return False
+            if nCols is None:
+                nCols = len(line.split())
+            elif len(line.split()) != nCols:
+                return False
+            nRows += 1
+        return nRows >= 2
+
+    @staticmethod
+    def _isNumeric(line):
+        try:
+            [float(number) for number in line.split()]
+        except ValueError:
+            return False
+        return True
+
+    @staticmethod
+    def parse(raw, comment=b'#'):
+        """
+        :param bytes raw: Content of a plain text file
+        :param bytes comment: Everything from this prefix up to the end of a line is skipped
 
-        if self.reader.closed:
-            raise IOError('RawReader -- File handler is closed')
+        Converts whitespace separated columns of numbers into a two dimensional array. Line endings of all
+        platforms are accepted. Comments, including comments trailing the numbers of a line, as well as header
+        lines preceding the first line of numbers are skipped. The numbers themselves are converted in bulk by
+        numpy, the number of columns is checked for every line.
+
+        :returns: Array of shape (nRows, nCols) or None if raw does not contain any numbers
+        :rtype: ndarray or None
+        :raises ValueError: If the rows differ in their number of columns or contain non-numeric values
+        """
+        raw = raw.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
 
         #
-        # Guess key
+        # Skip header lines up to the first line of numbers
         #
-        key = OsPathSplit(fileName)[-1]
-        if DEBUG >= 1:
-            print("RawReader -- key: '%s'" % key)
+        pos, firstLine = 0, None
+        while pos < len(raw):
+            end = raw.find(b'\n', pos)
+            if end < 0:
+                end = len(raw)
+            line = raw[pos:end].split(comment, 1)[0].strip()
+            if line and RawReader._isNumeric(line):
+                firstLine = line
+                break
+            pos = end + 1
+        if firstLine is None:
+            return None
+        body = raw[pos:]
+        if comment in body:
+            body = re.sub(re.escape(comment) + b'[^\n]*', b'', body)
+        body = BLANKLINES.sub(b'', body.strip())
+        nCols = len(firstLine.split())
+
+        try:
+            data = np.fromstring(body, dtype=np.float64, sep=' ')
+        except ValueError:
+            raise ValueError('RawReader.parse -- Non-numeric value in data block')
+        columns = RawReader._fieldCount(body)
+        if data.size != columns.sum() or (columns != nCols).any():
+            raise ValueError('RawReader.parse -- Rows differ in their number of columns')
+        return data.reshape(-1, nCols)
+
+    @staticmethod
+    def _fieldCount(body):
+        """
+        :param bytes body: Lines of whitespace separated fields without empty lines
+
+        :returns: Number of fields in every line
+        :rtype: ndarray
+        """
+        chars = np.frombuffer(body, dtype=np.uint8)
+        # Whitespace and control characters separate the fields
+        isField = chars > ord(b' ')
+        starts = np.flatnonzero(isField[1:] & ~isField[:-1]) + 1
+        if len(isField) and isField[0]:
+            starts = np.concatenate(([0], starts))
+        newlines = np.flatnonzero(chars == ord(b'\n'))
+        return np.bincount(np.searchsorted(newlines, starts), minlength=len(newlines) + 1)
 
-        raw = self.reader.read()
-        raw = raw.strip().split(NEWLINE)
+    def _itemize(self, fileName, key, fileHandle):
         if DEBUG >= 1:
-            print("RawReader -- raw: %s" % str(raw))
+            print("RawReader -- key: '%s'" % key)
 
-        if not len(raw):
+        data = self.parse(fileHandle.read())
+        if data is None:
             if DEBUG >= 1:
                 print('RawReader.itemize -- Received empty file')
             return []
-
-        #
-        # Try to determine the number of columns
-        #
-        nRows = len(raw)
         if DEBUG >= 1:
-            print('RawReader.itemize -- Determined %d rows' % nRows)
-
-        #
-        # Try to determine the number of columns
-        #
-        nCols = len(raw[0].split())
-        if DEBUG >= 1:
-            print('RawReader.itemize -- Determined %d columns' % nCols)
-
-        data = np.zeros((nRows, nCols))
-
-        for idx, line in enumerate(raw):
-            iterator = [float(number.strip()) for number in line.split()]  # is list even in python3(.2.3)
-            data[idx, :] = np.fromiter(iterator, dtype=float)
+            print('RawReader.itemize -- Determined %d rows, %d columns' % data.shape)
         data = np.squeeze(data.T)
 
         if DEBUG >= 1:
@@ -230,19 +676,14 @@ class RawReader(InputReader):
             item = ScanItem(
                 key=key,
                 header='',
-                array=data[1],
+                array=np.ascontiguousarray(data[1]),
                 fileLocation=fileName
             )
             item.setScale(np.copy(data[0]))
         else:
             raise ValueError('RawReader.itemize -- Unexpected dimensionality')
 
-        llist = [item]
-
-        timeEnd = time.time()
-        if DEBUG >= 1:
-            print('RawReader.itemize -- Method finished in %.3f s, item %s' % ((timeEnd - timeStart), str(item)))
-        return llist
+        return [item]
 
 
 def unitTest_RawReader():
@@ -252,6 +693,803 @@ def unitTest_RawReader():
     reader.itemize(fname)
 
 
+class SpecScanBlock(object):
+    __doc__ = """Byte range of the data lines of a single scan in a SPEC file. The data is parsed on first
+    access and shared by all columns of the scan.
+
+    .. py:attribute:: fileName
+
+        Absolute path to the SPEC file
+
+    .. py:attribute:: start
+
+        Byte offset of the first data line
+
+    .. py:attribute:: stop
+
+        Byte offset of the end of the scan
+
+    .. py:attribute:: nCols
+
+        Number of columns as given in the scan header
+
+    .. py:attribute:: labels
+
+        List of column labels as given in the scan header"""
+
+    def __init__(self, fileName, start, stop, nCols, labels=None, rowCount=None):
+        """
+        :param int rowCount: Number of data lines if known in advance. Default: None, i.e. the lines are counted
+         on first access of :func:`SpecScanBlock.rowCount`
+        """
+        self.fileName = fileName
+        self.start = start
+        self.stop = stop
+        self.nCols = nCols
+        self.labels = labels if labels is not None else []
+        self._rowCount = rowCount
+        self._data = None
+
+    def _read(self):
+        """
+        :returns: Lines of the scan without MCA data
+        :rtype: bytes
+        """
+        with open(self.fileName, 'rb') as fileHandle:
+            fileHandle.seek(self.start)
+            raw = fileHandle.read(self.stop - self.start)
+        if b'@' in raw:
+            raw = SPEC_MCALINES.sub(b'', raw)
+        return raw
+
+    def rowCount(self):
+        """
+        :returns: Number of data lines in the scan, determined without converting the data
+        :rtype: int
+        """
+        if self._rowCount is None:
+            if self._data is not None:
+                self._rowCount = len(self._data)
+            else:
+                self._rowCount = len(SPEC_DATALINE.findall(self._read()))
+        return self._rowCount
+
+    def data(self):
+        """
+        :returns: Data of the scan
+        :rtype: ndarray of shape (nRows, nCols)
+        """
+        if self._data is None:
+            data = RawReader.parse(self._read())
+            if data is None:
+                data = np.zeros(shape=(0, self.nCols), dtype=np.float64)
+            self._data = data
+        return self._data
+
+
+class SpecColumn(LazyArray):
+    __doc__ = """:class:`Items.LazyArray` describing a single column of a scan in a SPEC file.
+
+    .. py:attribute:: block
+
+        :class:`SpecScanBlock` containing the column
+
+    .. py:attribute:: column
+
+        Index of the column in the block"""
+
+    def __init__(self, block, column):
+        self.block = block
+        self.column = column
+        self.dtype = np.dtype(np.float64)
+
+    @property
+    def shape(self):
+        return self.block.rowCount(),
+
+    def load(self):
+        return self.block.data()[:, self.column]
+
+
+class SpecReader(InputReader):
+    __doc__ = """Reader for SPEC files. While itemizing, the file is scanned once for the start of every scan and
+    the scan headers. The data of a scan is only read when it is accessed."""
+    fileType = IODict.SPEC_TYPE
+    extensions = ('.spec',)
+
+    def __init__(self):
+        super(SpecReader, self).__init__()
+        self._srcType = _openBinary
+
+    @staticmethod
+    def sniff(head):
+        return SPEC_FILEHEADER.search(head) is not None
+
+    @staticmethod
+    def parseHeader(raw):
+        """
+        :param bytes raw: Header lines of a scan
+
+        :returns: Dictionary containing the header lines without the leading '#' ordered by their tag. Tags that
+         occur more than once are joined by newlines.
+        :rtype: dict
+        """
+        header = {}
+        for line in raw.decode('latin-1').splitlines():
+            if not line.startswith('#'):
+                continue
+            parts = line[1:].split(None, 1)
+            if not parts:
+                continue
+            tag = parts[0]
+            value = parts[1].strip() if len(parts) > 1 else ''
+            if tag in header:
+                header[tag] += '\n' + value
+            else:
+                header[tag] = value
+        return header
+
+    def indexScans(self, fileHandle, fileName):
+        """
+        :param file fileHandle: Binary file handle of the SPEC file
+        :param str fileName: Absolute path to the SPEC file
+
+        Determines the byte offsets of all scans in the file together with their headers, the data lines
+        are skipped.
+
+        :returns: List of 3-tuples containing the byte offset, the header and a :class:`SpecScanBlock` for
+         every scan
+        :rtype: list
+        """
+        llist = []
+        fileHandle.seek(0, 2)
+        size = fileHandle.tell()
+        if not size:
+            return llist
+        memoryMap = MemoryMap(fileHandle.fileno(), 0, access=MMAP_ACCESS_READ)
+        try:
+            starts = [0] if memoryMap[:3] == b'#S ' else []
+            pos = memoryMap.find(b'\n#S ')
+            while pos >= 0:
+                starts += [pos + 1]
+                pos = memoryMap.find(b'\n#S ', pos + 1)
+            for idx, start in enumerate(starts):
+                stop = starts[idx+1] if (idx + 1) < len(starts) else size
+                match = SPEC_DATALINE.search(memoryMap, start, stop)
+                dataStart = match.start() if match else stop
+                header = self.parseHeader(memoryMap[start:dataStart])
+                labels = SPEC_LABELS.split(header.get('L', '').strip()) if header.get('L') else []
+                try:
+                    nCols = int(header.get('N', '').split()[0])
+                except (IndexError, ValueError):
+                    nCols = len(labels)
+                llist += [(start, header, SpecScanBlock(fileName, dataStart, stop, nCols, labels))]
+        finally:
+            memoryMap.close()
+        return llist
+
+    def _itemize(self, fileName, fileKey, fileHandle):
+        scanList = self.indexScans(fileHandle, fileName)
+
+        llist = []
+        orders = {}
+        for offset, header, block in scanList:
+            number = header['S'].split()[0] if header['S'] else '0'
+            orders[number] = orders.get(number, 0) + 1
+            key = '%s %s.%d' % (fileKey, number, orders[number])
+            if block.nCols > 1:
+                #
+                # Zero-th column is used as scale and the last column, i.e. the detector, as data
+                #
+                item = ScanItem(
+                    key=key,
+                    header=header,
+                    array=SpecColumn(block, block.nCols - 1),
+                    fileLocation=fileName
+                )
+                item.setScale(SpecColumn(block, 0))
+            else:
+                item = SpecItem(
+                    key=key,
+                    header=header,
+                    array=SpecColumn(block, 0),
+                    fileLocation=fileName
+                )
+            llist += [item]
+        return llist
+
+
+#
+# Built-in readers in the order in which they identify files
+#
+IODict.register(EdfReader)
+IODict.register(SpecReader)
+IODict.register(RawReader)
+
+
+#
+# Project files
+#
+class Hdf5Array(LazyArray):
+    __doc__ = """:class:`LazyArray` referencing a dataset in a HDF5 file. Shape and data type are taken from the
+    dataset, the data is only read by :func:`Hdf5Array.load`.
+
+    .. py:attribute:: fileName
+
+        Absolute path to the HDF5 file
+
+    .. py:attribute:: path
+
+        Path of the dataset inside the file
+
+    .. py:attribute:: index
+
+        Index of a single frame in the dataset. None if the whole dataset is referenced"""
+
+    def __init__(self, fileName, path, shape, dtype, index=None):
+        LazyArray.__init__(self, shape, dtype)
+        self.fileName = fileName
+        self.path = path
+        self.index = index
+
+    @staticmethod
+    def fromDataset(fileName, dataset):
+        """
+        :param str fileName: Absolute path to the HDF5 file
+        :param h5py.Dataset dataset: Dataset to reference
+        :returns: Placeholder for the whole dataset
+        :rtype: Hdf5Array
+        """
+        return Hdf5Array(fileName, dataset.name, dataset.shape, dataset.dtype)
+
+    def load(self):
+        with h5py.File(self.fileName, 'r') as fileHandle:
+            if self.index is None:
+                return fileHandle[self.path][()]
+            return fileHandle[self.path][self.index]
+
+
+class Hdf5Project(object):
+    __doc__ = """Writes the tree of :class:`ItemContainer.ItemContainer` instances of a project to a single HDF5
+    file and restores it. Every container is stored as group carrying the label of the container. Its children are
+    stored as groups in the subgroup 'children', named by their position, its item in the subgroup 'item'
+    (c.f. :func:`Items.ProjectItem.hdf5Dump`).
+
+    Restoring the tree does not read any array data. All arrays are replaced by :class:`Hdf5Array` placeholders
+    that read the data once it is accessed."""
+
+    ITEM_CLASSES = dict((itemClass.__name__, itemClass) for itemClass in
+                        [DataItem, SpecItem, ScanItem, ImageItem, StackItem, FunctionItem])
+    FORMAT_VERSION = 1
+
+    @staticmethod
+    def dump(root, fileName):
+        """
+        :param ItemContainer root: Root of the tree
+        :param str fileName: Name of the project file
+
+        The tree is written to a temporary file that replaces fileName once the tree is written completely. Items
+        that were restored from fileName are thereby still readable while the file is written.
+
+        :raises ImportError: if h5py is not available
+        """
+        if h5py is None:
+            raise ImportError('Hdf5Project.dump -- Project files require h5py')
+        tmpName = fileName + '.tmp'
+        try:
+            with h5py.File(tmpName, 'w') as fileHandle:
+                fileHandle.attrs['formatVersion'] = Hdf5Project.FORMAT_VERSION
+                Hdf5Project._dumpContainer(root, fileHandle.create_group('project'))
+            OsReplace(tmpName, fileName)
+        finally:
+            if OsPathExists(tmpName):
+                OsRemove(tmpName)
+
+    @staticmethod
+    def _dumpContainer(container, group):
+        group.attrs['label'] = container.label
+        if container.hasItem():
+            container.item().hdf5Dump(group.create_group('item'))
+        childGroup = group.create_group('children')
+        for idx, child in enumerate(container.children):
+            Hdf5Project._dumpContainer(child, childGroup.create_group(str(idx)))
+
+    @staticmethod
+    def load(fileName):
+        """
+        :param str fileName: Name of the project file
+        :returns: Root of the restored tree
+        :rtype: ItemContainer
+        :raises ImportError: if h5py is not available
+        :raises ValueError: if the file is not a project file
+        """
+        if h5py is None:
+            raise ImportError('Hdf5Project.load -- Project files require h5py')
+        fileName = OsAbsPath(fileName)
+        with h5py.File(fileName, 'r') as fileHandle:
+            if 'project' not in fileHandle:
+                raise ValueError("Hdf5Project.load -- '%s' is not a project file" % fileName)
+            return Hdf5Project._loadContainer(fileHandle['project'], None, fileName)
+
+    @staticmethod
+    def _loadContainer(group, parent, fileName):
+        item = Hdf5Project.loadItem(group['item'], fileName) if 'item' in group else None
+        container = ItemContainer(item=item, parent=parent, label=str(group.attrs['label']))
+        childGroup = group['children']
+        container.addChildren([Hdf5Project._loadContainer(childGroup[name], container, fileName)
+                               for name in sorted(childGroup.keys(), key=int)])
+        return container
+
+    @staticmethod
+    def _loadHeader(group, name):
+        if name in group:
+            return dict((attr, Hdf5Project._attrValue(value)) for attr, value in group[name].attrs.items())
+        return str(group.attrs.get(name, ''))
+
+    @staticmethod
+    def _attrValue(value):
+        if isinstance(value, np.generic):
+            return value.item()
+        if isinstance(value, bytes) and not isinstance(value, str):
+            return value.decode('utf-8')
+        return value
+
+    @staticmethod
+    def _loadArray(group, name, fileName):
+        if name not in group:
+            return None
+        return Hdf5Array.fromDataset(fileName, group[name])
+
+    @staticmethod
+    def loadItem(group, fileName):
+        """
+        :param h5py.Group group: Group written by :func:`Items.ProjectItem.hdf5Dump`
+        :param str fileName: Absolute path to the project file
+
+        :returns: Restored item. Its data is referenced by :class:`Hdf5Array` placeholders
+        :rtype: ProjectItem
+        :raises TypeError: if the item class is unknown
+        :raises ValueError: if the expression of a function is not allowed (c.f. :func:`Items.compileExpression`)
+        """
+        className = str(group.attrs['class'])
+        if className not in Hdf5Project.ITEM_CLASSES:
+            raise TypeError("Hdf5Project.loadItem -- Unknown item class '%s'" % className)
+        itemClass = Hdf5Project.ITEM_CLASSES[className]
+        key = str(group.attrs['key'])
+        header = Hdf5Project._loadHeader(group, 'header')
+
+        if itemClass is FunctionItem:
+            item = FunctionItem(key, header)
+            item.setExpression(str(group.attrs['expression']))
+            item.setParameters(dict((name, Hdf5Project._attrValue(value))
+                                    for name, value in group['parameters'].attrs.items()))
+            return item
+
+        fileLocation = str(group.attrs.get('fileLocation', ''))
+        if itemClass is StackItem:
+            dataset = group['array']
+            frames = [Hdf5Array(fileName, dataset.name, dataset.shape[1:], dataset.dtype, idx)
+                      for idx in range(dataset.shape[0])]
+            item = StackItem(key, header, frames, fileLocation)
+            if 'frameHeaders' in group:
+                headerGroup = group['frameHeaders']
+                names = set(headerGroup.keys()) | set(headerGroup.attrs.keys())
+                item.frameHeaders = [Hdf5Project._loadHeader(headerGroup, name)
+                                     for name in sorted(names, key=int)]
+            return item
+
+        item = itemClass(key, header, Hdf5Project._loadArray(group, 'array', fileName), fileLocation)
+        if itemClass is ScanItem and 'scale' in group:
+            if isinstance(group['scale'], h5py.Group):
+                item.setScale(Hdf5Project.loadItem(group['scale'], fileName))
+            else:
+                item.setScale(Hdf5Project._loadArray(group, 'scale', fileName))
+        elif itemClass is ImageItem:
+            item.scaleX = Hdf5Project._loadArray(group, 'scaleX', fileName)
+            item.scaleY = Hdf5Project._loadArray(group, 'scaleY', fileName)
+        return item
+
+
+#
+# Export of spectra
+#
+def spectrumData(item):
+    """
+    :param DataItem item: :class:`Items.ScanItem` or :class:`Items.SpecItem`
+
+    SpecItems do not provide a scale, the pixel number is used instead.
+
+    :returns: Two column array containing scale and counts
+    :rtype: ndarray
+    :raises NotImplementedError: if the item type is unknown or the data is not one dimensional
+    """
+    if isinstance(item, ScanItem):
+        counts = item.array
+        scale = item.scale()
+    elif isinstance(item, SpecItem):
+        counts = item.array
+        scale = None
+    else:
+        raise NotImplementedError('spectrumData -- Unknown item type: %s' % type(item))
+    if counts.ndim != 1:
+        raise NotImplementedError('spectrumData -- Can only write one dimensional spectra')
+    if scale is None:
+        scale = np.arange(len(counts), dtype=counts.dtype)
+    return np.vstack((scale, counts)).T
+
+
+class OutputWriter(object):
+    __doc__ = """Base class of all spectrum writers. A writer opens a single output file, receives the spectra
+    scan by scan and writes every scan to disk as soon as it is received. The writer therefore never holds more
+    than a single scan in memory.
+
+    .. py:attribute:: fileType
+
+        Name of the format the writer produces
+
+    .. py:attribute:: labels
+
+        Column labels written for every scan"""
+    fileType = None
+    labels = ['PixelNo', 'Counts']
+
+    def __init__(self, fileName, comment=''):
+        """
+        :param str fileName: File name including absolute path to the file
+        :param str comment: Comment stored in the header of the file
+        """
+        self.fileName = fileName
+        self.comment = comment if comment else ''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def scanHeader(self, scanNo, item):
+        """
+        :param int scanNo: Number of the scan in the file
+        :param DataItem item: Item the scan is taken from
+
+        :returns: SPEC style header lines of the scan
+        :rtype: list
+        """
+        return ['#S %d %s' % (scanNo, item.key()),
+                '#N %d' % len(self.labels),
+                '#L %s' % '  '.join(self.labels)]
+
+    def writeScan(self, scanNo, item):
+        """
+        Must be reimplemented in every child class.
+
+        :param int scanNo: Number of the scan in the file
+        :param DataItem item: Item to write
+        """
+        raise NotImplementedError('OutputWriter.writeScan -- Do not instantiate base class')
+
+    def close(self):
+        raise NotImplementedError('OutputWriter.close -- Do not instantiate base class')
+
+
+class SpecWriter(OutputWriter):
+    __doc__ = """Writes spectra as scans of a SPEC file through a buffered file handle"""
+    fileType = IODict.SPEC_TYPE
+
+    BUFFERSIZE = 1 << 20
+
+    def __init__(self, fileName, comment=''):
+        OutputWriter.__init__(self, fileName, comment)
+        self._fileHandle = open(fileName, 'wb', SpecWriter.BUFFERSIZE)
+        lines = ['#F %s' % OsPathSplit(fileName)[1]]
+        lines += ['#C %s' % line for line in self.comment.splitlines()]
+        self._write(lines)
+
+    def _write(self, lines):
+        self._fileHandle.write(('\n'.join(lines) + '\n').encode('utf-8'))
+
+    def writeScan(self, scanNo, item):
+        data = spectrumData(item)
+        self._write([''] + self.scanHeader(scanNo, item))
+        np.savetxt(self._fileHandle, data, fmt='%.6f', delimiter=' ', newline='\n')
+
+    def close(self):
+        self._fileHandle.close()
+
+
+class NpzWriter(OutputWriter):
+    __doc__ = """Writes spectra to a numpy .npz archive. Scan n is stored in the arrays 'n.data' and 'n.header',
+    the latter holding the SPEC style header lines of the scan. Every scan is compressed and added to the
+    archive on its own."""
+    fileType = IODict.NPZ_TYPE
+
+    def __init__(self, fileName, comment=''):
+        OutputWriter.__init__(self, fileName, comment)
+        self._archive = ZipFile(fileName, 'w', ZIP_DEFLATED, allowZip64=True)
+        if self.comment:
+            self._writeArray('comment', np.array(self.comment.splitlines()))
+
+    def _writeArray(self, name, array):
+        buf = BytesIO()
+        np.lib.format.write_array(buf, np.asanyarray(array))
+        self._archive.writestr(name + '.npy', buf.getvalue())
+
+    def writeScan(self, scanNo, item):
+        data = spectrumData(item)
+        self._writeArray('%d.header' % scanNo, np.array(self.scanHeader(scanNo, item)))
+        self._writeArray('%d.data' % scanNo, data)
+
+    def close(self):
+        self._archive.close()
+
+
+class Hdf5Writer(OutputWriter):
+    __doc__ = """Writes spectra to a HDF5 file, one group per scan named as in the SPEC file ('n.1'). Requires h5py."""
+    fileType = IODict.HDF5_TYPE
+
+    def __init__(self, fileName, comment=''):
+        if h5py is None:
+            raise ImportError('Hdf5Writer.__init__ -- Export to HDF5 requires h5py')
+        OutputWriter.__init__(self, fileName, comment)
+        self._file = h5py.File(fileName, 'w')
+        if self.comment:
+            self._file.attrs['comment'] = self.comment
+
+    def writeScan(self, scanNo, item):
+        data = spectrumData(item)
+        group = self._file.create_group('%d.1' % scanNo)
+        group.attrs['title'] = self.scanHeader(scanNo, item)[0]
+        group.attrs['key'] = item.key()
+        group.attrs['labels'] = np.array(self.labels, dtype='S')
+        group.create_dataset('data', data=data)
+
+    def close(self):
+        self._file.close()
+
+
+class SpectraExporter(object):
+    __doc__ = """Streams a list of spectra to disk, either into a single file or into one file per spectrum. The
+    output format is determined by the extension of the file name (c.f. :py:attr:`EXTENSIONS`), unknown
+    extensions are written as SPEC files. The exporter does not depend on the GUI.
+
+    .. py:attribute:: workers
+
+        Number of files written concurrently if every spectrum is written to a file of its own"""
+
+    WRITERS = {
+        IODict.SPEC_TYPE: SpecWriter,
+        IODict.NPZ_TYPE: NpzWriter,
+        IODict.HDF5_TYPE: Hdf5Writer
+    }
+
+    EXTENSIONS = {
+        '.npz': IODict.NPZ_TYPE,
+        '.h5': IODict.HDF5_TYPE,
+        '.hdf5': IODict.HDF5_TYPE,
+        '.hdf': IODict.HDF5_TYPE,
+        '.nxs': IODict.HDF5_TYPE
+    }
+
+    def __init__(self, workers=1):
+        self.workers = workers
+
+    @staticmethod
+    def fileType(fileName):
+        """
+        :param str fileName: Name of the output file
+        :returns: Output format derived from the extension of the file name
+        :rtype: str
+        """
+        ext = OsPathSplitext(fileName)[1].lower()
+        return SpectraExporter.EXTENSIONS.get(ext, IODict.SPEC_TYPE)
+
+    @staticmethod
+    def numberedFileNames(fileName, count):
+        """
+        :param str fileName: Name of the output file
+        :param int count: Number of files
+
+        :returns: File names carrying the zero padded index of the spectrum in front of the extension
+        :rtype: list
+        """
+        path, ext = OsPathSplitext(fileName)
+        width = len(str(count))
+        return ['{path}_{idx:0>{width}}{ext}'.format(path=path, idx=idx, width=width, ext=ext)
+                for idx in range(count)]
+
+    def export(self, fileName, itemList, singleFile=True, comment=''):
+        """
+        :param str fileName: Name of the output file
+        :param list itemList: :class:`Items.ScanItem` or :class:`Items.SpecItem` instances to write
+        :param bool singleFile: If False, every spectrum is written to a numbered file of its own
+        :param str comment: Comment stored in the header of every file
+
+        :returns: Names of the files written
+        :rtype: list
+        """
+        writerClass = SpectraExporter.WRITERS[SpectraExporter.fileType(fileName)]
+        if singleFile:
+            with writerClass(fileName, comment) as writer:
+                for idx, item in enumerate(itemList):
+                    writer.writeScan(idx + 1, item)
+            fileNameList = [fileName]
+        else:
+            fileNameList = SpectraExporter.numberedFileNames(fileName, len(itemList))
+
+            def write(args):
+                numberedName, item = args
+                with writerClass(numberedName, comment) as writer:
+                    writer.writeScan(1, item)
+
+            if self.workers > 1 and len(itemList) > 1:
+                pool = ThreadPool(self.workers)
+                try:
+                    pool.map(write, zip(fileNameList, itemList))
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                for args in zip(fileNameList, itemList):
+                    write(args)
+        if DEBUG >= 1:
+            print('SpectraExporter.export -- Wrote %d spectra to %d file(s)' % (len(itemList), len(fileNameList)))
+        return fileNameList
+
+
+def benchmark_RawReader(nRows=100000, nCols=2):
+    """
+    Compares the bulk parser of :class:`RawReader` to the former line by line parser on a spectrum
+    with nRows rows.
+    """
+    from tempfile import mkstemp
+    from os import close as OsClose, remove as OsRemove
+
+    def lineByLine(fileName):
+        with open(fileName) as fileHandle:
+            raw = fileHandle.read().strip().split(NEWLINE)
+        data = np.zeros((len(raw), len(raw[0].split())))
+        for idx, line in enumerate(raw):
+            iterator = [float(number.strip()) for number in line.split()]
+            data[idx, :] = np.fromiter(iterator, dtype=float)
+        return np.squeeze(data.T)
+
+    handle, fileName = mkstemp(suffix='.dat')
+    OsClose(handle)
+    reference = np.random.random((nRows, nCols)) * 1000.
+    np.savetxt(fileName, reference, fmt='%.6f')
+    try:
+        timeStart = time.time()
+        legacy = lineByLine(fileName)
+        timeLegacy = time.time() - timeStart
+
+        timeStart = time.time()
+        item = RawReader().itemize(fileName)[0]
+        timeBulk = time.time() - timeStart
+    finally:
+        OsRemove(fileName)
+
+    success = np.allclose(legacy[1], item.array) and np.allclose(legacy[0], item.scale())
+    print('RawReader.benchmark -- %d rows, %d columns' % (nRows, nCols))
+    print('\tline by line: %.3f s' % timeLegacy)
+    print('\tbulk:         %.3f s (speedup: %.1f)' % (timeBulk, timeLegacy / timeBulk))
+    print('\tresults identical: %s' % str(success))
+    return success
+
+
+def unitTest_RawReaderParse():
+    """
+    Checks that :func:`RawReader.parse` strips comments and rejects ragged or non-numeric data blocks.
+    """
+    success = True
+    data = RawReader.parse(b'#F header\n# comment\n1 2  # trailing\r\n3 4\n\n# inline\n5 6 #\n')
+    success &= data is not None and np.array_equal(data, [[1., 2.], [3., 4.], [5., 6.]])
+    success &= RawReader.parse(b'# no numbers\nlabel text\n') is None
+    for raw in [b'1 2\n3 4 5\n6\n', b'1 2 3\n4 5\n6 7 8\n', b'1 2\n3 x\n']:
+        try:
+            RawReader.parse(raw)
+            success = False
+        except ValueError:
+            pass
+    print('RawReader.unitTest -- %s' % ('Success' if success else 'Failure'))
+    return success
+
+
+def unitTest_SpecReader():
+    """
+    Reads a SPEC file whose scans contain MCA lines, including MCA data continued over several lines. The MCA
+    lines must neither be counted as rows nor show up in the data.
+    """
+    from tempfile import mkstemp
+    from os import close as OsClose
+
+    handle, fileName = mkstemp(suffix='.spec')
+    OsClose(handle)
+    with open(fileName, 'wb') as fileHandle:
+        fileHandle.write(b'#F test.spec\n\n'
+                         b'#S 1 ascan\n#N 2\n#L PixelNo  Counts\n#@MCA 8C\n'
+                         b'1 2\n@A 3 4 5 6\n5 6\n@A 7 8 \\\n 9 10\n9 10\n\n'
+                         b'#S 2 ascan\n#N 2\n#L PixelNo  Counts\n@A 1 1\n7 8\n')
+    try:
+        itemList = SpecReader().itemize(fileName)
+        success = len(itemList) == 2
+        success &= itemList[0].array.shape == (3,) and itemList[1].array.shape == (1,)
+        success &= np.array_equal(np.asarray(itemList[0].array), [2., 6., 10.])
+        success &= np.array_equal(np.asarray(itemList[0].scale()), [1., 5., 9.])
+        success &= np.array_equal(np.asarray(itemList[1].array), [8.])
+    finally:
+        OsRemove(fileName)
+    print('SpecReader.unitTest -- %s' % ('Success' if success else 'Failure'))
+    return success
+
+
+def stressTest_InputReader(numFiles=300, numThreads=16):
+    """
+    Loads numFiles EDF, SPEC and plain text files from numThreads threads at once, using a single set of
+    readers. Every item must carry the key and the data of the file it was read from.
+    """
+    from tempfile import mkdtemp
+    from shutil import rmtree
+    from os.path import join as OsPathJoin
+    from multiprocessing.pool import ThreadPool
+
+    directory = mkdtemp()
+    expected = {}
+    try:
+        for idx in range(numFiles):
+            kind = idx % 3
+            if kind == 0:
+                fileName = OsPathJoin(directory, 'image%04d.edf' % idx)
+                data = np.arange(64 * 32, dtype=np.uint16).reshape(64, 32) + idx
+                EdfFile(fileName, 'wb').WriteImage({'energy': str(930. + idx)}, data)
+                expected[fileName] = [('image%04d.edf' % idx, data)]
+            elif kind == 1:
+                fileName = OsPathJoin(directory, 'spectrum%04d.dat' % idx)
+                data = np.vstack((np.arange(100.), np.arange(100.) * idx)).T
+                np.savetxt(fileName, data, fmt='%.6f')
+                expected[fileName] = [('spectrum%04d.dat' % idx, data[:, 1])]
+            else:
+                fileName = OsPathJoin(directory, 'scans%04d.spec' % idx)
+                keys = []
+                with open(fileName, 'w') as fileHandle:
+                    for scanNo in range(1, 4):
+                        data = np.vstack((np.arange(50.), np.arange(50.) + idx * scanNo)).T
+                        fileHandle.write('#S %d scan\n#N 2\n#L PixelNo  Counts\n' % scanNo)
+                        np.savetxt(fileHandle, data, fmt='%.6f')
+                        fileHandle.write('\n')
+                        keys += [('scans%04d.spec %d.1' % (idx, scanNo), data[:, 1])]
+                expected[fileName] = keys
+
+        readers = IODict.inputReaderDict()
+
+        def read(fileName):
+            fileType = IODict.sniff(fileName, readers)
+            itemList = readers[fileType].itemize(fileName)
+            return fileName, [(item.key(), np.array(item.array)) for item in itemList]
+
+        timeStart = time.time()
+        pool = ThreadPool(numThreads)
+        try:
+            results = pool.map(read, sorted(expected.keys()))
+        finally:
+            pool.terminate()
+            pool.join()
+        timeEnd = time.time()
+    finally:
+        rmtree(directory)
+
+    success = True
+    for fileName, itemList in results:
+        reference = expected[fileName]
+        if len(itemList) != len(reference):
+            success = False
+            continue
+        for (key, data), (refKey, refData) in zip(itemList, reference):
+            success &= (key == refKey) and np.allclose(data, refData)
+    print('InputReader.stressTest -- %d files, %d threads: %.3f s' % (numFiles, numThreads, timeEnd - timeStart))
+    print('\t%s' % ('Success' if success else 'Failure'))
+    return success
+
+
 def unitTest_InputReader():
     #rixsImageDir = '/Users/tonn/DATA/rixs_data/Images'
     rixsImageDir = '/home/truter/lab/rixs/rixs_data/Images'
@@ -262,7 +1500,7 @@ def unitTest_InputReader():
 
     edfReader = EdfReader()
     for elem in sum([edfReader.itemize(fn) for fn in edfImageList], []):
-        print elem.key
+        print(elem.key())
     print(edfReader)
 
 if __name__ == '__main__':
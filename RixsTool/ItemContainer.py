@@ -26,22 +26,30 @@
 #############################################################################*/
 __author__ = "Tonn Rueter - ESRF Data Analysis Unit"
 
-from uuid import uuid4
+from itertools import count
+from collections import deque
 
 DEBUG = 0
 
+#
+# Source of the container identifiers
+#
+_identifiers = count()
+
 
 class ItemContainer(object):
     __doc__ = """The :class:`ItemContainer` class is the basic building block of a tree like data structure. Within
      the tree hierarchy a container can either be a node or a leave. Nodes have zero or more children, while leaves
      reference an instance of the class :py:class:`Items.ProjectItem`. Both uses of the item container can be
      distinguished using the :func:`hasItem` respectively :py:func:`hasChildren`. Every item container except for
-     the top most has a parent pointer and a unique identifier. The identifier can savely be assumed to be random and
-     is provided at the moment of instantiation by the :func:`uuid.uuid4`
+     the top most has a parent pointer and a unique identifier. The identifier is an integer that is increased with
+     every instantiation and is unique within the running process.
+
+     Containers are created in large numbers, they therefore use __slots__ instead of an instance dictionary.
 
-     .. py:attribute:: __identifier
+     .. py:attribute:: _identifier
 
-        Randomly generated identifier for the container
+        Unique integer identifier for the container
 
      .. py:attribute:: _item
 
@@ -50,7 +58,8 @@ class ItemContainer(object):
      .. py:attribute:: _data
 
         List containing the names of attributes of a :py:class:`Items.ProjectItem` that might be of interest for
-        a display (c.f. :py:class:`Models.ProjectView`)
+        a display (c.f. :py:class:`Models.ProjectView`). All containers share the list :py:attr:`COLUMNS` until
+        :func:`setData` is called on a container.
 
      .. py:attribute:: parent
 
@@ -58,19 +67,30 @@ class ItemContainer(object):
 
      .. py:attribute:: children
 
-        List of :class:`ItemContainer` instance that are lower in the tree hierarchie than the current instance
+        List of :class:`ItemContainer` instance that are lower in the tree hierarchie than the current instance.
+        The list must only be modified using :func:`addChildren` and :func:`removeChildren`, which keep the cached
+        row numbers of the children up to date.
+
+     .. py:attribute:: _row
+
+        Cached position of the container in the children list of its parent (c.f. :func:`childNumber`)
 
      .. py:attribute:: label
 
         String naming the container."""
 
+    __slots__ = ('_identifier', '_item', '_columns', 'parent', 'children', '_row', 'label')
+
+    COLUMNS = ['key', 'description', 'shape', 'dtype']
+
     def __init__(self, item=None, parent=None, label=None):
         #self._data = data if data is not None else [] # Dict or OrderedDict here?
-        self.__identifier = uuid4()
+        self._identifier = next(_identifiers)
         self._item = item
-        self._data = ['key', 'description', 'shape', 'dtype']
+        self._columns = None
         self.parent = parent
         self.children = []
+        self._row = -1
         if label:
             self.label = label
         elif item:
@@ -83,7 +103,7 @@ class ItemContainer(object):
     # Compare two containers
     #
     def getID(self):
-        return self.__identifier
+        return self._identifier
 
     def __eq__(self, other):
         return self.getID() == other.getID()
@@ -102,17 +122,32 @@ class ItemContainer(object):
         :returns: Index in parents children list. If parent is None, -1 is returned
         :rtype: int
         """
-        if self.parent:
-            siblings = self.parent.children
-            idx = siblings.index(self)
-        else:
-            idx = -1
+        if self.parent is None:
+            return -1
+        siblings = self.parent.children
+        idx = self._row
+        if idx < 0 or idx >= len(siblings) or siblings[idx] is not self:
+            # Children list was modified directly, rebuild the cache
+            self.parent._updateRows(0)
+            idx = self._row
         return idx
 
+    def _updateRows(self, start):
+        """
+        :param int start: First position in the children list whose row number is updated
+        """
+        children = self.children
+        for idx in range(start, len(children)):
+            children[idx]._row = idx
+
     #
     # Methods acting on ItemContainer._data
     #
 
+    @property
+    def _data(self):
+        return ItemContainer.COLUMNS if self._columns is None else self._columns
+
     def columnCount(self):
         """
         :returns: Number of columns to be displayed in a QTreeView
@@ -134,7 +169,7 @@ class ItemContainer(object):
             return False
         head = self._data[0:pos]
         tail = self._data[pos:]
-        self._data = head + [attr] + tail
+        self._columns = head + [attr] + tail
         return True
 
     def data(self, idx):
@@ -201,14 +236,17 @@ class ItemContainer(object):
         # Insert ItemContainer instances
         if (pos < -1) or (pos > len(self.children)):
             return False
-        if False in [isinstance(child, ItemContainer) for child in containerList]:
-            return False
+        for child in containerList:
+            if not isinstance(child, ItemContainer):
+                return False
         if pos == -1:
             pos = len(self.children)
 
-        head = self.children[0:pos]
-        tail = self.children[pos:]
-        self.children = head + containerList + tail
+        # Insert in place, only the rows from pos on change
+        self.children[pos:pos] = containerList
+        for child in containerList:
+            child.parent = self
+        self._updateRows(pos)
         return True
 
     def removeChildren(self, pos, count=1):
@@ -221,9 +259,143 @@ class ItemContainer(object):
         if (pos < 0) or (pos >= len(self.children)):
             return False
 
+        for child in self.children[pos:pos+count]:
+            child._row = -1
         del(self.children[pos:pos+count])
+        self._updateRows(pos)
         return True
 
+    #
+    # Traversal of the subtree below ItemContainer
+    #
+
+    def preOrder(self):
+        """
+        Iterates over the container and all of its descendants in depth-first pre-order, i.e. every container is
+        visited before its children and the children are visited in the order of ItemContainer.children. The
+        traversal uses an explicit stack and works for trees of any depth.
+
+        The tree must not be modified during the iteration.
+
+        :returns: Generator yielding ItemContainer instances
+        :rtype: generator
+        """
+        stack = [self]
+        while len(stack):
+            container = stack.pop()
+            yield container
+            if len(container.children):
+                stack.extend(reversed(container.children))
+
+    def breadthFirst(self):
+        """
+        Iterates over the container and all of its descendants level by level. The tree must not be modified during
+        the iteration.
+
+        :returns: Generator yielding ItemContainer instances
+        :rtype: generator
+        """
+        queue = deque([self])
+        while len(queue):
+            container = queue.popleft()
+            yield container
+            queue.extend(container.children)
+
+
+def benchmark_ItemContainer(numNodes=100000):
+    """
+    Compares the memory used per node of the project tree, i.e. an :class:`ItemContainer` holding a
+    :class:`Items.SpecItem`, to the former implementation using instance dictionaries, UUIDs and a column
+    list per container. Requires tracemalloc.
+    """
+    try:
+        import tracemalloc
+    except ImportError:
+        print('ItemContainer.benchmark -- tracemalloc not available')
+        return None
+    from uuid import uuid4
+    from gc import collect
+    from RixsTool.Items import SpecItem
+
+    class LegacyItem(object):
+        def __init__(self, key, header, array, fileLocation):
+            self._key = key
+            self.header = header
+            self.__identifier = uuid4()
+            self.fileLocation = fileLocation
+            self._array = array
+            self._lazyArray = None
+
+    class LegacyContainer(object):
+        def __init__(self, item=None, parent=None, label=None):
+            self.__identifier = uuid4()
+            self._item = item
+            self._data = ['key', 'description', 'shape', 'dtype']
+            self.parent = parent
+            self.children = []
+            self._row = -1
+            self.label = label
+
+    def bytesPerNode(containerClass, itemClass):
+        keys = ['spectrum%06d' % idx for idx in range(numNodes)]
+        collect()
+        tracemalloc.start()
+        try:
+            start = tracemalloc.get_traced_memory()[0]
+            nodes = [containerClass(item=itemClass(key, '', None, None), label=key) for key in keys]
+            stop = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        del(nodes)
+        return (stop - start) / float(numNodes)
+
+    legacy = bytesPerNode(LegacyContainer, LegacyItem)
+    compact = bytesPerNode(ItemContainer, SpecItem)
+    print('ItemContainer.benchmark -- memory per node, %d nodes' % numNodes)
+    print('\tdict, uuid4, column list: %5.0f bytes' % legacy)
+    print('\tslots, integer id:        %5.0f bytes' % compact)
+    return legacy, compact
+
+
+def unitTest_ItemContainer(maxExponent=6):
+    """
+    Fills a container with 10**3 up to 10**maxExponent children and checks that bulk insertion, bulk removal and
+    the row numbers of the children scale linearly with the number of children.
+    """
+    import time
+    success = True
+    for exponent in range(3, maxExponent + 1):
+        count = 10**exponent
+        root = ItemContainer(label='root')
+
+        containerList = [ItemContainer(label=str(idx)) for idx in range(count)]
+        timeStart = time.time()
+        root.addChildren(containerList)
+        timeInsert = time.time() - timeStart
+
+        timeStart = time.time()
+        for idx, child in enumerate(root.children):
+            success &= child.childNumber() == idx
+        timeRows = time.time() - timeStart
+
+        # Single appends as done by RixsProject.addItem
+        containerList = [ItemContainer(label='appended') for idx in range(1000)]
+        timeStart = time.time()
+        for container in containerList:
+            root.addChildren([container])
+        timeAppend = time.time() - timeStart
+
+        timeStart = time.time()
+        root.removeChildren(0, count // 2)
+        timeRemove = time.time() - timeStart
+        success &= root.childCount() == count - count // 2 + 1000
+        success &= root.children[0].childNumber() == 0 and root.children[-1].childNumber() == root.childCount() - 1
+
+        print('ItemContainer.unitTest -- %7d children: insert %.3f s, rows %.3f s, 1000 appends %.3f s, '
+              'remove half %.3f s' % (count, timeInsert, timeRows, timeAppend, timeRemove))
+    print('\t%s' % ('Success' if success else 'Failure'))
+    return success
+
 
 if __name__ == '__main__':
-    pass
\ No newline at end of file
+    unitTest_ItemContainer()
\ No newline at end of file
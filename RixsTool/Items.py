@@ -25,22 +25,153 @@
 # is a problem for you.
 #############################################################################*/
 __author__ = "Tonn Rueter - ESRF Data Analysis Unit"
-from uuid import uuid4
+from itertools import count
 from inspect import getargspec as getArgSpec
+import ast
 import numpy
 
 DEBUG = 1
 
+#
+# Source of the item identifiers
+#
+_identifiers = count()
+
+#
+# Datasets are written in chunks compressed by gzip (c.f. :func:`ProjectItem.hdf5Dump`)
+#
+HDF5_COMPRESSION = 'gzip'
+
+#
+# Names available in expressions given to :func:`FunctionItem.setExpression` as string. Of numpy, only the
+# attributes in FUNCTION_NUMPY_NAMES can be used
+#
+FUNCTION_NAMESPACE = {
+    '__builtins__': {},
+    'numpy': numpy,
+    'abs': abs
+}
+FUNCTION_NUMPY_NAMES = frozenset([
+    'pi', 'e', 'abs', 'absolute', 'sign', 'sqrt', 'exp', 'log', 'log10', 'power', 'sin', 'cos', 'tan', 'arcsin',
+    'arccos', 'arctan', 'arctan2', 'sinh', 'cosh', 'tanh', 'minimum', 'maximum', 'clip', 'where'
+])
+
+#
+# Syntax allowed in expressions given as string: arithmetic, comparisons, conditional expressions and calls
+#
+FUNCTION_SYNTAX = frozenset([
+    'Expression', 'Lambda', 'arguments', 'arg', 'Param', 'Name', 'Load', 'Attribute', 'Call', 'Num', 'Constant',
+    'BinOp', 'Add', 'Sub', 'Mult', 'Div', 'FloorDiv', 'Mod', 'Pow', 'UnaryOp', 'UAdd', 'USub', 'IfExp',
+    'Compare', 'Eq', 'NotEq', 'Lt', 'LtE', 'Gt', 'GtE', 'BoolOp', 'And', 'Or'
+])
+
+
+def compileExpression(expression):
+    """
+    :param str expression: Lambda expression, e.g. 'lambda x, a, b: a * x + b'
+
+    Checks every node of the syntax tree of the expression before it is compiled. Only the syntax in
+    :py:attr:`FUNCTION_SYNTAX`, numbers, the arguments of the lambda, the names in :py:attr:`FUNCTION_NAMESPACE`
+    and the numpy functions in :py:attr:`FUNCTION_NUMPY_NAMES` are accepted. Expressions read from files can
+    therefore not execute arbitrary code.
+
+    :returns: Function defined by the expression
+    :rtype: function
+    :raises ValueError: if the expression is not a lambda expression or contains anything else
+    """
+    try:
+        tree = ast.parse(expression.strip(), mode='eval')
+    except SyntaxError:
+        raise ValueError("compileExpression -- Invalid expression '%s'" % expression)
+    if not isinstance(tree.body, ast.Lambda):
+        raise ValueError("compileExpression -- '%s' is not a lambda expression" % expression)
+    arguments = tree.body.args
+    if arguments.vararg or arguments.kwarg or arguments.defaults or getattr(arguments, 'kwonlyargs', None) or\
+            getattr(arguments, 'posonlyargs', None):
+        raise ValueError("compileExpression -- Only plain arguments allowed in '%s'" % expression)
+    argNames = set(getattr(arg, 'arg', None) or getattr(arg, 'id', None) for arg in arguments.args)
+
+    numpyNames = set()
+    for node in ast.walk(tree):
+        nodeType = type(node).__name__
+        if nodeType not in FUNCTION_SYNTAX or (nodeType == 'Lambda' and node is not tree.body):
+            raise ValueError("compileExpression -- '%s' not allowed in '%s'" % (nodeType, expression))
+        if nodeType == 'Attribute':
+            if not (isinstance(node.value, ast.Name) and node.value.id == 'numpy' and
+                    node.attr in FUNCTION_NUMPY_NAMES):
+                raise ValueError("compileExpression -- Attribute '%s' not allowed in '%s'" % (node.attr, expression))
+            numpyNames.add(id(node.value))
+        elif nodeType in ('Num', 'Constant'):
+            value = node.n if nodeType == 'Num' else node.value
+            if isinstance(value, bool) or not isinstance(value, (int, float, complex)):
+                raise ValueError("compileExpression -- Constant %r not allowed in '%s'" % (value, expression))
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id not in argNames and id(node) not in numpyNames:
+            if node.id == 'numpy' or node.id not in FUNCTION_NAMESPACE or node.id.startswith('__'):
+                raise ValueError("compileExpression -- Name '%s' not allowed in '%s'" % (node.id, expression))
+    return eval(compile(tree, '<expression>', 'eval'), dict(FUNCTION_NAMESPACE))
+
+
+def hdf5DumpArray(group, name, array):
+    """
+    :param h5py.Group group: Group the dataset is created in
+    :param str name: Name of the dataset
+    :param ndarray array: Data of the dataset
+
+    Writes array as chunked and compressed dataset. Scalars and empty arrays can not be chunked and are written as
+    they are.
+    """
+    array = numpy.asarray(array)
+    if array.ndim == 0 or array.size == 0:
+        return group.create_dataset(name, data=array)
+    return group.create_dataset(name, data=array, chunks=True, compression=HDF5_COMPRESSION, shuffle=True)
+
+
+def hdf5DumpHeader(group, name, header):
+    """
+    :param h5py.Group group: Group the header is written to
+    :param str name: Name of the header
+    :param header: dict or str
+
+    Header dicts are written as attributes of a subgroup, all other headers as string attribute of the group.
+    """
+    if isinstance(header, dict):
+        headerGroup = group.create_group(name)
+        for attr, value in header.items():
+            if not isinstance(value, (int, float, str)):
+                value = str(value)
+            headerGroup.attrs[str(attr)] = value
+    else:
+        group.attrs[name] = '' if header is None else str(header)
+
 
 class ProjectItem(object):
-    __doc__ = """Base class to be contained in a project"""
+    __doc__ = """Base class to be contained in a project. Items use __slots__ instead of an instance dictionary,
+    every child class lists its additional attributes in its own __slots__.
+
+    The identifier of an item is an integer unique within the running process. Unpickled items receive a new
+    identifier."""
+    __slots__ = ('_key', 'header', '_identifier')
     interpretation = 'Abstract DataItem'
 
     def __init__(self, key, header):
         super(ProjectItem, self).__init__()
         self._key = key
         self.header = header
-        self.__identifier = uuid4()
+        self._identifier = next(_identifiers)
+
+    def __getstate__(self):
+        state = {}
+        for cls in type(self).__mro__:
+            for attr in getattr(cls, '__slots__', ()):
+                if attr != '_identifier' and hasattr(self, attr):
+                    state[attr] = getattr(self, attr)
+        return state
+
+    def __setstate__(self, state):
+        for attr, value in state.items():
+            setattr(self, attr, value)
+        self._identifier = next(_identifiers)
 
     def __repr__(self):
         return '%s: %s' % (self.key(), str(self.interpretation))
@@ -48,49 +179,187 @@ class ProjectItem(object):
     def key(self):
         return self._key
 
+    def setKey(self, key):
+        """
+        :param str key: New key of the item. Use :func:`Project.RixsProject.rename` for items in a project.
+        """
+        self._key = key
+
     def description(self):
         return self.interpretation
 
     def getID(self):
-        return self.__identifier
+        return self._identifier
 
-    def hdf5Dump(self):
-        raise NotImplementedError('DataItem.hdfDump -- to be implemented here?')
+    def hdf5Dump(self, group):
+        """
+        :param h5py.Group group: Empty group the item is written to
+
+        Stores class, key and header of the item. Child classes extend the method by their data.
+        """
+        group.attrs['class'] = type(self).__name__
+        group.attrs['key'] = self.key()
+        hdf5DumpHeader(group, 'header', self.header)
+
+
+class LazyArray(object):
+    __doc__ = """Placeholder for numeric data that is only read from its source once it is accessed. Readers
+    provide subclasses of :class:`LazyArray` that know the shape and data type of the data in advance, so
+    that a :class:`DataItem` can be displayed without touching the actual data.
+
+    .. py:attribute:: shape
+
+        Tuple describing the shape of the data
+
+    .. py:attribute:: dtype
+
+        numpy.dtype of the data"""
+
+    def __init__(self, shape, dtype):
+        self.shape = tuple(shape)
+        self.dtype = numpy.dtype(dtype)
+
+    def load(self):
+        """
+        Must be reimplemented in every child class.
+
+        :returns: Data described by the placeholder
+        :rtype: ndarray
+        """
+        raise NotImplementedError('LazyArray.load -- Do not instantiate base class')
+
+
+class FrameStack(LazyArray):
+    __doc__ = """:class:`LazyArray` that combines a list of two dimensional frames into a three dimensional array.
+    The frames are either ndarrays or :class:`LazyArray` instances themselves.
+
+    .. py:attribute:: frames
+
+        List of frames in the stack"""
+
+    def __init__(self, frames):
+        if not len(frames):
+            raise ValueError('FrameStack.__init__ -- Received empty frame list')
+        shape, dtype = tuple(frames[0].shape), numpy.dtype(frames[0].dtype)
+        for frame in frames:
+            if tuple(frame.shape) != shape or numpy.dtype(frame.dtype) != dtype:
+                raise ValueError('FrameStack.__init__ -- Frames differ in shape or dtype')
+        LazyArray.__init__(self, (len(frames),) + shape, dtype)
+        self.frames = frames
+
+    def frame(self, idx):
+        """
+        :param int idx: Number of the frame in the stack
+        :returns: Data of a single frame
+        :rtype: ndarray
+        """
+        frame = self.frames[idx]
+        if isinstance(frame, LazyArray):
+            frame = frame.load()
+        return frame
+
+    def load(self):
+        stack = numpy.empty(shape=self.shape, dtype=self.dtype)
+        for idx in range(len(self.frames)):
+            stack[idx] = self.frame(idx)
+        return stack
 
 
 class DataItem(ProjectItem):
-    __doc__ = """Generic class to contain numeric data"""
+    __doc__ = """Generic class to contain numeric data. Instead of an ndarray, the item can be provided with a
+    :class:`LazyArray` that is replaced by the actual data on first access of :py:attr:`array`."""
+    __slots__ = ('fileLocation', '_array', '_lazyArray')
     interpretation = 'Dataset'
 
     def __init__(self, key, header, array, fileLocation):
         ProjectItem.__init__(self, key, header)
         self.fileLocation = fileLocation
+        self._array = None
+        self._lazyArray = None
         self.array = array
 
     def __repr__(self):
         return '%s %s: %s' % (self.interpretation, self.key(), str(self.shape()))
 
+    @property
+    def array(self):
+        if self._array is None and self._lazyArray is not None:
+            self._array = self._lazyArray.load()
+        return self._array
+
+    @array.setter
+    def array(self, array):
+        if isinstance(array, LazyArray):
+            self._lazyArray = array
+            self._array = None
+        else:
+            self._lazyArray = None
+            self._array = array
+
+    def isLoaded(self):
+        """
+        :returns: False if the data is still held by a :class:`LazyArray`, True otherwise
+        :rtype: bool
+        """
+        return self._array is not None or self._lazyArray is None
+
+    def loadArray(self):
+        """
+        :returns: Data of the item. Data held by a :class:`LazyArray` is read, but not kept in the item, so that many
+         items can be processed one after another in bounded memory.
+        :rtype: ndarray
+        """
+        return self._array if self.isLoaded() else self._lazyArray.load()
+
     def shape(self):
+        if not self.isLoaded():
+            return self._lazyArray.shape
         return self.array.shape
 
     def dtype(self):
+        if not self.isLoaded():
+            return self._lazyArray.dtype
         return self.array.dtype
 
+    def hdf5Dump(self, group):
+        """
+        :param h5py.Group group: Empty group the item is written to
+
+        Data held by a :class:`LazyArray` is read for writing, but not kept in memory afterwards.
+        """
+        ProjectItem.hdf5Dump(self, group)
+        group.attrs['fileLocation'] = '' if self.fileLocation is None else str(self.fileLocation)
+        array = self.loadArray()
+        if array is not None:
+            hdf5DumpArray(group, 'array', array)
+
 
 class FunctionItem(ProjectItem):
     __doc__ = """Class to contain a real valued function in terms of an analytical expression and a set of parameters"""
+    __slots__ = ('expression', 'expressionString', 'parameters', '_argspec')
     interpretation = 'Function'
 
     def __init__(self, key, header):
         ProjectItem.__init__(self, key, header)
         self.expression = lambda x: x
+        self.expressionString = 'lambda x: x'
         self.parameters = {}
         self._argspec = getArgSpec(self.expression)
 
     def setExpression(self, expression):
         """
-        :param function expression: Analystical function
+        :param expression: Analytical function, either as function or as string containing a lambda expression,
+         e.g. 'lambda x, a, b: a * x + b'. Only functions given as string can be stored in a project file. Strings
+         are restricted to arithmetic and a set of numpy functions (c.f. :func:`compileExpression`).
+        :type expression: function or str
+        :raises ValueError: if the string contains anything else
         """
+        if isinstance(expression, str):
+            function = compileExpression(expression)
+            self.expressionString = expression
+            expression = function
+        else:
+            self.expressionString = None
         self._argspec = getArgSpec(expression)
         self.expression = expression
 
@@ -121,13 +390,28 @@ class FunctionItem(ProjectItem):
         if len(self.parameters) <= 0:
             raise AttributeError('FunctionItem.sample -- parameters dict empty')
         # CONTINUE HERE
-        param = self.parameters
+        param = dict(self.parameters)
         param.update({'x': sampleRange})
         return self.expression(**param)
 
+    def hdf5Dump(self, group):
+        """
+        :param h5py.Group group: Empty group the item is written to
+
+        :raises ValueError: if the expression was not given as string
+        """
+        if self.expressionString is None:
+            raise ValueError("FunctionItem.hdf5Dump -- Expression of '%s' was not given as string" % self.key())
+        ProjectItem.hdf5Dump(self, group)
+        group.attrs['expression'] = self.expressionString
+        parameterGroup = group.create_group('parameters')
+        for name, value in self.parameters.items():
+            parameterGroup.attrs[name] = value
+
 
 class ScanItem(DataItem):
     __doc__ = """Class to contain data in multiple 1D numpy arrays"""
+    __slots__ = ('_scale',)
     interpretation = 'Scan'
 
     def __init__(self, key, header, array, fileLocation):
@@ -141,6 +425,8 @@ class ScanItem(DataItem):
          0 to len(array).
         :returns: ndarray scale or None
         """
+        if isinstance(self._scale, LazyArray):
+            self._scale = self._scale.load()
         if isinstance(self._scale, numpy.ndarray):
             return self._scale
         elif isinstance(self._scale, FunctionItem):
@@ -154,29 +440,137 @@ class ScanItem(DataItem):
             return None
 
     def setScale(self, scale):
+        """
+        :param scale: ndarray, :py:class:`Items.LazyArray` or :py:class:`Items.FunctionItem`
+        """
         self._scale = scale
 
+    def hdf5Dump(self, group):
+        DataItem.hdf5Dump(self, group)
+        if isinstance(self._scale, FunctionItem):
+            self._scale.hdf5Dump(group.create_group('scale'))
+        elif isinstance(self._scale, LazyArray):
+            hdf5DumpArray(group, 'scale', self._scale.load())
+        elif self._scale is not None:
+            hdf5DumpArray(group, 'scale', self._scale)
+
 
 class SpecItem(DataItem):
     __doc__ = """Class to contain data in 1D numpy array"""
+    __slots__ = ()
     interpretation = 'Spec'
-    pass
 
 
 class ImageItem(DataItem):
-    __doc__ = """Class to contain data in 2D numpy array"""
+    __doc__ = """Class to contain data in 2D numpy array. The scales :py:attr:`scaleX` and :py:attr:`scaleY` can be
+    provided as :class:`LazyArray` as well."""
+    __slots__ = ('_scaleX', '_scaleY')
     interpretation = 'Image'
 
     def __init__(self, key, header, array, fileLocation):
         DataItem.__init__(self, key, header, array, fileLocation)
-        self.scaleX = None
-        self.scaleY = None
+        self._scaleX = None
+        self._scaleY = None
+
+    @property
+    def scaleX(self):
+        if isinstance(self._scaleX, LazyArray):
+            self._scaleX = self._scaleX.load()
+        return self._scaleX
+
+    @scaleX.setter
+    def scaleX(self, scale):
+        self._scaleX = scale
+
+    @property
+    def scaleY(self):
+        if isinstance(self._scaleY, LazyArray):
+            self._scaleY = self._scaleY.load()
+        return self._scaleY
+
+    @scaleY.setter
+    def scaleY(self, scale):
+        self._scaleY = scale
+
+    def hdf5Dump(self, group):
+        DataItem.hdf5Dump(self, group)
+        for name in ['scaleX', 'scaleY']:
+            scale = getattr(self, name)
+            if scale is not None:
+                hdf5DumpArray(group, name, scale)
 
 
 class StackItem(DataItem):
-    __doc__ = """Class to contain data in 3D numpy array"""
+    __doc__ = """Class to contain data in 3D numpy array. Instead of a 3D array, the item can be provided with a
+    list of frames. In that case, accessing a single frame via stack[idx] only reads said frame and the whole
+    stack is only assembled when :py:attr:`array` is accessed.
+
+    .. py:attribute:: frameHeaders
+
+        List of the headers of the single frames, if available"""
+    __slots__ = ('frameHeaders',)
     interpretation = 'Stack'
-    pass
+
+    def __init__(self, key, header, array, fileLocation):
+        if isinstance(array, (list, tuple)):
+            array = FrameStack(array)
+        DataItem.__init__(self, key, header, array, fileLocation)
+        self.frameHeaders = []
+
+    def __getitem__(self, idx):
+        if not self.isLoaded() and isinstance(self._lazyArray, FrameStack):
+            return self._lazyArray.frame(idx)
+        return self.array[idx]
+
+    def __iter__(self):
+        for idx in range(self.frameCount()):
+            yield self[idx]
+
+    def frameCount(self):
+        return self.shape()[0]
+
+    def reduce(self, function, initial=None):
+        """
+        :param function function: Binary function combining the intermediate result and the next frame
+        :param initial: Start value for the reduction. If None, the first frame is used
+
+        Reduces the stack frame by frame, so that only a single frame is held in memory at a time.
+
+        :returns: Result of the reduction
+        """
+        result = initial
+        for frame in self:
+            if result is None:
+                result = numpy.array(frame)
+            else:
+                result = function(result, frame)
+        return result
+
+    def sum(self):
+        """
+        :returns: Sum over all frames of the stack
+        :rtype: ndarray
+        """
+        initial = numpy.zeros(shape=self.shape()[1:], dtype=numpy.float64)
+        return self.reduce(lambda result, frame: numpy.add(result, frame, out=result), initial)
+
+    def hdf5Dump(self, group):
+        """
+        :param h5py.Group group: Empty group the item is written to
+
+        The stack is written frame by frame, one chunk per frame.
+        """
+        ProjectItem.hdf5Dump(self, group)
+        group.attrs['fileLocation'] = '' if self.fileLocation is None else str(self.fileLocation)
+        shape = self.shape()
+        dataset = group.create_dataset('array', shape=shape, dtype=self.dtype(), chunks=(1,) + tuple(shape[1:]),
+                                       compression=HDF5_COMPRESSION, shuffle=True)
+        for idx, frame in enumerate(self):
+            dataset[idx] = frame
+        if self.frameHeaders:
+            headerGroup = group.create_group('frameHeaders')
+            for idx, header in enumerate(self.frameHeaders):
+                hdf5DumpHeader(headerGroup, str(idx), header)
 
 
 if __name__ == '__main__':
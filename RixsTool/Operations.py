@@ -27,20 +27,62 @@
 __author__ = "Tonn Rueter - ESRF Data Analysis Unit"
 
 import numpy
+from multiprocessing import Pool as ProcessPool
 
-# Numeric routines from PyMca
-from PyMca5.PyMcaMath.fitting.Gefit import LeastSquaresFit as LSF
-from PyMca5.PyMcaMath.fitting import SpecfitFunctions as SF
-from PyMca5.PyMcaMath.fitting.SpecfitFuns import gauss as gaussianModel
-from PyMca5.PyMcaMath import SNIPModule as SNIP
+# Numeric routines from PyMca, only required by the lsf and pool fits and the peak search
+try:
+    from PyMca5.PyMcaMath.fitting.Gefit import LeastSquaresFit as LSF
+    from PyMca5.PyMcaMath.fitting import SpecfitFunctions as SF
+    from PyMca5.PyMcaMath.fitting.SpecfitFuns import gauss as gaussianModel
+    from PyMca5.PyMcaMath import SNIPModule as SNIP
+except ImportError:
+    LSF = SF = gaussianModel = SNIP = None
 
 # IO and Datahandling from RixsTool
 from RixsTool.Project import RixsProject
 from RixsTool.Items import FunctionItem
 from RixsTool.Functions import Fit
+from RixsTool.HeaderIndex import headerFields
 
 DEBUG = 0
 
+#
+# Default detector parameters of ID32 and the number of rows forming the dark region of an image,
+# c.f. Filter.bandPassFilterID32
+#
+ID32_DEFAULTS = {
+    'energy': 931.942,
+    'binning': 4,
+    'preset': 300,
+    'dc': 0.00016
+}
+ID32_DARKROWS = 100
+
+#
+# Number of images Filter.bandPassFilterID32Batch loads and filters at once
+#
+ID32_CHUNKSIZE = 8
+
+#
+# Number of pixels the band pass engine processes in one chunk. The masks of a chunk stay in the CPU cache.
+#
+BANDPASS_CHUNKSIZE = 1 << 16
+
+#
+# Integer images of at least this many pixels are filtered using a lookup table
+#
+BANDPASS_LUTMINSIZE = 1 << 18
+
+#
+# Number of curves FftCorrelator transforms at once
+#
+FFT_CHUNKSIZE = 64
+
+#
+# Converts the FWHM of a gaussian to its standard deviation, 2 * sqrt(2 * ln(2))
+#
+FWHM_PER_SIGMA = 2.3548200450309493
+
 
 class ImageOp(object):
     def __init__(self):
@@ -81,10 +123,9 @@ class Filter(ImageOp):
 
         :returns ndarray: Filtered image
         """
-        imMin = image.min()
-        imMax = image.max()
-        lo = params.get('low', imMin)
-        hi = params.get('high', imMax)
+        # Only reduce the image if a threshold is missing
+        lo = params['low'] if 'low' in params else image.min()
+        hi = params['high'] if 'high' in params else image.max()
         offset = params.get('offset', 0.)
         replace = params.get('replace', 0.)
 
@@ -95,9 +136,7 @@ class Filter(ImageOp):
             print('\toffset = %s (type: %s)' % (str(offset), str(type(offset))))
             print('\treplace = %s (type: %s)' % (str(replace), str(type(replace))))
 
-        out = image.astype(type(offset)) - offset
-        out = numpy.where((lo <= out), out, replace)
-        out = numpy.where((out <= hi), out, replace)
+        out = Filter.bandPass(image, lo, hi, offset, replace, dtype=type(offset))
 
         if DEBUG >= 1:
             print('\timage.min = %s (type: %s)' % (str(image.min()), str(type(image.min()))))
@@ -107,6 +146,120 @@ class Filter(ImageOp):
 
         return out
 
+    @staticmethod
+    def bandPass(image, low=None, high=None, offset=0., replace=0., out=None, dtype=None):
+        """
+        :param ndarray image: Input array of arbitrary shape
+        :param float low: Lower threshold applied after subtracting the offset. Default: None, i.e. no lower threshold
+        :param float high: Upper threshold applied after subtracting the offset. Default: None, i.e. no upper threshold
+        :param float offset: Baseline subtracted from the image. Default: 0.
+        :param float replace: Replacement for values outside of [low, high]. Default: 0.
+        :param ndarray out: Output buffer with the shape of the image, may be the image itself. Default: None,
+         i.e. a new array is allocated
+        :param dtype: Type of a newly allocated output buffer. Default: None, i.e. the type of offset
+
+        Band pass filter engine behind :func:`Filter.bandPassFilter`. Casting, subtracting the offset and replacing
+        values outside of the thresholds is done in a single pass over the image. The image is processed in chunks of
+        BANDPASS_CHUNKSIZE pixels, so the only temporary memory needed is a boolean mask of one chunk. Non-finite
+        values are replaced as well.
+
+        Large images of 8 or 16 bit integers, i.e. raw detector images, are filtered by computing the result for
+        every possible pixel value once and looking up the pixels in this table.
+
+        :returns ndarray: Filtered image, i.e. out if given
+        :raises ValueError: if out does not match the shape of the image
+        """
+        image = numpy.asarray(image)
+        if out is None:
+            out = numpy.empty(image.shape, dtype=dtype if dtype is not None else type(offset))
+        elif out.shape != image.shape:
+            raise ValueError('Filter.bandPass -- Output buffer has shape %s, expected %s'
+                             % (str(out.shape), str(image.shape)))
+        if not image.size:
+            return out
+
+        if not out.flags['C_CONTIGUOUS']:
+            raise ValueError('Filter.bandPass -- Output buffer must be contiguous')
+
+        # Flat views of the input and the output, reshape copies the input if it is not contiguous
+        source = image.reshape(-1)
+        target = out.reshape(-1)
+
+        chunkSize = min(BANDPASS_CHUNKSIZE, source.size)
+        if image.dtype.kind in 'ui' and image.dtype.itemsize <= 2 and image.size >= BANDPASS_LUTMINSIZE:
+            info = numpy.iinfo(image.dtype)
+            table = Filter.bandPass(numpy.arange(info.min, info.max + 1), low, high, offset, replace, dtype=out.dtype)
+            index = numpy.empty(chunkSize, dtype=numpy.intp)
+            for start in range(0, source.size, chunkSize):
+                stop = min(start + chunkSize, source.size)
+                chunkIndex = index[:stop - start]
+                chunkIndex[...] = source[start:stop]
+                if info.min:
+                    chunkIndex -= info.min
+                numpy.take(table, chunkIndex, out=target[start:stop], mode='clip')
+            return out
+
+        keep = numpy.empty(chunkSize, dtype=bool)
+        inside = numpy.empty(chunkSize, dtype=bool)
+        for start in range(0, source.size, chunkSize):
+            stop = min(start + chunkSize, source.size)
+            chunk = target[start:stop]
+            numpy.subtract(source[start:stop], offset, out=chunk, casting='unsafe')
+            mask = keep[:stop - start]
+            if low is None and high is None:
+                # Compare with itself to catch NaN
+                numpy.equal(chunk, chunk, out=mask)
+            if low is not None:
+                numpy.greater_equal(chunk, low, out=mask)
+            if high is not None:
+                if low is None:
+                    numpy.less_equal(chunk, high, out=mask)
+                else:
+                    numpy.less_equal(chunk, high, out=inside[:stop - start])
+                    numpy.logical_and(mask, inside[:stop - start], out=mask)
+            numpy.logical_not(mask, out=mask)
+            numpy.copyto(chunk, replace, casting='unsafe', where=mask)
+        return out
+
+    @staticmethod
+    def bandPassStack(stack, low=None, high=None, offset=0., replace=0., out=None, dtype=numpy.float32):
+        """
+        :param ndarray stack: Three dimensional array, the first axis enumerates the images
+        :param low: Lower threshold, either a scalar or one value per image. Default: None
+        :param high: Upper threshold, either a scalar or one value per image. Default: None
+        :param offset: Baseline, either a scalar or one value per image. Default: 0.
+        :param float replace: Replacement for values outside of [low, high]. Default: 0.
+        :param ndarray out: Output buffer with the shape of the stack. Default: None
+        :param dtype: Type of a newly allocated output buffer. Default: numpy.float32
+
+        Applies :func:`Filter.bandPass` to every image of a stack, writing into a single output buffer.
+
+        :returns ndarray: Filtered stack, i.e. out if given
+        :raises ValueError: if out does not match the shape of the stack or a parameter does not match the number
+         of images
+        """
+        if out is None:
+            out = numpy.empty(stack.shape, dtype=dtype)
+        elif out.shape != stack.shape:
+            raise ValueError('Filter.bandPassStack -- Output buffer has shape %s, expected %s'
+                             % (str(out.shape), str(stack.shape)))
+        numImages = len(stack)
+
+        def perImage(value, name):
+            if value is None or numpy.isscalar(value):
+                return [value] * numImages
+            if len(value) != numImages:
+                raise ValueError("Filter.bandPassStack -- '%s' has %d values for %d images"
+                                 % (name, len(value), numImages))
+            return value
+
+        lows = perImage(low, 'low')
+        highs = perImage(high, 'high')
+        offsets = perImage(offset, 'offset')
+        for idx in range(numImages):
+            Filter.bandPass(stack[idx], lows[idx], highs[idx], offsets[idx], replace, out=out[idx])
+        return out
+
     @staticmethod
     def bandPassFilterID32(image, params):
         """
@@ -127,12 +280,8 @@ class Filter(ImageOp):
         # binning: Hardware binning in the detector, 4 in the example
         # photon energy: guess what..
         #
-        photonEnery = params.get('energy', 931.942)  # From header...
-        binning = params.get('binning', 4)
-
-        detectorEfficiency = photonEnery * 0.24801587301587297  # 1. / (3.6 * 1.12) = 0.248...
-        lower = detectorEfficiency * 0.035  # TODO: Where does 0.035 come from?!
-        upper = detectorEfficiency * binning * 0.9
+        photonEnery = params.get('energy', ID32_DEFAULTS['energy'])  # From header...
+        binning = params.get('binning', ID32_DEFAULTS['binning'])
 
         #
         # -- BASELINE --
@@ -142,18 +291,12 @@ class Filter(ImageOp):
         # exposureTime: time to record an entire image in seconds
         # DC: counts per pixel per second
         #
-        exposureTime = params.get('preset', 300)
-        dc = params.get('dc', 0.00016)
+        exposureTime = params.get('preset', ID32_DEFAULTS['preset'])
+        dc = params.get('dc', ID32_DEFAULTS['dc'])
 
-        offset = numpy.mean(image[:100, :]) + 1
-        baseline = offset + exposureTime * dc
+        darkMean = numpy.mean(image[:ID32_DARKROWS, :])
 
-        parameters = {
-            'offset': baseline,
-            'low': lower,
-            'high': upper,
-            'replace': 0
-        }
+        parameters = Filter.parametersID32(photonEnery, binning, exposureTime, dc, darkMean)
 
         if DEBUG >= 1:
             print('Filter.bandPassFilterID32 -- values:')
@@ -163,6 +306,102 @@ class Filter(ImageOp):
         #print('Filter.bandPassFilterID32 -- parameters:\n\t%s' % str(parameters))
         return Filter.bandPassFilter(image, parameters)
 
+    @staticmethod
+    def parametersID32(energy, binning, preset, dc, darkMean):
+        """
+        :param energy: Photon energy in eV
+        :param binning: Hardware binning of the detector
+        :param preset: Exposure time in seconds
+        :param dc: Dark current in counts per pixel per second
+        :param darkMean: Mean of the dark region of the image
+
+        Band pass parameters of the ID32 detector, c.f. :func:`Filter.bandPassFilterID32`. All arguments may be
+        arrays holding one value per image.
+
+        :returns: Parameters offset, low, high and replace as used by :func:`Filter.bandPassFilter`
+        :rtype: dict
+        """
+        detectorEfficiency = energy * 0.24801587301587297  # 1. / (3.6 * 1.12) = 0.248...
+        lower = detectorEfficiency * 0.035  # TODO: Where does 0.035 come from?!
+        upper = detectorEfficiency * binning * 0.9
+        baseline = darkMean + 1 + preset * dc
+        return {
+            'offset': baseline,
+            'low': lower,
+            'high': upper,
+            'replace': 0
+        }
+
+    @staticmethod
+    def bandPassFilterID32Batch(images, params=None, chunkSize=ID32_CHUNKSIZE, dtype=numpy.float32):
+        """
+        :param images: Either a three dimensional numpy.ndarray, the first axis enumerating the images, or an iterable
+         of :class:`Items.ImageItem`. All images must have the same shape.
+        :param dict params: Parameters energy, binning, preset and dc (c.f. :func:`Filter.bandPassFilterID32`) used
+         for images whose header lacks them. Default: None
+        :param int chunkSize: Number of images loaded and filtered at once. Default: ID32_CHUNKSIZE
+        :param dtype: Type of the filtered images. Default: numpy.float32
+
+        Batch version of :func:`Filter.bandPassFilterID32`. Generator filtering the images in chunks, so that a run
+        of any length is filtered in bounded memory. The shapes and, for ImageItems, the header fields energy,
+        binning and preset are read before any data (c.f. :func:`HeaderIndex.headerFields`). The images of a chunk
+        are then loaded without being kept in their items, the baselines of the chunk are computed in a single
+        reduction over their dark regions and every image is filtered into a buffer by :func:`Filter.bandPass`.
+
+        The buffer is reused for the next chunk, copy the chunk to keep it, e.g.
+
+        for start, chunk in Filter.bandPassFilterID32Batch(itemList):
+            out[start:start + len(chunk)] = chunk
+
+        :returns: Generator yielding 2-tuples containing the index of the first image of a chunk and the filtered
+         images of the chunk as three dimensional numpy.ndarray
+        :rtype: generator
+        :raises ValueError: if the images differ in shape
+        """
+        params = params if params else {}
+        if isinstance(images, numpy.ndarray):
+            if images.ndim != 3:
+                raise ValueError('Filter.bandPassFilterID32Batch -- Expected three dimensional array, got %d dimensions'
+                                 % images.ndim)
+            shape = images.shape[1:]
+            headers = [{}] * len(images)
+
+            def load(idx):
+                return images[idx]
+        else:
+            itemList = list(images)
+            shapes = set(tuple(item.shape()) for item in itemList)
+            if len(shapes) > 1:
+                raise ValueError('Filter.bandPassFilterID32Batch -- Images differ in shape: %s' % str(sorted(shapes)))
+            shape = shapes.pop() if len(shapes) else ()
+            headers = [headerFields(item.header) for item in itemList]
+
+            def load(idx):
+                return itemList[idx].loadArray()
+
+        def perImage(name):
+            default = params.get(name, ID32_DEFAULTS[name])
+            values = [header.get(name, default) for header in headers]
+            return numpy.asarray([value if isinstance(value, float) else default for value in values])
+
+        numImages = len(headers)
+        energies, binnings, presets = perImage('energy'), perImage('binning'), perImage('preset')
+        dc = params.get('dc', ID32_DEFAULTS['dc'])
+        chunkSize = max(1, int(chunkSize))
+        buffer = numpy.empty((min(chunkSize, numImages),) + tuple(shape), dtype=dtype)
+        for start in range(0, numImages, chunkSize):
+            stop = min(start + chunkSize, numImages)
+            arrays = [load(idx) for idx in range(start, stop)]
+            darkMeans = numpy.asarray([array[:ID32_DARKROWS, :] for array in arrays]).mean(axis=(1, 2))
+            parameters = Filter.parametersID32(energies[start:stop], binnings[start:stop], presets[start:stop], dc,
+                                               darkMeans)
+            chunk = buffer[:stop - start]
+            for idx, array in enumerate(arrays):
+                Filter.bandPass(array, parameters['low'][idx], parameters['high'][idx], parameters['offset'][idx],
+                                parameters['replace'], out=chunk[idx])
+            del(arrays)
+            yield start, chunk
+
 
 class Alignment(ImageOp):
     def __init__(self=None):
@@ -174,13 +413,17 @@ class Alignment(ImageOp):
         }
 
     @staticmethod
-    def maxAlignment(image, params):
-        # TODO: Add normalization flag
-        idx0 = params.get('idx0', 0)
-        axis = params.get('axis', -1) # Axis defines direction of curves
-        scale = params.get('scale', None)
+    def _curves(image, axis):
+        """
+        :param ndarray image: Two dimensional numpy.ndarray
+        :param int axis: Axis along which the curves are stored. If negative, the curves lie along the longer axis.
 
+        :returns: Two dimensional view of the image, every row holding a curve
+        :rtype: ndarray
+        :raises ValueError: if axis is neither -1, 0 nor 1
+        """
         if axis < 0:
+            # If axis not specified, align along smaller axis
             rows, cols = image.shape
             if rows < cols:
                 axis = 0
@@ -188,25 +431,82 @@ class Alignment(ImageOp):
                 axis = 1
 
         if axis == 0:
-            nCurves, nPoints = image.shape
-            curves = image
+            return image
         elif axis == 1:
-            nPoints, nCurves = image.shape
-            curves = image.T
+            return image.T
         else:
             raise ValueError('Alignment instance -- Axis must be either -1, 0 or 1')
 
-        shiftList = [float('NaN')] * nCurves
+    @staticmethod
+    def _contiguousCurves(curves, dtype=float, tileSize=64):
+        """
+        :param ndarray curves: Two dimensional array, every row holding a curve
+        :param dtype: Type of the copy. Default: float
+        :param int tileSize: Edge length of the tiles copied at once if the curves are columns in memory. Default: 64
+
+        Copies the curves into a C-contiguous array. Transposed images are copied tile by tile, so that reading
+        and writing stay in the CPU cache.
 
-        pos0 = curves[idx0].argmax()
+        :returns: Copy of the curves
+        :rtype: ndarray
+        """
+        nCurves, nPoints = curves.shape
+        out = numpy.empty((nCurves, nPoints), dtype=dtype)
+        if abs(curves.strides[1]) <= abs(curves.strides[0]):
+            out[...] = curves
+            return out
+        for start in range(0, nCurves, tileSize):
+            for pos in range(0, nPoints, tileSize):
+                out[start:start + tileSize, pos:pos + tileSize] = curves[start:start + tileSize, pos:pos + tileSize]
+        return out
 
-        for idx, y in enumerate(curves):
-            shift = pos0 - y.argmax()
-            shiftList[idx] = shift
+    @staticmethod
+    def _argmax(curves, blockSize=64):
+        """
+        :param ndarray curves: Two dimensional array, every row holding a curve
+        :param int blockSize: Number of points per block if the curves are columns in memory. Default: 64
 
-        shiftArray = numpy.asarray(shiftList)
-        if scale:
-            shiftArray *= numpy.average(numpy.diff(scale))
+        Position of the maximum of every curve, equivalent to curves.argmax(axis=1). If the curves are the columns
+        of an image, numpy.argmax walks through memory with a large stride. In this case the image is scanned block
+        by block along the rows, only curves whose maximum lies in a block are searched for its position.
+
+        :returns: Positions of the first maximum
+        :rtype: ndarray
+        """
+        if curves.ndim != 2 or abs(curves.strides[1]) <= abs(curves.strides[0]):
+            return curves.argmax(axis=1)
+        columns = curves.T
+        nPoints, nCurves = columns.shape
+        positions = numpy.zeros(nCurves, dtype=numpy.intp)
+        if not nPoints:
+            return curves.argmax(axis=1)
+        maxima = columns[0].copy()
+        for start in range(0, nPoints, blockSize):
+            block = columns[start:start + blockSize]
+            blockMaxima = block.max(axis=0)
+            # NaN is the maximum for numpy.argmax, the first occurrence wins
+            update = (blockMaxima > maxima) | (numpy.isnan(blockMaxima) & ~numpy.isnan(maxima))
+            if start == 0:
+                update[:] = True
+            if not update.any():
+                continue
+            positions[update] = numpy.ascontiguousarray(block[:, update].T).argmax(axis=1) + start
+            maxima[update] = blockMaxima[update]
+        return positions
+
+    @staticmethod
+    def maxAlignment(image, params):
+        # TODO: Add normalization flag
+        idx0 = params.get('idx0', 0)
+        axis = params.get('axis', -1) # Axis defines direction of curves
+        scale = params.get('scale', None)
+
+        curves = Alignment._curves(image, axis)
+
+        pos0 = curves[idx0].argmax()
+        shiftArray = pos0 - Alignment._argmax(curves)
+        if scale is not None and len(scale):
+            shiftArray = shiftArray * numpy.average(numpy.diff(scale))
 
         #ddict = {
         #    'op': 'maxAlignment',
@@ -215,6 +515,75 @@ class Alignment(ImageOp):
         #return ddict
         return shiftArray
 
+    @staticmethod
+    def _peakBounds(below, idxMax):
+        """
+        :param ndarray below: Two dimensional boolean array marking the points outside of the peaks
+        :param ndarray idxMax: Position of the maximum in every row
+
+        :returns: Nearest positions marked in below at or left respectively right of the maximum. If there is no
+         such position, the left bound is -1 and the right bound is the row length.
+        :rtype: tuple
+        """
+        nPoints = below.shape[1]
+        positions = numpy.arange(nPoints)
+        mask = below & (positions <= idxMax[:, numpy.newaxis])
+        left = nPoints - 1 - mask[:, ::-1].argmax(axis=1)
+        left[~mask.any(axis=1)] = -1
+        numpy.logical_and(below, positions >= idxMax[:, numpy.newaxis], out=mask)
+        right = mask.argmax(axis=1)
+        right[~mask.any(axis=1)] = nPoints
+        return left, right
+
+    @staticmethod
+    def _peakWindows(curves, left, right):
+        """
+        :param ndarray curves: Two dimensional array, every row holding a curve
+        :param ndarray left: Left bound of the peak in every row, inside the row
+        :param ndarray right: Right bound of the peak in every row, inside the row
+
+        Gathers the peaks in a block as wide as the widest peak.
+
+        :returns: Positions of the points in the block and their values. Points beyond the right bound are zero.
+        :rtype: tuple
+        """
+        nCurves, nPoints = curves.shape
+        width = int((right - left).max()) + 1 if nCurves else 0
+        window = left[:, numpy.newaxis] + numpy.arange(width)
+        inside = window <= right[:, numpy.newaxis]
+        numpy.minimum(window, nPoints - 1, out=window)
+        weights = numpy.where(inside, curves[numpy.arange(nCurves)[:, numpy.newaxis], window], 0.)
+        return window, weights
+
+    @staticmethod
+    def _peakCentroids(curves, threshold):
+        """
+        :param ndarray curves: Two dimensional array, every row holding a curve normalized between zero and one
+        :param float threshold: Fraction of the maximum delimiting the peak
+
+        The peak of a curve reaches from its maximum to the nearest points on both sides that do not exceed the
+        threshold. The centroid of the peak is the ratio of the trapezoidal integrals of x * y and y over the peak.
+        Bounds are found for all curves at once from the mask of points below threshold, the integrals are computed
+        on a block holding only the peaks.
+
+        :returns: Centroids, left and right bounds of the peaks. A left bound of -1 respectively a right bound equal
+         to the curve length indicate that the peak is not delimited inside the curve.
+        :rtype: tuple
+        """
+        nCurves, nPoints = curves.shape
+        rows = numpy.arange(nCurves)
+        left, right = Alignment._peakBounds(~(curves > threshold), curves.argmax(axis=1))
+        clippedLeft, clippedRight = numpy.clip(left, 0, nPoints - 1), numpy.clip(right, 0, nPoints - 1)
+        window, weights = Alignment._peakWindows(curves, clippedLeft, clippedRight)
+
+        # Trapezoidal rule on [left, right]: sum over the peak minus half of the end points
+        yLeft, yRight = curves[rows, clippedLeft], curves[rows, clippedRight]
+        area = weights.sum(axis=1) - .5 * (yLeft + yRight)
+        moment = (weights * window).sum(axis=1) - .5 * (yLeft * clippedLeft + yRight * clippedRight)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            centroids = moment / area
+        return centroids, left, right
+
     @staticmethod
     def centerOfMassAlignment(image, params):
         idx0 = params.get('idx0', 0)
@@ -223,73 +592,47 @@ class Alignment(ImageOp):
         scale = params.get('scale', None)
 
         # Determine which axis defines curves
-        if axis < 0:
-            # If axis not specified..
-            rows, cols = image.shape
-            # ..align along smaller axis
-            if rows < cols:
-                axis = 0
-            else:
-                axis = 1
-
-        if axis == 0:
-            nCurves, nPoints = image.shape
-            curves = image
-        elif axis == 1:
-            nPoints, nCurves = image.shape
-            curves = image.T
-        else:
-            raise ValueError('Alignment instance -- Axis must be either -1, 0 or 1')
-
-        shiftList = nCurves * [float('NaN')]
-
-        y0 = curves[idx0]
-        pos0 = y0.argmax()
-        ymin0, ymax0 = y0.min(), y0.max()
-        normFactor = ymax0-ymin0
-        if float(normFactor) <= 0.:
-            # Curve is constant
+        curves = Alignment._curves(image, axis)
+        nCurves, nPoints = curves.shape
+        idx0 = range(nCurves)[idx0]
+
+        # Normalize betw. zero an one
+        ynormed = Alignment._contiguousCurves(curves)
+        ymin = ynormed.min(axis=1)
+        normFactor = ynormed.max(axis=1) - ymin
+        # Constant curves are not aligned
+        valid = ~(normFactor <= 0)
+        if not valid[idx0]:
             raise ZeroDivisionError('Alignment.centerOfMass -- Trying to align on constant curve')
-        ynormed0 = (y0-ymin0)/normFactor
-
-        threshold = portion * float(ynormed0[pos0])
-        left, right = pos0, pos0
-        while  ynormed0[left] > threshold:
-            left -= 1
-        while  ynormed0[right] > threshold:
-            right += 1
-        if left < 0 or right >= nPoints:
-            raise IndexError('Alignment.centerOfMassAlignment: 0-th index out of range (left: %d, right: %d)'%(left, right))
-        mask = numpy.arange(left, right+1, dtype=int)
-        pos0 = numpy.trapz(ynormed0[mask] * mask) / numpy.trapz(ynormed0[mask])
-
-        for idx, y in enumerate(curves):
-            # Normalize betw. zero an one
-            ymin, ymax = y.min(), y.max()
-            normFactor = ymax-ymin
-            if float(normFactor) <= 0.:
-                # Curve is constant
-                continue
-            ynormed = (y-ymin)/normFactor
-
-            idxMax = ynormed.argmax()
-            left, right = idxMax, idxMax
-            while ynormed[left] > threshold:
-                left -= 1
-            while ynormed[right] > threshold:
-                right += 1
-            if left < 0 or right >= nPoints:
-                raise IndexError('Alignment.centerOfMassAlignment: index out of range (left: %d, right: %d)'%(left, right))
-            mask = numpy.arange(left, right+1, dtype=int)
-            if DEBUG >= 1:
-                print('mask:', mask)
-            shift = pos0 - numpy.trapz(ynormed[mask] * mask) / numpy.trapz(ynormed[mask])
-            if DEBUG >= 1:
-                print('\t%d\t%f'%(idx, shift))
-            shiftList[idx] = shift
+        if not valid.all():
+            ynormed = ynormed[valid]
+        ynormed -= ymin[valid, numpy.newaxis]
+        ynormed /= normFactor[valid, numpy.newaxis]
+
+        # Reference curve
+        y0 = ynormed[numpy.count_nonzero(valid[:idx0])]
+        threshold = portion * float(y0[y0.argmax()])
+        centroids, left, right = Alignment._peakCentroids(y0[numpy.newaxis, :], threshold)
+        if left[0] < 0 or right[0] >= nPoints:
+            raise IndexError('Alignment.centerOfMassAlignment: 0-th index out of range (left: %d, right: %d)'
+                             % (left[0], right[0]))
+        pos0 = centroids[0]
+
+        centroids, left, right = Alignment._peakCentroids(ynormed, threshold)
+        outOfRange = numpy.flatnonzero((left < 0) | (right >= nPoints))
+        if len(outOfRange):
+            first = outOfRange[0]
+            raise IndexError('Alignment.centerOfMassAlignment: index out of range (left: %d, right: %d)'
+                             % (left[first], right[first]))
+
+        shiftArray = numpy.empty(nCurves)
+        shiftArray.fill(float('NaN'))
+        shiftArray[valid] = pos0 - centroids
+        if DEBUG >= 1:
+            for idx, shift in enumerate(shiftArray):
+                print('\t%d\t%f' % (idx, shift))
 
-        shiftArray = numpy.asarray(shiftList)
-        if scale:
+        if scale is not None and len(scale):
             shiftArray *= numpy.average(numpy.diff(scale))
         #ddict = {
         #    'op': 'centerOfMassAlignment',
@@ -300,148 +643,113 @@ class Alignment(ImageOp):
 
     @staticmethod
     def fftAlignment(image, params):
+        """
+        :param ndarray image: Two dimensional numpy.ndarray
+        :param dict params: Contains parameters idx0, axis, portion, minChannel, maxChannel, scale, fastSize and
+         correlator
+
+        Determines the shifts of the curves by cross correlation with the reference curve idx0 inside the channel
+        window [minChannel, maxChannel). The shift of a curve is the center of mass of the correlation peak above
+        portion times its maximum. The correlations are computed by :class:`FftCorrelator`, which can be passed
+        as correlator to reuse the transform of the reference curve for several images. If fastSize is True (default),
+        curves of a length that is slow to transform are zero-padded without changing the result.
+
+        :returns ndarray: Shifts in channels respectively in units of scale
+        """
         idx0 = params.get('idx0', 0)
         axis = params.get('axis', -1)  # Axis defines direction of curves
         portion = params.get('portion', .80)
         minChannel = params.get('minChannel', 0)
         maxChannel = params.get('maxChannel', -1)
         scale = params.get('scale', None)
+        fastSize = params.get('fastSize', True)
+        correlator = params.get('correlator', None)
 
         # Determine which axis defines curves
-        if axis < 0:
-            # If axis not specified..
-            rows, cols = image.shape
-            # ..align along smaller axis
-            if rows < cols:
-                axis = 0
-            else:
-                axis = 1
-
-        if axis == 0:
-            nCurves, nPoints = image.shape
-            curves = image
-        elif axis == 1:
-            nPoints, nCurves = image.shape
-            curves = image.T
-        else:
-            raise ValueError('Alignment instance -- Axis must be either -1, 0 or 1')
+        curves = Alignment._curves(image, axis)
+        nCurves, nPoints = curves.shape
 
         # Determine, if a window is defined
         if maxChannel < 0:
             maxChannel = nPoints - 1
-        window = numpy.arange(
-            start=minChannel,
-            stop=maxChannel,
-            step=1,
-            dtype=numpy.uint16
-        )
-        #print('fftAlignment -- window: %s' % str(window))
+        windowed = curves[:, minChannel:maxChannel]
         if DEBUG >= 1:
-            print('fftAlignment -- window.shape: %s' % str(window.shape))
+            print('fftAlignment -- window.shape: %s' % str(windowed.shape))
 
-        shiftList = nCurves * [float('NaN')]
-
-        #y0 = curves[idx0]
-        y0 = curves[idx0][window]
-        if DEBUG >= 1:
-            print('fftAlignment -- y0.shape: %s' % str(y0.shape))
-        fft0 = numpy.fft.fft(y0)
-
-        for idx, y in enumerate(curves):
-            if DEBUG >= 1:
-                print('fftAlignment -- y.shape: %s' % str(y.shape))
-            data = y[window]
-            if DEBUG >= 1:
-                print('fftAlignment -- data.shape: %s' % str(data.shape))
-            ffty = numpy.fft.fft(data)
-            #ffty = numpy.fft.fft(y)
-            shiftTmp = numpy.fft.ifft(fft0 * ffty.conjugate()).real
-            shiftPhase = numpy.zeros(shiftTmp.shape, dtype=shiftTmp.dtype)
-            m = shiftTmp.size//2
-            shiftPhase[m:] = shiftTmp[:-m]
-            shiftPhase[:m] = shiftTmp[-m:]
-
-            # Normalize shiftPhase between 0 and 1 to standardize thresholding
-            shiftPhaseMin = shiftPhase.min()
-            shiftPhaseMax = shiftPhase.max()
-            normFactor = shiftPhaseMax - shiftPhaseMin
-            if float(normFactor) <= 0.:
-                if DEBUG >= 1:
-                    print('fftAlignment -- normFactor is zero')
-                continue
-            if DEBUG >= 1:
-                print('fftAlignment -- \n\t\t\tshiftPhaseMin: %f\n\t\t\tshiftPhaseMax: %f' % (shiftPhaseMin, shiftPhaseMax))
-            shiftPhase = (shiftPhase-shiftPhaseMin)/normFactor
-
-            # Thresholding: The noisier the data is, the more likely it is for the
-            # normalization to be ineffective, i.e. the whole range of shiftPhase
-            # is used later on.
-            idxMax = shiftPhase.argmax()
-            left, right = idxMax, idxMax
-            threshold = portion
-            while shiftPhase[left] >= threshold:
-                if left <= 0:
-                    if DEBUG >= 1:
-                        print('fftAlignment -- reached left limit')
-                    left = 0
-                    break
-                left -= 1
-            while shiftPhase[right] >= threshold:
-                if right >= len(shiftPhase)-1:
-                    if DEBUG >= 1:
-                        print('fftAlignment -- reached right limit')
-                    right = len(shiftPhase)-1
-                    break
-                right += 1
-
-            mask = numpy.arange(left, right+1, 1, dtype=numpy.uint16)
-            if DEBUG >= 1:
-                print('fftAlignment -- mask: %s' % str(mask))
-            # The shift is determined by center-of-mass around idxMax
-            shiftTmp = numpy.sum((shiftPhase[mask] * mask/shiftPhase[mask].sum()))
-            #shift = (shiftTmp - m) * (x[1] - x[0])
-            # x-range is pixel count..
-            shift = (shiftTmp - m)
-            shiftList[idx] = shift
-            if DEBUG >= 1:
-                print('fftAlignment -- shiftList[%d]: %s' % (idx, str(shift)))
+        if correlator is None:
+            correlator = FftCorrelator(windowed[idx0], fastSize)
+        shiftArray = correlator.shifts(windowed, portion)
 
+        if scale is not None and len(scale):
+            shiftArray *= numpy.average(numpy.diff(scale))
         #ddict = {
         #    'op': 'fftAlignment',
         #    'shiftList': shiftList
         #}
         #return ddict
         #return shiftList
-        return numpy.ascontiguousarray(shiftList)
+        return shiftArray
 
     @staticmethod
     def fitAlignment(image, params):
+        """
+        :param ndarray image: Two dimensional numpy.ndarray
+        :param dict params: Contains parameters idx0, axis, snipWidth, peakSearch, mode and workers
+         (c.f. :func:`Alignment.fitAlignmentReport`)
+
+        Determines the shifts of the curves from the positions of gaussians fitted to them.
+
+        :returns list: Shifts in channels
+        """
+        report = Alignment.fitAlignmentReport(image, params)
+        if report is None:
+            return None
+        return list(report['shifts'])
+
+    @staticmethod
+    def fitAlignmentReport(image, params):
+        """
+        :param ndarray image: Two dimensional numpy.ndarray
+        :param dict params: Contains parameters idx0, axis, snipWidth, peakSearch, mode and workers
+
+        Fits a gaussian to every curve after subtracting a SNIP background of width snipWidth. The mode selects
+        the fitting procedure:
+
+        lsf
+            PyMca's LeastSquaresFit curve by curve (default)
+
+        pool
+            PyMca's LeastSquaresFit distributed over a pool of worker processes, workers defaults to the number of
+            CPUs
+
+        batch
+            :class:`GaussianFitter` fitting all curves at once. The background of all curves is computed at once
+            by :func:`snipBackground`.
+
+        :returns: Shifts relative to curve idx0, fitted parameters (height, position, FWHM) per curve, reduced
+         chi-square, uncertainties of the parameters, convergence flags and the number of iterations (-1 if not
+         reported by the procedure). None if peakSearch finds no peaks.
+        :rtype: dict
+        :raises ValueError: if mode is unknown
+        :raises ImportError: if mode is lsf or pool or peakSearch is set and PyMca is not available
+        """
         idx0 = params.get('idx0', 0)
         axis = params.get('axis', -1)  # Axis defines direction of curves
         snipWidth = params.get('snipWidth', None)
         peakSearch = params.get('peakSearch', False)
+        mode = params.get('mode', 'lsf')
+        workers = params.get('workers', None)
+        if mode not in ['lsf', 'pool', 'batch']:
+            raise ValueError("Alignment.fitAlignment -- Unknown mode '%s'" % str(mode))
+        if LSF is None and (mode != 'batch' or peakSearch):
+            raise ImportError("Alignment.fitAlignment -- Mode '%s' and peak search require PyMca" % mode)
 
         #
         # Determine which axis defines curves
         # Make shure to convert image to float!!!
         #
-        if axis < 0:
-            # If axis not specified..
-            rows, cols = image.shape
-            # ..align along smaller axis
-            if rows < cols:
-                axis = 0
-            else:
-                axis = 1
-
-        if axis == 0:
-            nCurves, nPoints = image.shape
-            curves = numpy.float64(image)
-        elif axis == 1:
-            nPoints, nCurves = image.shape
-            curves = numpy.float64(image.T)
-        else:
-            raise ValueError('Alignment instance -- Axis must be either -1, 0 or 1')
+        curves = numpy.float64(Alignment._curves(image, axis))
+        nCurves, nPoints = curves.shape
 
         #
         # Image preprocessing: Snip background
@@ -449,34 +757,88 @@ class Alignment(ImageOp):
         imRows, imCols = image.shape
         if snipWidth is None:
             snipWidth = max(imRows, imCols)//10
-        specfitObj = SF.SpecfitFunctions()
-
-        background = numpy.zeros(shape=curves.shape,
-                                 dtype=numpy.float64)
-        for idx, curve in enumerate(curves):
-            background[idx] = SNIP.getSnip1DBackground(curve, snipWidth)
+        if mode == 'batch':
+            background = snipBackground(curves, snipWidth)
+        else:
+            background = numpy.zeros(shape=curves.shape,
+                                     dtype=numpy.float64)
+            for idx, curve in enumerate(curves):
+                background[idx] = SNIP.getSnip1DBackground(curve, snipWidth)
         subtracted = curves-background
         normResult = Normalization.zeroToOne(image=subtracted,
                                              params={})
         normalized = normResult['image']
 
         #
-        # Loop through curves: Find peak (max..), Estimate fit params, Perform Gaussian fit
+        # Find peak (max..), Estimate fit params
+        #
+        estimates = Alignment._gaussianEstimates(curves, subtracted, normalized, peakSearch)
+        if estimates is None:
+            return None
+        initial, fitMask = estimates
+
+        #
+        # Peak fit: Uses actual data
         #
-        fitList = nCurves * [float('NaN')]
         if DEBUG >= 1:
             print('Alignment.fitAlignment -- fitting..')
-        for idx, y in enumerate(subtracted):
-            #
-            # Peak search
-            #
-            if peakSearch:
+        if mode == 'batch':
+            # Data on the fitted points, shifted to a minimum of zero
+            minima = numpy.where(fitMask, curves, numpy.inf).min(axis=1)
+            ydata = numpy.where(fitMask, curves - minima[:, numpy.newaxis], 0.)
+            report = GaussianFitter().fit(ydata, fitMask, initial)
+        else:
+            tasks = [(initial[idx], numpy.nonzero(fitMask[idx])[0], curves[idx, fitMask[idx]])
+                     for idx in range(nCurves)]
+            if mode == 'pool':
+                pool = ProcessPool(workers)
+                try:
+                    results = pool.map(_lsfGaussianFit, tasks)
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                results = [_lsfGaussianFit(task) for task in tasks]
+            report = {
+                'parameters': numpy.asarray([fitp for fitp, chisq, sigma in results], dtype=float),
+                'chisq': numpy.asarray([chisq for fitp, chisq, sigma in results], dtype=float),
+                'sigma': numpy.asarray([sigma for fitp, chisq, sigma in results], dtype=float),
+                'iterations': -numpy.ones(nCurves, dtype=int)
+            }
+            report['converged'] = numpy.isfinite(report['parameters']).all(axis=1)
+        if DEBUG >= 1:
+            for idx, fitp in enumerate(report['parameters']):
+                print('\tCurve %d -- fitp: %s, converged: %s' % (idx, str(fitp), str(report['converged'][idx])))
+
+        posIdx = 1  # ..2nd argument of fitp is peak position
+        positions = report['parameters'][:, posIdx]
+        report['shifts'] = positions[idx0] - positions
+        return report
+
+    @staticmethod
+    def _gaussianEstimates(curves, subtracted, normalized, peakSearch=False):
+        """
+        :param ndarray curves: Curves in rows
+        :param ndarray subtracted: Curves after background subtraction
+        :param ndarray normalized: Background subtracted image normalized between zero and one
+        :param bool peakSearch: If True, the highest peak found by PyMca's peak search is fitted, else the maximum
+
+        :returns: Initial parameters (height, position, FWHM) per curve and a boolean array marking the points
+         included in the fits. None if peakSearch finds no peaks.
+        :rtype: tuple
+        """
+        nCurves, nPoints = curves.shape
+        rows = numpy.arange(nCurves)
+        positions = subtracted.argmax(axis=1)
+        if peakSearch:
+            specfitObj = SF.SpecfitFunctions()
+            for idx, y in enumerate(subtracted):
                 try:
                     # Calculate array with all peak indices
                     peakIdx = numpy.asarray(specfitObj.seek(y, yscaling=100.),
                                             dtype=int)
                     # Extract highest feature
-                    maxIdx = y[peakIdx].argsort()[-1]
+                    positions[idx] = peakIdx[y[peakIdx].argsort()[-1]]
                 except IndexError:
                     if DEBUG >= 1:
                         print('Alignment.fitAlignment -- No peaks found..')
@@ -484,55 +846,340 @@ class Alignment(ImageOp):
                 except SystemError:
                     if DEBUG >= 1:
                         print('Alignment.fitAlignment -- Peak search failed. Continue with y maximum')
-                    peakIdx = [y.argmax()]
-                    maxIdx = 0
-            else:
-                peakIdx = [y.argmax()]
-                maxIdx = 0
-            height = float(y[peakIdx][maxIdx]) + curves[idx].min()
-            pos = float(peakIdx[maxIdx])
+        height = subtracted[rows, positions] + curves.min(axis=1)
 
-            #
-            # Estimate FWHM
-            #
-            fwhmIdx = numpy.nonzero(y >= .5*normalized[idx])[0]
-            # Underestimates FWHM, since carried out on normalized image
-            fwhm = float(fwhmIdx.max()-fwhmIdx.min())
+        #
+        # Estimate FWHM
+        # Underestimates FWHM, since carried out on normalized image
+        #
+        halfMask = subtracted >= .5*normalized
+        first = halfMask.argmax(axis=1)
+        last = nPoints - 1 - halfMask[:, ::-1].argmax(axis=1)
+        fwhm = numpy.where(halfMask.any(axis=1), last - first, numpy.nan)
+
+        fitMask = subtracted >= .1*normalized
+        return numpy.column_stack((height, positions, fwhm)).astype(float), fitMask
+
+
+def _lsfGaussianFit(task):
+    """
+    :param tuple task: Initial parameters, x and y values of a curve
+
+    Fits a gaussian to a curve using PyMca's LeastSquaresFit. Module level function to be usable with a process pool.
+
+    :returns: Fitted parameters, reduced chi-square and uncertainties. NaN if the fit failed.
+    :rtype: tuple
+    """
+    initial, xdata, ydata = task
+    try:
+        fitp, chisq, sigma = LSF(gaussianModel,
+                                 numpy.asarray(initial),
+                                 xdata=xdata,
+                                 ydata=(ydata-ydata.min()))
+    except numpy.linalg.LinAlgError:
+        nan = float('NaN')
+        return [nan, nan, nan], nan, [nan, nan, nan]
+    return fitp, chisq, sigma
+
+
+def snipBackground(curves, width):
+    """
+    :param ndarray curves: Two dimensional array, every row holding a curve
+    :param int width: Maximal width of the clipping window
+
+    SNIP background of all curves at once. For every window half width p from width down to one, each point is
+    replaced by the mean of its neighbors at distance p if the mean is smaller (c.f. snip1d in PyMca). The
+    optional smoothing of PyMca's getSnip1DBackground is not applied.
+
+    :returns: Background of every curve
+    :rtype: ndarray
+    """
+    background = numpy.array(curves, dtype=numpy.float64)
+    nPoints = background.shape[-1]
+    mean = numpy.empty(background.shape, dtype=numpy.float64)
+    for p in range(int(width), 0, -1):
+        if 2 * p >= nPoints:
+            continue
+        inner = background[..., p:nPoints - p]
+        neighbors = mean[..., p:nPoints - p]
+        numpy.add(background[..., :nPoints - 2 * p], background[..., 2 * p:], out=neighbors)
+        neighbors *= .5
+        numpy.minimum(inner, neighbors, out=inner)
+    return background
+
+
+class GaussianFitter(object):
+    __doc__ = """Least squares fit of a single gaussian to many curves at once using the Levenberg-Marquardt
+    algorithm. All curves are iterated in lockstep, curves that converged are taken out of the iteration. The model
+    is the one of PyMca's gauss function with the parameters height, position and FWHM.
+
+    A curve has converged when an accepted step decreases its chi-square by less than the relative tolerance or when
+    a proposed step changes none of its parameters by more than the relative tolerance.
+
+    .. py:attribute:: maxIterations
+
+        Maximal number of iterations per curve
+
+    .. py:attribute:: tolerance
+
+        Relative tolerance deciding convergence"""
+
+    def __init__(self, maxIterations=100, tolerance=1e-10):
+        self.maxIterations = maxIterations
+        self.tolerance = tolerance
 
-            #
-            # Peak fit: Uses actual data
-            #
-            #xrange = numpy.arange(0, len(y), dtype=y.dtype) # Full range
-            mask = numpy.nonzero(y >= .1*normalized[idx])[0]
-            ydata = curves[idx,mask]
-            #ydata -= ydata.min()
-            try:
-                fitp, chisq, sigma = LSF(gaussianModel,
-                                         numpy.asarray([height, pos, fwhm]),
-                                         xdata=mask,
-                                         ydata=(ydata-ydata.min()))
-                if DEBUG >= 1:
-                    print('\tCurve %d -- fitp: %s' % (idx, str(fitp)))
-                    print('\tCurve %d -- chisq: %s' % (idx, str(chisq)))
-                    print('\tCurve %d -- sigma: %s' % (idx, str(sigma)))
-            except numpy.linalg.linalg.LinAlgError:
-                fitp, chisq, sigma = [None, None, None],\
-                                     float('Nan'),\
-                                     float('Nan')
-                if DEBUG >= 1:
-                    print('\tCurve %d -- Fit failed!' % idx)
-            fitList[idx] = fitp # ftip is 3-tuple..
+    @staticmethod
+    def model(parameters, x):
+        """
+        :param ndarray parameters: Height, position and FWHM per curve, shape (number of curves, 3)
+        :param ndarray x: Positions at which the gaussians are evaluated
+        :returns: Gaussians, shape (number of curves, number of positions)
+        :rtype: ndarray
+        """
+        height, position, fwhm = [parameters[:, idx, numpy.newaxis] for idx in range(3)]
+        return height * numpy.exp(-.5 * ((x - position) * (FWHM_PER_SIGMA / fwhm))**2)
 
-        posIdx = 1  # ..2nd argument of fitp is peak position
-        shift0 = fitList[idx0][posIdx]
-        shiftList = [shift0-fit[posIdx] for fit in fitList]
+    @staticmethod
+    def _jacobian(parameters, x):
+        height, position, fwhm = [parameters[:, idx, numpy.newaxis] for idx in range(3)]
+        u = (x - position) * (FWHM_PER_SIGMA / fwhm)
+        exponential = numpy.exp(-.5 * u**2)
+        model = height * exponential
+        dPosition = model * u * (FWHM_PER_SIGMA / fwhm)
+        dFwhm = model * u**2 / fwhm
+        return model, (exponential, dPosition, dFwhm)
 
-        #ddict = {
-        #    'op': 'fitAlignment',
-        #    'shiftList': shiftList
-        #}
-        #return ddict
-        return shiftList
+    @staticmethod
+    def _chisq(parameters, x, ydata, weights):
+        residuals = ydata - GaussianFitter.model(parameters, x)
+        return (weights * residuals**2).sum(axis=1)
+
+    @staticmethod
+    def _normalMatrix(derivatives, weights):
+        nCurves = weights.shape[0]
+        matrix = numpy.empty((nCurves, 3, 3))
+        for i in range(3):
+            weighted = weights * derivatives[i]
+            for j in range(i, 3):
+                matrix[:, i, j] = matrix[:, j, i] = (weighted * derivatives[j]).sum(axis=1)
+        return matrix
+
+    def fit(self, ydata, weights, initial):
+        """
+        :param ndarray ydata: Curves in rows, sampled at the positions 0, 1, 2, ...
+        :param ndarray weights: Weight of every point, points with weight zero are excluded from the fit
+        :param ndarray initial: Initial height, position and FWHM per curve, shape (number of curves, 3)
+
+        :returns: Fitted parameters, reduced chi-square, uncertainties of the parameters, convergence flags and the
+         number of iterations per curve. Curves with less than four points or invalid initial parameters are not
+         fitted, their parameters are NaN.
+        :rtype: dict
+        """
+        ydata = numpy.asarray(ydata, dtype=numpy.float64)
+        weights = numpy.asarray(weights, dtype=numpy.float64)
+        nCurves, nPoints = ydata.shape
+        x = numpy.arange(nPoints, dtype=numpy.float64)
+        diagonal = numpy.arange(3)
+
+        parameters = numpy.array(initial, dtype=numpy.float64)
+        # A vanishing FWHM leaves the position undetermined
+        parameters[:, 2] = numpy.where(numpy.abs(parameters[:, 2]) < 1., 1., parameters[:, 2])
+        degreesOfFreedom = weights.sum(axis=1) - 3
+        fitted = (degreesOfFreedom > 0) & numpy.isfinite(parameters).all(axis=1)
+
+        chisq = numpy.empty(nCurves)
+        chisq.fill(numpy.nan)
+        chisq[fitted] = self._chisq(parameters[fitted], x, ydata[fitted], weights[fitted])
+        damping = numpy.empty(nCurves)
+        damping.fill(1e-3)
+        converged = numpy.zeros(nCurves, dtype=bool)
+        iterations = numpy.zeros(nCurves, dtype=int)
+        active = fitted.copy()
+
+        for iteration in range(self.maxIterations):
+            indices = numpy.flatnonzero(active)
+            if not len(indices):
+                break
+            current = parameters[indices]
+            currentWeights = weights[indices]
+            model, derivatives = self._jacobian(current, x)
+            residuals = ydata[indices] - model
+            matrix = self._normalMatrix(derivatives, currentWeights)
+            gradient = numpy.column_stack([(currentWeights * derivative * residuals).sum(axis=1)
+                                           for derivative in derivatives])
+
+            damped = matrix.copy()
+            damped[:, diagonal, diagonal] *= 1. + damping[indices, numpy.newaxis]
+            # Solve all 3x3 systems at once, the pseudo inverse copes with singular matrices
+            step = numpy.einsum('kij,kj->ki', numpy.linalg.pinv(damped), gradient)
+            proposed = current + step
+            newChisq = self._chisq(proposed, x, ydata[indices], currentWeights)
+
+            oldChisq = chisq[indices]
+            improved = newChisq < oldChisq
+            accepted = indices[improved]
+            parameters[accepted] = proposed[improved]
+            chisq[accepted] = newChisq[improved]
+            damping[accepted] *= .1
+            damping[indices[~improved]] *= 10.
+            iterations[indices] += 1
+
+            tolerance = self.tolerance
+            smallDecrease = improved & ((oldChisq - newChisq) <= tolerance * numpy.maximum(oldChisq, 1e-300))
+            smallStep = (numpy.abs(step) <= tolerance * (numpy.abs(current) + tolerance)).all(axis=1)
+            done = smallDecrease | smallStep
+            converged[indices[done]] = True
+            active[indices[done | (damping[indices] > 1e16)]] = False
+
+        # Uncertainties from the covariance matrix at the solution
+        sigma = numpy.empty((nCurves, 3))
+        sigma.fill(numpy.nan)
+        reducedChisq = numpy.empty(nCurves)
+        reducedChisq.fill(numpy.nan)
+        if fitted.any():
+            model, derivatives = self._jacobian(parameters[fitted], x)
+            covariance = numpy.linalg.pinv(self._normalMatrix(derivatives, weights[fitted]))
+            reducedChisq[fitted] = chisq[fitted] / degreesOfFreedom[fitted]
+            variance = numpy.abs(covariance[:, diagonal, diagonal]) * reducedChisq[fitted, numpy.newaxis]
+            sigma[fitted] = numpy.sqrt(variance)
+        # The model only depends on the square of the FWHM
+        parameters[:, 2] = numpy.abs(parameters[:, 2])
+        parameters[~fitted] = numpy.nan
+
+        return {
+            'parameters': parameters,
+            'chisq': reducedChisq,
+            'sigma': sigma,
+            'converged': converged,
+            'iterations': iterations
+        }
+
+
+def fastFftSize(size):
+    """
+    :param int size: Minimal length of the transform
+    :returns: Smallest integer not smaller than size whose only prime factors are 2, 3 and 5
+    :rtype: int
+    """
+    if size <= 1:
+        return 1
+    best = 1
+    while best < size:
+        best *= 2
+    power5 = 1
+    while power5 < best:
+        power35 = power5
+        while power35 < best:
+            candidate = power35
+            while candidate < size:
+                candidate *= 2
+            best = min(best, candidate)
+            power35 *= 3
+        power5 *= 5
+    return best
+
+
+class FftCorrelator(object):
+    __doc__ = """Cross correlates curves with a reference curve using real valued FFTs. The transform of the reference
+    is computed once, so a correlator can be reused for all images aligned to the same reference. Curves are
+    transformed in chunks of FFT_CHUNKSIZE curves by a single two dimensional rFFT.
+
+    If the length of the curves is slow to transform, the curves are zero-padded to a fast size of at least twice
+    their length. The padded transforms yield the linear correlation, which is folded into the circular
+    correlation of the unpadded curves. The result is the same as without padding.
+
+    The forward and inverse transforms take the larger part of the run time, so the speedup over transforming the
+    curves one by one is limited by the FFT of numpy itself: about two to four times on a single core, not an order
+    of magnitude (c.f. :func:`benchmark_fftAlignment`).
+
+    .. py:attribute:: length
+
+        Number of points of the reference curve
+
+    .. py:attribute:: size
+
+        Length of the transforms. If larger than length, the curves are zero-padded"""
+
+    def __init__(self, reference, fastSize=True):
+        """
+        :param ndarray reference: Reference curve
+        :param bool fastSize: If True, curves are zero-padded to a length that is fast to transform
+         (c.f. :func:`fastFftSize`). Default: True
+        """
+        reference = numpy.asarray(reference, dtype=float)
+        self.length = len(reference)
+        self.size = self.length
+        if fastSize and fastFftSize(self.length) != self.length:
+            self.size = fastFftSize(2 * self.length - 1)
+        self._reference = numpy.fft.rfft(reference, n=self.size)
+
+    def correlate(self, curves):
+        """
+        :param ndarray curves: Two dimensional array, every row holding a curve of the length of the reference
+
+        :returns: Circular cross correlation of every curve with the reference, rolled by length // 2 such that
+         zero shift lies in the middle of a row
+        :rtype: ndarray
+        :raises ValueError: if the curves differ in length from the reference
+        """
+        nCurves, nPoints = curves.shape
+        if nPoints != self.length:
+            raise ValueError('FftCorrelator.correlate -- Curves have %d points, reference has %d'
+                             % (nPoints, self.length))
+        length = self.length
+        correlation = numpy.empty((nCurves, length))
+        middle = length // 2
+        for start in range(0, nCurves, FFT_CHUNKSIZE):
+            stop = min(start + FFT_CHUNKSIZE, nCurves)
+            spectra = numpy.fft.rfft(Alignment._contiguousCurves(curves[start:stop]), n=self.size, axis=1)
+            numpy.conjugate(spectra, out=spectra)
+            spectra *= self._reference
+            chunk = numpy.fft.irfft(spectra, n=self.size, axis=1)
+            if self.size != length:
+                # Fold the negative lags 1 - length, .., -1 of the linear correlation onto the positive lags
+                # 1, .., length - 1. Lag zero has no counterpart.
+                chunk[:, 1:length] += chunk[:, self.size - length + 1:]
+            correlation[start:stop, middle:] = chunk[:, :length - middle]
+            correlation[start:stop, :middle] = chunk[:, length - middle:length]
+        return correlation
+
+    def shifts(self, curves, portion=.8):
+        """
+        :param ndarray curves: Two dimensional array, every row holding a curve of the length of the reference
+        :param float portion: Fraction of the maximum of the normalized correlation delimiting its peak
+
+        The shift of a curve is the center of mass of the peak of its correlation with the reference. The peak
+        reaches from the maximum to the nearest points on both sides below portion, at most to the ends of the
+        correlation.
+
+        :returns: Shifts in channels. Curves with constant correlation are assigned NaN
+        :rtype: ndarray
+        """
+        correlation = self.correlate(curves)
+        nCurves, size = correlation.shape
+
+        # Normalize correlation between 0 and 1 to standardize thresholding
+        minima = correlation.min(axis=1)
+        normFactor = correlation.max(axis=1) - minima
+        valid = ~(normFactor <= 0)
+        if not valid.all():
+            correlation = correlation[valid]
+        correlation -= minima[valid, numpy.newaxis]
+        correlation /= normFactor[valid, numpy.newaxis]
+
+        # Thresholding: The noisier the data is, the more likely it is for the
+        # normalization to be ineffective, i.e. the whole range of the correlation
+        # is used later on.
+        left, right = Alignment._peakBounds(correlation < portion, correlation.argmax(axis=1))
+        numpy.clip(left, 0, size - 1, out=left)
+        numpy.clip(right, 0, size - 1, out=right)
+        window, weights = Alignment._peakWindows(correlation, left, right)
+
+        shiftArray = numpy.empty(nCurves)
+        shiftArray.fill(float('NaN'))
+        # The shift is determined by center-of-mass around the maximum
+        shiftArray[valid] = (weights * window).sum(axis=1) / weights.sum(axis=1) - size // 2
+        return shiftArray
 
 
 class Interpolation(ImageOp):
@@ -851,6 +1498,310 @@ class SlopeCorrection(object):
         return smileFunction
 
 
+def benchmark_bandPassFilter(shape=(2048, 2048), numImages=10):
+    """
+    Compares the former band pass filter implementation to :func:`Filter.bandPass` on numImages frames of the given
+    shape.
+    """
+    import time
+
+    def legacyBandPassFilter(image, params):
+        imMin = image.min()
+        imMax = image.max()
+        lo = params.get('low', imMin)
+        hi = params.get('high', imMax)
+        offset = params.get('offset', 0.)
+        replace = params.get('replace', 0.)
+        out = image.astype(type(offset)) - offset
+        out = numpy.where((lo <= out), out, replace)
+        out = numpy.where((out <= hi), out, replace)
+        return out
+
+    stack = numpy.random.poisson(120., (numImages,) + tuple(shape)).astype(numpy.uint16)
+    params = {'offset': 114., 'low': 8., 'high': 803., 'replace': 0.}
+
+    timeStart = time.time()
+    reference = [legacyBandPassFilter(image, params) for image in stack]
+    timeLegacy = (time.time() - timeStart) / numImages
+
+    timeStart = time.time()
+    results = [Filter.bandPassFilter(image, params) for image in stack]
+    timeFilter = (time.time() - timeStart) / numImages
+
+    out = numpy.empty(shape, dtype=numpy.float32)
+    timeStart = time.time()
+    for image in stack:
+        Filter.bandPass(image, 8., 803., 114., out=out)
+    timeBuffer = (time.time() - timeStart) / numImages
+
+    timeStart = time.time()
+    filteredStack = Filter.bandPassStack(stack, 8., 803., 114.)
+    timeStack = (time.time() - timeStart) / numImages
+
+    success = all(numpy.array_equal(ref, res) for ref, res in zip(reference, results)) \
+        and numpy.allclose(filteredStack, numpy.asarray(reference, dtype=numpy.float32))
+    print('Operations.benchmark -- band pass filter on %d images of shape %s' % (numImages, str(shape)))
+    print('\tlegacy implementation:            %.4f s per image' % timeLegacy)
+    print('\tFilter.bandPassFilter (float64):   %.4f s per image' % timeFilter)
+    print('\tFilter.bandPass (float32, buffer): %.4f s per image' % timeBuffer)
+    print('\tFilter.bandPassStack (float32):    %.4f s per image' % timeStack)
+    print('\tresults identical: %s' % str(success))
+    return success
+
+
+def benchmark_bandPassFilterID32(shape=(2048, 2048), numImages=20):
+    """
+    Compares filtering numImages frames one by one using :func:`Filter.bandPassFilterID32` to
+    :func:`Filter.bandPassFilterID32Batch` on a stack and on a list of :class:`Items.ImageItem`.
+    """
+    import time
+    from RixsTool.Items import ImageItem
+
+    stack = numpy.random.poisson(150., (numImages,) + tuple(shape)).astype(numpy.uint16)
+    energies = numpy.linspace(925., 935., numImages)
+    itemList = [ImageItem('image%03d.edf' % idx, {'energy': '%.3f' % energies[idx], 'preset': '300', 'binning': '4'},
+                          stack[idx], None)
+                for idx in range(numImages)]
+
+    timeStart = time.time()
+    reference = [Filter.bandPassFilterID32(item.array, {'energy': energy}) for item, energy in zip(itemList, energies)]
+    timeSingle = (time.time() - timeStart) / numImages
+
+    filteredItems = numpy.empty(stack.shape, dtype=numpy.float32)
+    timeStart = time.time()
+    for start, chunk in Filter.bandPassFilterID32Batch(itemList):
+        filteredItems[start:start + len(chunk)] = chunk
+    timeItems = (time.time() - timeStart) / numImages
+
+    timeStart = time.time()
+    for start, chunk in Filter.bandPassFilterID32Batch(stack, {'energy': 931.942}):
+        pass
+    timeStack = (time.time() - timeStart) / numImages
+
+    timeStart = time.time()
+    stack.astype(numpy.float32)
+    timeCopy = (time.time() - timeStart) / numImages
+
+    success = numpy.allclose(filteredItems, numpy.asarray(reference, dtype=numpy.float32))
+    print('Operations.benchmark -- ID32 band pass filter on %d images of shape %s' % (numImages, str(shape)))
+    print('\tbandPassFilterID32 per image:        %.4f s per image' % timeSingle)
+    print('\tbandPassFilterID32Batch, ImageItems: %.4f s per image' % timeItems)
+    print('\tbandPassFilterID32Batch, stack:      %.4f s per image' % timeStack)
+    print('\tsingle pass stack.astype(float32):   %.4f s per image' % timeCopy)
+    print('\tresults identical: %s' % str(success))
+    return success
+
+
+def benchmark_Alignment(shape=(2048, 2048), numRepeats=5):
+    """
+    Compares the former curve by curve implementations of :func:`Alignment.maxAlignment` and
+    :func:`Alignment.centerOfMassAlignment` to the current ones on an image of shifted gaussian peaks.
+    """
+    import time
+
+    def legacyMaxAlignment(curves, idx0=0):
+        pos0 = curves[idx0].argmax()
+        return numpy.asarray([pos0 - y.argmax() for y in curves])
+
+    def legacyCenterOfMassAlignment(curves, idx0=0, portion=.8):
+        trapz = getattr(numpy, 'trapz', None) or numpy.trapezoid
+
+        def centroid(ynormed, threshold):
+            idxMax = ynormed.argmax()
+            left, right = idxMax, idxMax
+            while ynormed[left] > threshold:
+                left -= 1
+            while ynormed[right] > threshold:
+                right += 1
+            mask = numpy.arange(left, right+1, dtype=int)
+            return trapz(ynormed[mask] * mask) / trapz(ynormed[mask])
+        y0 = curves[idx0]
+        ynormed0 = (y0 - y0.min()) / (y0.max() - y0.min())
+        threshold = portion * float(ynormed0[ynormed0.argmax()])
+        pos0 = centroid(ynormed0, threshold)
+        shiftList = []
+        for y in curves:
+            shiftList += [pos0 - centroid((y - y.min()) / (y.max() - y.min()), threshold)]
+        return numpy.asarray(shiftList)
+
+    nPoints, nCurves = shape
+    x = numpy.arange(nPoints)
+    centers = nPoints / 2. + 20. * numpy.sin(numpy.linspace(0, numpy.pi, nCurves))
+    image = 100. * numpy.exp(-.5 * ((x[:, numpy.newaxis] - centers) / 15.)**2)
+    image += numpy.random.poisson(2., shape)
+    curves = image.T
+
+    results = {}
+    for name, legacy, current in [('maxAlignment', legacyMaxAlignment, Alignment.maxAlignment),
+                                  ('centerOfMassAlignment', legacyCenterOfMassAlignment,
+                                   Alignment.centerOfMassAlignment)]:
+        timeStart = time.time()
+        for idx in range(numRepeats):
+            reference = legacy(curves)
+        timeLegacy = (time.time() - timeStart) / numRepeats
+        timeStart = time.time()
+        for idx in range(numRepeats):
+            shifts = current(image, {'axis': 1})
+        timeCurrent = (time.time() - timeStart) / numRepeats
+        deviation = numpy.abs(shifts - reference).max()
+        results[name] = deviation < 1e-9
+        print('Operations.benchmark -- %s on %d curves of %d points' % (name, nCurves, nPoints))
+        print('\tcurve by curve: %.4f s' % timeLegacy)
+        print('\tvectorized:     %.4f s (speedup: %.1f)' % (timeCurrent, timeLegacy / timeCurrent))
+        print('\tmaximal deviation of the shifts: %.2e' % deviation)
+    return all(results.values())
+
+
+def unitTest_FftCorrelator(lengths=(997, 1013, 1024, 2047)):
+    """
+    Compares the correlations of curves zero-padded to a fast FFT size to the unpadded ones. The lengths include
+    1013, whose linear correlation of 2 * 1013 - 1 = 2025 points already has a fast size, so that nothing is
+    padded beyond it.
+    """
+    result = True
+    for length in lengths:
+        curves = numpy.random.random((5, length))
+        padded = FftCorrelator(curves[0], fastSize=True)
+        unpadded = FftCorrelator(curves[0], fastSize=False)
+        deviation = numpy.abs(padded.correlate(curves) - unpadded.correlate(curves)).max()
+        print('Operations.unitTest_FftCorrelator -- %d points, FFT size %d: maximal deviation %.2e'
+              % (length, padded.size, deviation))
+        result = result and deviation < 1e-8
+    return result
+
+
+def benchmark_fftAlignment(shape=(2048, 2048), numRepeats=3):
+    """
+    Compares the former curve by curve implementation of :func:`Alignment.fftAlignment` to the current one on an
+    image of shifted gaussian peaks. The current implementation is timed with and without zero-padding to fast FFT
+    sizes and with a cached reference transform. The time of the bare forward and inverse transforms of all curves
+    is printed as the bound of the achievable speedup.
+    """
+    import time
+
+    def legacyFftAlignment(curves, idx0=0, portion=.8):
+        window = numpy.arange(0, curves.shape[1] - 1)
+        fft0 = numpy.fft.fft(curves[idx0][window])
+        shiftList = []
+        for y in curves:
+            shiftTmp = numpy.fft.ifft(fft0 * numpy.fft.fft(y[window]).conjugate()).real
+            m = shiftTmp.size//2
+            shiftPhase = numpy.roll(shiftTmp, m)
+            shiftPhase = (shiftPhase - shiftPhase.min()) / (shiftPhase.max() - shiftPhase.min())
+            left = right = shiftPhase.argmax()
+            while shiftPhase[left] >= portion and left > 0:
+                left -= 1
+            while shiftPhase[right] >= portion and right < len(shiftPhase) - 1:
+                right += 1
+            mask = numpy.arange(left, right+1)
+            shiftList += [numpy.sum((shiftPhase[mask] * mask/shiftPhase[mask].sum())) - m]
+        return numpy.asarray(shiftList)
+
+    nPoints, nCurves = shape
+    x = numpy.arange(nPoints)
+    centers = nPoints / 2. + 20. * numpy.sin(numpy.linspace(0, numpy.pi, nCurves))
+    image = 100. * numpy.exp(-.5 * ((x[:, numpy.newaxis] - centers) / 15.)**2)
+    image += numpy.random.poisson(2., shape)
+
+    timeStart = time.time()
+    for idx in range(numRepeats):
+        reference = legacyFftAlignment(image.T)
+    timeLegacy = (time.time() - timeStart) / numRepeats
+
+    timeStart = time.time()
+    for idx in range(numRepeats):
+        shifts = Alignment.fftAlignment(image, {'axis': 1})
+    timeCurrent = (time.time() - timeStart) / numRepeats
+
+    correlator = FftCorrelator(image[:-1, 0])
+    curves = numpy.ascontiguousarray(image[:-1].T)
+    timeStart = time.time()
+    for idx in range(numRepeats):
+        numpy.fft.irfft(numpy.fft.rfft(curves, n=correlator.size, axis=1), n=correlator.size, axis=1)
+    timeTransforms = (time.time() - timeStart) / numRepeats
+
+    timeStart = time.time()
+    for idx in range(numRepeats):
+        Alignment.fftAlignment(image, {'axis': 1, 'correlator': correlator})
+    timeCached = (time.time() - timeStart) / numRepeats
+
+    timeStart = time.time()
+    for idx in range(numRepeats):
+        unpadded = Alignment.fftAlignment(image, {'axis': 1, 'fastSize': False})
+    timeUnpadded = (time.time() - timeStart) / numRepeats
+
+    deviation = numpy.abs(shifts - reference).max()
+    print('Operations.benchmark -- fftAlignment on %d curves of %d points' % (nCurves, nPoints))
+    print('\tcurve by curve:                %.4f s' % timeLegacy)
+    print('\tbatched rFFT, unpadded:        %.4f s (speedup: %.1f)' % (timeUnpadded, timeLegacy / timeUnpadded))
+    print('\tbatched rFFT, size %5d:       %.4f s (speedup: %.1f)'
+          % (correlator.size, timeCurrent, timeLegacy / timeCurrent))
+    print('\tbatched rFFT, cached ref.:     %.4f s (speedup: %.1f)' % (timeCached, timeLegacy / timeCached))
+    print('\trFFT and inverse alone:        %.4f s (speedup limit: %.1f)'
+          % (timeTransforms, timeLegacy / timeTransforms))
+    print('\tmaximal deviation of the shifts: %.2e (unpadded: %.2e)'
+          % (deviation, numpy.abs(unpadded - reference).max()))
+    return deviation < 1e-6
+
+
+def unitTest_fitAlignment(numCurves=50, numPoints=512, tolerance=.5):
+    """
+    Compares the peak positions fitted by :func:`Alignment.fitAlignmentReport` in batch mode to the ones of PyMca's
+    LeastSquaresFit (mode lsf) on curves of gaussian peaks on a linear background. Skipped if PyMca is not available.
+    """
+    if LSF is None:
+        print('Operations.unitTest_fitAlignment -- PyMca not available, skipped')
+        return True
+    x = numpy.arange(numPoints)
+    centers = numPoints / 2. + 20. * numpy.sin(numpy.linspace(0, numpy.pi, numCurves))
+    fwhm = 35.
+    image = 100. * numpy.exp(-.5 * ((x[:, numpy.newaxis] - centers) * (FWHM_PER_SIGMA / fwhm))**2)
+    image += (5. + .02 * x)[:, numpy.newaxis]
+    image = numpy.random.poisson(image).astype(float)
+
+    batch = Alignment.fitAlignmentReport(image, {'axis': 1, 'mode': 'batch'})['parameters'][:, 1]
+    lsf = Alignment.fitAlignmentReport(image, {'axis': 1, 'mode': 'lsf'})['parameters'][:, 1]
+    deviation = numpy.abs(batch - lsf).max()
+    print('Operations.unitTest_fitAlignment -- maximal deviation of batch and lsf positions: %.3f points'
+          % deviation)
+    return bool(deviation < tolerance)
+
+
+def benchmark_fitAlignment(numCurves=1000, numPoints=512):
+    """
+    Fits gaussian peaks on a linear background to numCurves curves using :func:`Alignment.fitAlignmentReport` in
+    batch mode and compares the fitted positions to the true ones. If PyMca's LeastSquaresFit is available, the
+    curve by curve fit and the fit distributed over a process pool are timed as well.
+    """
+    import time
+
+    x = numpy.arange(numPoints)
+    centers = numPoints / 2. + 20. * numpy.sin(numpy.linspace(0, numpy.pi, numCurves))
+    fwhm = 35.
+    image = 100. * numpy.exp(-.5 * ((x[:, numpy.newaxis] - centers) * (FWHM_PER_SIGMA / fwhm))**2)
+    image += (5. + .02 * x)[:, numpy.newaxis]
+    image = numpy.random.poisson(image).astype(float)
+
+    timeStart = time.time()
+    report = Alignment.fitAlignmentReport(image, {'axis': 1, 'mode': 'batch'})
+    timeBatch = time.time() - timeStart
+    deviation = numpy.abs(report['parameters'][:, 1] - centers).max()
+    print('Operations.benchmark -- fitAlignment on %d curves of %d points' % (numCurves, numPoints))
+    print('\tbatch:          %.4f s, %d of %d converged, max. %d iterations'
+          % (timeBatch, report['converged'].sum(), numCurves, report['iterations'].max()))
+    print('\tmaximal deviation of the positions: %.3f points' % deviation)
+
+    for mode in ['lsf', 'pool']:
+        if LSF is None:
+            print('\t%-15s not available without PyMca' % (mode + ':'))
+            continue
+        timeStart = time.time()
+        Alignment.fitAlignmentReport(image, {'axis': 1, 'mode': mode})
+        timeMode = time.time() - timeStart
+        print('\t%-15s %.4f s (batch speedup: %.1f)' % (mode + ':', timeMode, timeMode / timeBatch))
+    return deviation < 2.
+
+
 def run_test():
 
     from matplotlib import pyplot as plt
@@ -873,11 +1824,15 @@ def run_test():
 
     return
 
-    itemList = [child.item() for child in project['Images'].children]
-    filteredList = [Filter.bandPassFilterID32(item.array, {}) for item in itemList]
-    #polyList = [SlopeCorrection.slopeCorrection(arr, 64) for arr in filteredList]
-    polyList = [SlopeCorrection.slopeCorrection(im, 128) for im in filteredList]
-    corretedList = [SlopeCorrection.alignImage(im, func) for im, func in zip(filteredList, polyList)]
+    itemList = [node.item() for node in project['Images'].preOrder() if node.hasItem()]
+    polyList = []
+    summedList = []
+    for start, chunk in Filter.bandPassFilterID32Batch(itemList):
+        for im in chunk:
+            #poly = SlopeCorrection.slopeCorrection(im, 64)
+            poly = SlopeCorrection.slopeCorrection(im, 128)
+            polyList += [poly]
+            summedList += [SlopeCorrection.alignImage(im, poly).sum(axis=1)[::-1]]
 
     '''
     a = [float('Nan')] * len(polyList)
@@ -891,8 +1846,7 @@ def run_test():
     '''
 
     f = open('/home/truter/lab/rixs_own/all.dat', 'w')
-    for idx, (item, im) in enumerate(zip(itemList, corretedList)):
-        summed = im.sum(axis=1)[::-1]
+    for idx, (item, summed) in enumerate(zip(itemList, summedList)):
         points = numpy.arange(len(summed))
 
         f.write('#S %d\n' % idx)
@@ -908,7 +1862,7 @@ def run_test():
     #poly0 = SlopeCorrection.slopeCorrection(filtered, 16, (940, 1030))
 
     poly = FunctionItem('', '')
-    expression = lambda x, a, b, c: a * x**2 + b * x + c
+    expression = 'lambda x, a, b, c: a * x**2 + b * x + c'
     parameters = {
         'a': -5.25213*10**-5,
         'b': 0.18877,
@@ -27,16 +27,67 @@
 __author__ = "Tonn Rueter - ESRF Data Analysis Unit"
 
 from os.path import abspath as OsAbsPath  # Better than normalized, absolute version of path
-from os.path import splitext as OsPathSplitext
 from os.path import join as OsPathJoin
 from os import walk as OsWalk
+from os import stat as OsStat
+from multiprocessing.pool import ThreadPool
+from multiprocessing import Pool as ProcessPool
 from RixsTool.ItemContainer import ItemContainer
 
-from RixsTool.IO import IODict
+from RixsTool.IO import IODict, Hdf5Project, UnknownFileType
+from RixsTool.CrawlIndex import CrawlIndex, INDEX_FILENAME
+from RixsTool.HeaderIndex import HeaderIndex, headerFields
+from RixsTool.Grouping import GROUP_SEPARATOR
 from RixsTool.Items import SpecItem, ScanItem, ImageItem, StackItem
 
 DEBUG = 0
 
+#
+# Number of items crawl collects before adding them to the project in one batch
+#
+CRAWL_BATCHSIZE = 1000
+
+#
+# Input readers used by the worker processes of a concurrent crawl
+#
+_workerReaders = IODict.inputReaderDict()
+_workerSniffCache = {}
+
+
+def readFile(fileName, inputReaders, sniffCache=None):
+    """
+    :param str fileName: File name including path to file
+    :param dict inputReaders: Maps file types to :class:`IO.InputReader` instances
+    :param dict sniffCache: Formats sniffed per directory (c.f. :func:`IO.IODict.sniff`). Default: None
+
+    :returns: List of raw data items read from the file
+    :rtype: list
+    :raises UnknownFileType: if the file type is unknown
+    """
+    # Identify the file type from the content of the file
+    fileType = IODict.sniff(fileName, inputReaders, sniffCache)
+    if DEBUG >= 1:
+        print("RixsProject.read -- Received '%s' file" % fileType)
+    if fileType in inputReaders.keys():
+        reader = inputReaders[fileType]
+    else:
+        raise UnknownFileType("RixsProject.read -- Unknown file type '%s'" % fileType)
+    return reader.itemize(fileName)
+
+
+def _crawlWorker(fileName):
+    """
+    Reads a single file on a worker process of :func:`RixsProject.crawl`.
+
+    :returns: 3-tuple containing the file name, the list of items and the error that occurred, if any
+    :rtype: tuple
+    """
+    try:
+        itemList = readFile(fileName, _workerReaders, _workerSniffCache)
+    except Exception as error:
+        return fileName, [], error
+    return fileName, itemList, None
+
 
 class RixsProject(object):
 
@@ -48,8 +99,12 @@ class RixsProject(object):
     On the top level, the tree divides the data items in containers depeding on the  dimensionality of their data.
     Two dimensional input for example is treated as an image.
 
-    **TODO**:
-        * Implement HDF Backend..
+    The whole tree can be stored in a HDF5 file using :func:`RixsProject.save` and restored by
+    :func:`RixsProject.load`.
+
+    The header fields of all items are indexed when the items are added, :func:`RixsProject.query` selects items
+    by their header fields without reading any data. Grouping rules sort new items into nested groups according
+    to their header fields (c.f. :func:`RixsProject.setGroupingRules`).
     """
 
     def __init__(self):
@@ -57,11 +112,20 @@ class RixsProject(object):
         # Input readers
         #
         self.inputReaders = IODict.inputReaderDict()
+        self._sniffCache = {}
 
         #
-        # Identifier dict
+        # Indexes mapping keys respectively identifiers to containers
         #
-        self.__idDict = {}
+        self.__containerDict = {}
+        self.__identifierDict = {}
+        self._headerIndex = HeaderIndex()
+        self._parsedFields = {}
+
+        #
+        # Rules sorting new items into nested groups, c.f. setGroupingRules
+        #
+        self.groupingRules = []
 
         #
         # Data tree
@@ -71,21 +135,29 @@ class RixsProject(object):
         #    [ItemContainer(parent=self.projectRoot, label=key)\
         #     for key in ['Spectra', 'Images', 'Stacks']])
         for label in ['Spectra', 'Images', 'Stacks']:
-            self.addGroup(label)
+            # Child classes are not initialized yet, bypass their insertion hook
+            RixsProject._insertContainers(self, self.projectRoot, [ItemContainer(parent=self.projectRoot, label=label)])
         if DEBUG >= 1:
             print('RixsProject.__init__ -- projectRoot.childCount: %d' % self.projectRoot.childCount())
-            print('RixsProject.__init__ -- projectRoot.__idDict: %s' % str(self.__idDict))
+            print('RixsProject.__init__ -- projectRoot.__containerDict: %s' % str(self.__containerDict))
 
     def __getitem__(self, key):
-        result = None
-        identifier = self.__idDict[key]
-        for container in self._traverseDFS(self.projectRoot):
-            if container.getID() == identifier:
-                result = container
-                break
-        if not result:
-            raise KeyError()
-        return result
+        """
+        :param str key: Key of an item respectively label of a group
+        :returns: Container stored under key
+        :rtype: ItemContainer
+        :raises KeyError: if the key is not present
+        """
+        return self.__containerDict[key]
+
+    def containerByID(self, identifier):
+        """
+        :param identifier: Identifier of a container, c.f. :func:`ItemContainer.getID`
+        :returns: Container with the given identifier
+        :rtype: ItemContainer
+        :raises KeyError: if the identifier is not present
+        """
+        return self.__identifierDict[identifier]
 
     def __contains__(self, item):
         """
@@ -100,24 +172,43 @@ class RixsProject(object):
         :raises ValueError: If the provided item is neither of type string nor an ItemContainer
         """
         if isinstance(item, str):
-            llist = self.__idDict.keys()
+            return item in self.__containerDict
         elif isinstance(item, ItemContainer):
-            item = item.getID()
-            llist = self.__idDict.values()
+            return item.getID() in self.__identifierDict
         else:
             raise ValueError('RixsProject.__contains__ -- Argument must be of type string or ItemContainer')
-        return item in llist
 
     def getIdDict(self):
         # TODO: Function for debugging purposes
-        return self.__idDict
+        return dict((key, container.getID()) for key, container in self.__containerDict.items())
+
+    def _register(self, container):
+        """
+        :param ItemContainer container: Container to add to the indexes under its label
+        """
+        self.__containerDict[container.label] = container
+        self.__identifierDict[container.getID()] = container
+        if container.hasItem():
+            fields = self._parsedFields.pop(container.getID(), None)
+            self._headerIndex.add(container.getID(), container.item().header, fields)
+
+    def _unregister(self, container):
+        """
+        :param ItemContainer container: Container to remove from the indexes
+        """
+        del(self.__containerDict[container.label])
+        del(self.__identifierDict[container.getID()])
+        if container.hasItem():
+            self._headerIndex.remove(container.getID())
 
     @staticmethod
     def _traverseDFS(root):
-        yield root
-        for child in root.children:
-            for container in RixsProject._traverseDFS(child):
-                yield container
+        """
+        :param ItemContainer root: Root of the subtree
+        :returns: Generator over the subtree in pre-order, c.f. :func:`ItemContainer.preOrder`
+        :rtype: generator
+        """
+        return root.preOrder()
 
     def groupCount(self):
         return self.projectRoot.childCount()
@@ -158,12 +249,85 @@ class RixsProject(object):
         :returns: Container of item
         :rtype: ItemContainer
         :raises TypeError: if the item type is unknown
-        :raises ValueError: if the item.key() is already present
+        :raises ValueError: if the item.key() is already present or clashes with a group label
         """
         if DEBUG >= 1:
             print('RixsProject.addItem -- called')
-        if item.key() in self.__idDict:
+        if item.key() in self.__containerDict:
             raise ValueError("RixsProject.addItem -- Item key '%s' already present" % item.key())
+        fields = headerFields(item.header) if len(self.groupingRules) else None
+        node = self._destination(item, fields)
+        container = ItemContainer(
+            item=item,
+            parent=node
+        )
+        if fields is not None:
+            self._parsedFields[container.getID()] = fields
+        self._insertContainers(node, [container])
+        return container
+
+    def addItems(self, itemList):
+        """
+        :param iterable itemList: Items to be inserted into the project tree
+
+        Batch version of :func:`RixsProject.addItem`. The new containers are grouped by their insertion node and
+        every group is appended to its node in a single step (c.f. :func:`RixsProject._insertContainers`). Items
+        that can not be added do not prevent the other items from being added. The header of every item is parsed
+        once, the result is used for grouping as well as for the header index.
+
+        :returns: 2-tuple containing the list of new containers and a list of 2-tuples of every item that could not
+         be added together with the error (TypeError or ValueError, c.f. :func:`RixsProject.addItem`)
+        :rtype: tuple
+        """
+        if DEBUG >= 1:
+            print('RixsProject.addItems -- called')
+        groups = []
+        groupDict = {}
+        newKeys = set()
+        containerList = []
+        failures = []
+        for item in itemList:
+            key = item.key()
+            if key in self.__containerDict or key in newKeys:
+                failures += [(item, ValueError("RixsProject.addItems -- Item key '%s' already present" % key))]
+                continue
+            try:
+                fields = headerFields(item.header) if len(self.groupingRules) else None
+                node = self._destination(item, fields, newKeys)
+            except (TypeError, ValueError) as error:
+                failures += [(item, error)]
+                continue
+            newKeys.add(key)
+            if node.getID() not in groupDict:
+                groupDict[node.getID()] = []
+                groups += [(node, groupDict[node.getID()])]
+            container = ItemContainer(
+                item=item,
+                parent=node
+            )
+            if fields is not None:
+                self._parsedFields[container.getID()] = fields
+            groupDict[node.getID()] += [container]
+            containerList += [container]
+        for node, group in groups:
+            self._insertContainers(node, group)
+        return containerList, failures
+
+    def _destination(self, item, fields=None, reserved=()):
+        """
+        :param ProjectItem item: Item to be inserted into the project tree
+        :param dict fields: Parsed header fields of the item, required if grouping rules are set. Default: None
+        :param set reserved: Keys of items about to be added that may not be used as group labels. Default: empty
+
+        The top level container is determined by the item type. Below it, every grouping rule that applies to the
+        item selects a sub group. Sub groups that do not exist yet are created, but only after the labels of all
+        levels have been determined and checked. If the item is rejected, the tree is left unchanged.
+
+        :returns: Container the item is inserted in
+        :rtype: ItemContainer
+        :raises TypeError: if the item type is unknown
+        :raises ValueError: if a group label is already used by an item
+        """
         if isinstance(item, ScanItem) or isinstance(item, SpecItem):
             node = self.projectRoot.children[0]
         elif isinstance(item, ImageItem):
@@ -172,13 +336,48 @@ class RixsProject(object):
             node = self.projectRoot.children[2]
         else:
             raise TypeError("RixsProject.addItem -- unknown item type '%s'" % type(item))
-        container = ItemContainer(
-            item=item,
-            parent=node
-        )
-        node.addChildren([container])
-        self.__idDict[item.key()] = container.getID()
-        return container
+        labels = []
+        label = node.label
+        for rule in self.groupingRules:
+            if not rule.appliesTo(item):
+                continue
+            label = label + GROUP_SEPARATOR + rule.groupName(fields)
+            group = self.__containerDict.get(label)
+            if (group is not None and group.hasItem()) or label == item.key() or label in reserved:
+                raise ValueError("RixsProject.addItem -- Group label '%s' already used by an item" % label)
+            labels += [label]
+        for label in labels:
+            group = self.__containerDict.get(label)
+            if group is None:
+                group = RixsProject.addGroup(self, label, node)
+            node = group
+        return node
+
+    def setGroupingRules(self, ruleList):
+        """
+        :param list ruleList: Instances of :class:`Grouping.GroupingRule`
+
+        Items added to the project are sorted into nested groups below the group of their type, every rule that
+        applies to an item adds one level. For example the rules
+
+        [GroupingRule('sample'), GroupingRule('energy', binWidth=.5)]
+
+        insert an image into a group labeled 'Images/sample: Cu/energy: 930.5'. Items already in the project are
+        not moved.
+        """
+        self.groupingRules = list(ruleList)
+
+    def _insertContainers(self, node, containerList):
+        """
+        :param ItemContainer node: Container the new containers are appended to
+        :param list containerList: New containers
+
+        Appends the containers to node and adds them to the indexes of the project. Child classes reimplement this
+        method to be notified about insertions (c.f. :class:`Models.ProjectModel`).
+        """
+        node.addChildren(containerList)
+        for container in containerList:
+            self._register(container)
 
     def addGroup(self, label, node=None):
         """
@@ -193,7 +392,7 @@ class RixsProject(object):
         """
         if DEBUG >= 1:
             print('RixsProject.addItem -- called')
-        if label in self.__idDict:
+        if label in self.__containerDict:
             raise ValueError("RixsProject.addItem -- Item key '%s' already present" % label)
         if not node:
             node = self.projectRoot
@@ -202,70 +401,353 @@ class RixsProject(object):
             parent=node,
             label=label
         )
-        node.addChildren([container])
-        self.__idDict[container.label] = container.getID()
+        self._insertContainers(node, [container])
         return container
 
     def removeContainer(self, label):
+        """
+        :param str label: Key of an item respectively label of a group
+
+        Removes the container and all of its descendants from the project. The subtree is collected in a single
+        traversal before anything is changed, the removal takes linear time in the size of the subtree.
+
+        :raises KeyError: if the label is not present
+        """
         container = self.__getitem__(label)
         if container.childCount():
             if DEBUG >= 1:
                 print('RixsProject.removeContainer -- Has children')
-            for child in container.children:
-                self.removeContainer(child.label)
+        subtree = list(container.preOrder())
+        for descendant in subtree:
+            self._unregister(descendant)
         parentContainer = container.parent
-        idx = container.childNumber()
-        del(parentContainer.children[idx])
-        del(self.__idDict[label])
+        parentContainer.removeChildren(container.childNumber())
+        container.parent = None
+
+    def rename(self, label, newLabel):
+        """
+        :param str label: Key of an item respectively label of a group
+        :param str newLabel: New key respectively label
+
+        Changes the label of a container. If the container holds an item, the key of the item is changed as well.
+
+        :returns: Renamed container
+        :rtype: ItemContainer
+        :raises KeyError: if the label is not present
+        :raises ValueError: if newLabel is already present
+        """
+        container = self.__getitem__(label)
+        if newLabel == label:
+            return container
+        if newLabel in self.__containerDict:
+            raise ValueError("RixsProject.rename -- Item key '%s' already present" % newLabel)
+        self._unregister(container)
+        container.label = newLabel
+        if container.hasItem():
+            container.item().setKey(newLabel)
+        self._register(container)
+        return container
+
+    def headerFields(self):
+        """
+        :returns: Names of the header fields that can be used in :func:`RixsProject.query`
+        :rtype: list
+        """
+        return self._headerIndex.fields()
+
+    def query(self, conditions=None, itemType=None, **kwargs):
+        """
+        :param dict conditions: Maps header field names to conditions. Default: None
+        :param type itemType: Restricts the result to items of this type, e.g. :class:`Items.ImageItem`. Default: None
+        :param kwargs: Further conditions given as keyword arguments
+
+        Selects the containers whose items match all conditions. A condition is either a single value the header
+        field must equal or a 2-tuple (low, high) giving an inclusive range, None leaves one side of the range open.
+        Field names are case insensitive, numerical header values are compared as numbers.
+
+        Example: project.query(energy=(930., 935.), preset=300)
+
+        The query is answered from the header index and does not access any array data.
+
+        :returns: Matching containers in the order the items were added to the project
+        :rtype: list
+        :raises ValueError: if a range is not given as 2-tuple
+        """
+        conditions = dict(conditions) if conditions else {}
+        conditions.update(kwargs)
+        identifiers = self._headerIndex.select(conditions)
+        containerList = [self.__identifierDict[identifier] for identifier in sorted(identifiers)]
+        if itemType is not None:
+            containerList = [container for container in containerList if isinstance(container.item(), itemType)]
+        return containerList
+
+    def save(self, fileName):
+        """
+        :param str fileName: Name of the HDF5 project file
+
+        Writes the project tree including all items to fileName (c.f. :class:`IO.Hdf5Project`).
+
+        :raises ValueError: if a function item can not be stored
+        """
+        Hdf5Project.dump(self.projectRoot, fileName)
+
+    def load(self, fileName):
+        """
+        :param str fileName: Name of the HDF5 project file
+
+        Replaces the project tree by the tree stored in fileName. Array data is not read until it is accessed.
+
+        :raises ValueError: if the file is not a project file
+        """
+        projectRoot = Hdf5Project.load(fileName)
+        self.projectRoot = projectRoot
+        self.__containerDict = {}
+        self.__identifierDict = {}
+        self._headerIndex = HeaderIndex()
+        for container in self._traverseDFS(projectRoot):
+            if container is not projectRoot:
+                self._register(container)
 
     def read(self, fileName):
         """
         :param str fileName: File name including path to file
 
-        RixsProject stores a number of different reader for all sorts of file formats. The file stored under
-        file name is registered with a matching reader.
+        RixsProject stores a number of different reader for all sorts of file formats. The format of the file is
+        identified from its content and the file is read by the matching reader (c.f. :func:`IO.IODict.sniff`).
 
         :returns: List of raw data wrapped in :class:`datahandling.ItemContainer`
         :rtype: list
-        :raises TypeError: if the item type is unknown
+        :raises UnknownFileType: if the file type is unknown
         """
-        # Try to guess filetype
-        name, ext = OsPathSplitext(fileName)
-        fileType = ext.replace('.', '').lower()
-        if DEBUG >= 1:
-            print("RixsProject.read -- Received '%s' file" % fileType)
-        if fileType in self.inputReaders.keys():
-            reader = self.inputReaders[fileType]
-        else:
-            raise TypeError("RixsProject.read -- Unknown file type '%s'" % fileType)
-        itemList = reader.itemize(fileName)
-        return itemList
+        return readFile(fileName, self.inputReaders, self._sniffCache)
+
+    def _readSafely(self, fileName):
+        try:
+            itemList = self.read(fileName)
+        except Exception as error:
+            return fileName, [], error
+        return fileName, itemList, None
 
-    def crawl(self, directory):
+    def crawl(self, directory, workers=1, mode='thread', useIndex=False):
         """
         :param str directory: Root directory for the crawler to start
+        :param int workers: Number of files read concurrently. Default: 1, i.e. files are read one after another
+        :param str mode: Either 'thread' or 'process'. Determines if the files are read by a pool of worker threads
+         or worker processes. Default: 'thread'
+        :param bool useIndex: If True, the items of every file are stored in a :class:`CrawlIndex.CrawlIndex`. On
+         the next crawl of the directory, only new or modified files are read, the items of all other files are
+         restored from the index. Default: False
 
         Reads every file of known file type contained in directory and its subdirectories and adds it
-        to the project.
+        to the project. Directories and files are visited in alphabetical order and the items are added in
+        that order, independent of the number of workers.
+
+        :returns: List of 2-tuples containing the name of every file that could not be read or added together
+         with the error that occurred. Files of unknown type are skipped, every other error is reported.
+        :rtype: list
+        :raises ValueError: if the mode is unknown
         """
+        if mode not in ['thread', 'process']:
+            raise ValueError("RixsProject.crawl -- Unknown mode '%s'" % mode)
         walk = OsWalk(OsAbsPath(directory))
         if DEBUG >= 1:
             print("RixsProject.crawl -- crawling '%s'" % directory)
+        fileList = []
         for path, dirs, files in walk:
             if DEBUG >= 1:
                 print('RixsProject.crawl -- current path: %s' % path)
-            for ffile in files:
-                absName = OsPathJoin(path, ffile)
-                try:
-                    itemList = self.read(absName)
-                except TypeError:
+            dirs.sort()
+            fileList += [OsPathJoin(path, ffile) for ffile in sorted(files) if ffile != INDEX_FILENAME]
+
+        failures = []
+        pending = []
+        pool = None
+        index = None
+        try:
+            #
+            # Files that did not change since the last crawl are restored from the index
+            #
+            index = CrawlIndex(directory) if useIndex else None
+            fileStats = {}
+            readList = fileList
+            if index:
+                for absName in fileList:
+                    try:
+                        stat = OsStat(absName)
+                    except OSError as error:
+                        # E.g. dangling links or files removed during the walk
+                        if DEBUG >= 1:
+                            print("RixsProject.crawl -- failed to stat '%s': %s" % (absName, str(error)))
+                        failures += [(absName, error)]
+                        continue
+                    fileStats[absName] = (stat.st_size, stat.st_mtime)
+                fileList = [absName for absName in fileList if absName in fileStats]
+                readList = [absName for absName in fileList if not index.isCurrent(absName, *fileStats[absName])]
+                if DEBUG >= 1:
+                    print('RixsProject.crawl -- %d of %d files changed' % (len(readList), len(fileList)))
+
+            if workers > 1 and len(readList) > 1:
+                if mode == 'thread':
+                    #
+                    # Readers are stateless, worker threads share the readers of the project
+                    #
+                    pool = ThreadPool(workers)
+                    readResults = pool.imap(self._readSafely, readList, 1)
+                else:
+                    pool = ProcessPool(workers)
+                    chunkSize = max(1, len(readList) // (4 * workers))
+                    readResults = pool.imap(_crawlWorker, readList, chunkSize)
+            else:
+                readResults = (self._readSafely(absName) for absName in readList)
+
+            if index:
+                readSet = set(readList)
+                results = self._mergeIndexed(fileList, readResults, index, readSet)
+            else:
+                results = readResults
+
+            for absName, itemList, error in results:
+                # Only files that were read or identified as unknown are cached, read errors are retried
+                if index and absName in readSet and (error is None or isinstance(error, UnknownFileType)):
+                    index.update(absName, fileStats[absName][0], fileStats[absName][1], itemList)
+                if isinstance(error, UnknownFileType):
                     if DEBUG >= 1:
                         print("RixsProject.crawl -- unkown filetype '%s'" % absName)
                     continue
-                for item in itemList:
+                elif error is not None:
                     if DEBUG >= 1:
-                        print("RixsProject.crawl -- adding Item '%s'" % str(item))
-                    self.addItem(item)
+                        print("RixsProject.crawl -- failed to read '%s': %s" % (absName, str(error)))
+                    failures += [(absName, error)]
+                    continue
+                pending += [(absName, item) for item in itemList]
+                if len(pending) >= CRAWL_BATCHSIZE:
+                    failures += self._addPending(pending)
+                    pending = []
+            failures += self._addPending(pending)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            if index:
+                index.prune(fileList)
+                index.close()
+        return failures
+
+    def _addPending(self, pending):
+        """
+        :param list pending: 2-tuples containing file name and item
+
+        Adds the items in one batch, c.f. :func:`RixsProject.addItems`
+
+        :returns: List of 2-tuples containing file name and error for every item that could not be added
+        :rtype: list
+        """
+        if not len(pending):
+            return []
+        if DEBUG >= 1:
+            print('RixsProject.crawl -- adding %d items' % len(pending))
+        fileNames = dict((item.getID(), absName) for absName, item in pending)
+        containerList, failures = self.addItems([item for absName, item in pending])
+        return [(fileNames[item.getID()], error) for item, error in failures]
+
+    @staticmethod
+    def _mergeIndexed(fileList, readResults, index, readSet):
+        """
+        Yields the results for all files in fileList in order. Files in readSet are taken from readResults, the
+        items of all other files are restored from the index.
+        """
+        for absName in fileList:
+            if absName in readSet:
+                yield next(readResults)
+                continue
+            try:
+                itemList = index.items(absName)
+            except (KeyError, TypeError, ValueError) as error:
+                # Invalid entries are dropped, the file is read again on the next crawl
+                index.remove(absName)
+                yield absName, [], error
+                continue
+            yield absName, itemList, None
+
+
+def benchmark_RixsProject(numItems=100000, numLookups=100):
+    """
+    Compares the lookup of containers by key via the index of :class:`RixsProject` to the former search of the
+    whole tree in a project with numItems spectra.
+    """
+    import time
+    import numpy
+    project = RixsProject()
+    node = project['Spectra']
+    containerList = [ItemContainer(item=SpecItem('spectrum%06d' % idx, '', numpy.zeros(1), None), parent=node)
+                     for idx in range(numItems)]
+    node.addChildren(containerList)
+    for container in containerList:
+        project._register(container)
+
+    def searchTree(key):
+        # Former implementation: key -> identifier -> depth first search for the identifier
+        identifier = project[key].getID()
+        for container in RixsProject._traverseDFS(project.projectRoot):
+            if container.getID() == identifier:
+                return container
+        raise KeyError(key)
+
+    step = max(1, numItems // numLookups)
+    sampleKeys = ['spectrum%06d' % idx for idx in range(0, numItems, step)][:numLookups]
+    timeStart = time.time()
+    for key in sampleKeys:
+        searchTree(key)
+    timeSearch = (time.time() - timeStart) / len(sampleKeys)
+
+    allKeys = ['spectrum%06d' % idx for idx in range(numItems)]
+    timeStart = time.time()
+    for key in allKeys:
+        project[key]
+    timeIndex = (time.time() - timeStart) / len(allKeys)
+
+    print('RixsProject.benchmark -- lookup in a project of %d items' % numItems)
+    print('	tree search: %.3e s per lookup' % timeSearch)
+    print('	index:       %.3e s per lookup (speedup: %.0f)' % (timeIndex, timeSearch / timeIndex))
+    return timeSearch, timeIndex
+
+
+def benchmark_removeContainer(numItems=100000, depth=10000):
+    """
+    Disbands a group of numItems images and traverses a chain of depth nested groups, which exceeds the recursion
+    limit of a recursive traversal.
+    """
+    import time
+    import numpy
+    import sys
+
+    project = RixsProject()
+    group = project.addGroup('Disband', project['Images'])
+    containerList = [ItemContainer(item=ImageItem('image%06d.edf' % idx, {'energy': str(idx)}, numpy.zeros((2, 2)),
+                                                  None))
+                     for idx in range(numItems)]
+    project._insertContainers(group, containerList)
+
+    timeStart = time.time()
+    project.removeContainer('Disband')
+    timeRemove = time.time() - timeStart
+    success = ('Disband' not in project) and ('image000000.edf' not in project) \
+        and (not len(project.query(energy=(0, numItems)))) and (not project['Images'].childCount())
+
+    node = project.projectRoot
+    for idx in range(depth):
+        node = project.addGroup('level%d' % idx, node)
+    timeStart = time.time()
+    numPreOrder = sum(1 for container in project.projectRoot.preOrder())
+    numBreadthFirst = sum(1 for container in project.projectRoot.breadthFirst())
+    timeTraverse = time.time() - timeStart
+    success = success and numPreOrder == numBreadthFirst == depth + 4
+
+    print('RixsProject.benchmark -- remove group of %d items: %.3f s' % (numItems, timeRemove))
+    print('RixsProject.benchmark -- traverse chain of depth %d (recursion limit %d) twice: %.3f s'
+          % (depth, sys.getrecursionlimit(), timeTraverse))
+    print('\tsuccess: %s' % str(success))
+    return success
 
 
 def unitTest_RixsProject():
@@ -277,5 +759,35 @@ def unitTest_RixsProject():
     print(project['LBCO0497.edf'])
     print(project['Images'])
 
+def unitTest_crawlDanglingLink():
+    """
+    Crawls a directory containing a dangling symbolic link with and without the crawl index. In both cases the
+    link must be reported as failure while the other files are added.
+    """
+    from tempfile import mkdtemp
+    from shutil import rmtree
+    from os import symlink
+    from os.path import basename
+
+    directory = mkdtemp()
+    try:
+        with open(OsPathJoin(directory, 'spectrum.dat'), 'w') as fileHandle:
+            fileHandle.write(''.join('%d %d\n' % (idx, idx * idx) for idx in range(10)))
+        symlink(OsPathJoin(directory, 'missing.dat'), OsPathJoin(directory, 'dangling.dat'))
+        result = True
+        for useIndex in [False, True, True]:
+            project = RixsProject()
+            failures = project.crawl(directory, useIndex=useIndex)
+            failed = [basename(absName) for absName, error in failures]
+            numItems = len([node for node in project.projectRoot.preOrder() if node.hasItem()])
+            print('RixsProject.unitTest -- crawl with useIndex=%s: failed %s, %d items'
+                  % (str(useIndex), str(failed), numItems))
+            result = result and failed == ['dangling.dat'] and numItems == 1
+    finally:
+        rmtree(directory)
+    print('\t%s' % ('Success' if result else 'Failure'))
+    return result
+
+
 if __name__ == '__main__':
     unitTest_RixsProject()
\ No newline at end of file
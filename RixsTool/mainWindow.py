@@ -38,15 +38,16 @@ from PyMca5.PyMcaGui import PyMcaQt as qt
 # IMPORTS FROM RixsTool
 #
 from RixsTool.widgets.Models import ProjectModel
+from RixsTool.widgets.Ingestion import IngestionProgressWidget
 from RixsTool.Items import SpecItem, ScanItem, ImageItem
 from RixsTool.ItemContainer import ItemContainer
 from RixsTool.UiPaths import UiPaths
+from RixsTool.IO import SpectraExporter
 
 import numpy
 import platform
-from cStringIO import StringIO
+from multiprocessing import cpu_count
 #from os import linesep as OsLineSep
-from os.path import splitext as OsPathSplitExt
 
 DEBUG = 0
 PLATFORM = platform.system()
@@ -197,6 +198,7 @@ class RIXSMainWindow(qt.QMainWindow):
         else:
             model = ProjectModel()
         self.fileBrowser.addSignal.connect(model.addFileInfoList)
+        self.statusBar.addPermanentWidget(IngestionProgressWidget(model.ingestion, self))
         #self.projectBrowser.showSignal.connect(self._handleShowSignal)
         self.projectBrowser.setModel(model)
         self.projectDict[key] = model
@@ -251,6 +253,8 @@ class RIXSMainWindow(qt.QMainWindow):
                       (self.bandPassFilterID32Action, self.openBandPassID32Tool),
                       (self.energyScaleAction, self.imageView.energyScaleTool.show),
                       (self.saveSpectraAction, self.saveSpectra),
+                      (self.saveProjectAction, self.saveProject),
+                      (self.openProjectAction, self.openProject),
                       (self.projectBrowserShowAction, self.openProjectView)]
         for action, function in actionList:
             action.triggered[()].connect(function)
@@ -259,7 +263,8 @@ class RIXSMainWindow(qt.QMainWindow):
 
     def saveSpectra(self):
         """
-        Save routine that writes exports all spectra of the 'Spectra' node in a text file.
+        Save routine that exports all spectra of the 'Spectra' node. The format is chosen by the extension of the
+        file name, c.f. :class:`IO.SpectraExporter`.
         """
         try:
             (fileNameList, singleFile, comment) = RixsSaveSpectraDialog.\
@@ -279,111 +284,44 @@ class RIXSMainWindow(qt.QMainWindow):
         #return
 
         #
-        # Loop through all spectra in the top level of 'Spectra' group
+        # Stream all spectra of the 'Spectra' group, including those sorted into sub groups, to disk
         #
         specNode = self.currentProject['Spectra']
-        specString = StringIO()
-        specString.write(NEWLINE)
-
-        itemList = [node.item() for node in specNode.children if node.hasItem]
-        for idx, item in enumerate(itemList):
-            #
-            # Determine data shall be written
-            #
-            if isinstance(item, ScanItem):
-                data = numpy.vstack((item.scale(), item.array)).T  # Stack and transpose
-            elif isinstance(item, SpecItem):
-                #
-                # SpecItem does not have a scale, generate one by
-                #
-                scale = numpy.arange(
-                    start=0,
-                    stop=len(item.array),
-                    dtype=item.array.dtype)
-                data = numpy.vstack((scale, item.array)).T  # Stack and transpose
-            else:
-                raise NotImplementedError('RIXSMainWindow.saveSpectra -- Unknown item type: %s' % type(item))
-
-            if data.ndim == 1:
-                nRows, nCols = data.shape[0], 1
-            elif data.ndim == 2:
-                nRows, nCols = data.shape
-            else:
-                raise NotImplementedError('RIXSMainWindow.saveSpectra -- Can write item with dimensionality > 2')
-
-            scanNo = 1
-
-            #
-            # Start to write spec file header...
-            #
-            specString.write('#S %d %s' % (scanNo, item.key()) + NEWLINE)
-
-            #
-            # Write EDF header in #U comments
-            #
-            if DEBUG >= 1:
-                print("RIXSMainWindow.saveSpectra -- header: type(header):%s\n'%s'" % (type(item.header),
-                                                                                       item.header))
-            #headerLines = item.header.split('\n')
-            ## Determine order of magnitude
-            #if len(headerLines) > 0 and len(item.header) > 0:
-            #    magnitude = len(str(len(headerLines)))
-            #    for jdx, line in enumerate(headerLines):
-            #        # Format string explanation:
-            #        # #U              -> prefix, indicates header in spec file
-            #        # {idx:0>{width}} -> write value 'idx' in a string with 'width' letters,
-            #        #                    align value of 'idx' on the right and fill the
-            #        #                    remaining space with zeros (i.e. leading zeros)
-            #        # {line}          -> place value 'line' here
-            #        specString.write(
-            #            '#U{idx:0>{width}} {line}'.format(idx=jdx, width=magnitude, line=line) + NEWLINE
-            #        )
-
-            #
-            # .. finish to write spec file header
-            #
-            specString.write('#N %d' % nCols + NEWLINE)  # Number of columns
-            specString.write('#L PixelNo  Counts' + NEWLINE)  # Column labels
-
-            #
-            # Write data using numpy.savetxt, parameter fname can be file handle
-            #
-            numpy.savetxt(
-                fname=specString,
-                X=data,
-                fmt='%.6f',
-                delimiter=' ',
-                newline=NEWLINE
-            )
-
-            specString.write(NEWLINE)
-
-            if not singleFile:
-                #
-                # File names feature indexation
-                #
-                path, ext = OsPathSplitExt(fileName)
-                numberedPath = '{path}_{idx:0>{width}}{ext}'.format(
-                    path=path,
-                    idx=idx,
-                    width=len(itemList),
-                    ext=ext
-                )
-                with open(numberedPath, 'wb') as fileHandle:
-                    fileHandle.write(specString.getvalue())
-
-                #
-                # Reset StringIO
-                #
-                specString = StringIO()
-
-        if singleFile:
-            with open(fileName, 'wb') as fileHandle:
-                fileHandle.write(specString.getvalue())
+        itemList = [node.item() for node in specNode.preOrder() if node.hasItem()]
+        exporter = SpectraExporter(workers=cpu_count())
+        exporter.export(fileName, itemList, singleFile, comment)
 
         if DEBUG >= 1:
             print('RIXSMainWindow.saveSpectra -- Done!')
 
+    def saveProject(self):
+        """
+        Writes the current project to a HDF5 file, c.f. :func:`Project.RixsProject.save`
+        """
+        fileName = qt.QFileDialog.getSaveFileName(self, 'Save project', str(qt.QDir.home().absolutePath()),
+                                                  'RixsTool projects (*.h5 *.hdf5)')
+        fileName = qt.safe_str(fileName)
+        if not len(fileName):
+            return
+        try:
+            self.currentProject.save(fileName)
+        except (ImportError, ValueError) as error:
+            qt.QMessageBox.critical(self, 'Save project', str(error))
+
+    def openProject(self):
+        """
+        Replaces the current project by a project stored in a HDF5 file, c.f. :func:`Project.RixsProject.load`
+        """
+        fileName = qt.QFileDialog.getOpenFileName(self, 'Open project', str(qt.QDir.home().absolutePath()),
+                                                  'RixsTool projects (*.h5 *.hdf5)')
+        fileName = qt.safe_str(fileName)
+        if not len(fileName):
+            return
+        try:
+            self.currentProject.load(fileName)
+        except (ImportError, ValueError, IOError) as error:
+            qt.QMessageBox.critical(self, 'Open project', str(error))
+
     def openBandPassTool(self):
         self.imageView.setCurrentFilter('bandpass')
 
@@ -419,6 +357,9 @@ class RixsSaveSpectraDialog(qt.QFileDialog):
     def getSaveFileName(parent, caption, directory, typeFilter=None, selectedFilter=None, options=None):
         dial = RixsSaveSpectraDialog(parent, caption, directory)
         dial.setAcceptMode(qt.QFileDialog.AcceptSave)
+        dial.setNameFilters(['SPEC files (*.spec *.dat)',
+                             'Numpy archives (*.npz)',
+                             'HDF5 files (*.h5 *.hdf5)'])
         singleFile = None
         comment = None
         fileNameList = []
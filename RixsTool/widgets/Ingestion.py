@@ -0,0 +1,361 @@
+#/*##########################################################################
+# Copyright (C) 2014 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# This toolkit is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# PyMca is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# PyMca; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# PyMca follows the dual licensing model of Riverbank's PyQt and cannot be
+# used as a free plugin for a non-free program.
+#
+# Please contact the ESRF industrial unit (industry@esrf.fr) if this license
+# is a problem for you.
+#############################################################################*/
+__author__ = "Tonn Rueter - ESRF Data Analysis Unit"
+# Imports for GUI
+from PyMca5.PyMcaGui import PyMcaQt as qt
+
+from multiprocessing.pool import ThreadPool
+from threading import Lock, Event
+import time
+
+from RixsTool.IO import UnknownFileType
+
+DEBUG = 0
+
+#
+# Finished items are delivered as soon as either limit is reached
+#
+BATCH_SIZE = 50
+BATCH_INTERVAL = .25  # seconds
+
+
+class IngestionThread(qt.QThread):
+    __doc__ = """QThread that runs the work loop of an :class:`IngestionService`"""
+
+    def __init__(self, target, parent=None):
+        qt.QThread.__init__(self, parent)
+        self._target = target
+
+    def run(self):
+        self._target()
+
+
+class IngestionService(qt.QObject):
+    __doc__ = """Reads files in the background. The files are read by a pool of worker threads that is driven by an
+    :class:`IngestionThread`, the GUI thread only receives the finished items. Items are delivered in batches of at
+    most :py:attr:`batchSize` items, at least every :py:attr:`batchInterval` seconds. Since the signals are emitted
+    from the ingestion thread, connected slots of objects living in the GUI thread are called via queued connections.
+
+    Files passed to :func:`IngestionService.ingest` while the service is running are appended to the current run.
+    Every run holds its own cancel event, so files passed after :func:`IngestionService.cancel` start a new run
+    while the cancelled one winds down.
+
+    **Signals**
+        * startedSignal: Emitted when a run starts
+        * itemsReadySignal: Emits a list of :py:class:`Items.ProjectItem`
+        * failedSignal: Emits a list of 2-tuples containing file name and error of files that could not be read
+        * progressSignal: Emits the number of files read and the total number of files of the current run
+        * finishedSignal: Emits True if the run was cancelled, False otherwise
+
+    .. py:attribute:: readFunction
+
+        Callable that reads a single file and returns the 3-tuple (fileName, itemList, error), c.f.
+        :func:`Project.RixsProject._readSafely`. Must be thread safe."""
+
+    startedSignal = qt.pyqtSignal()
+    itemsReadySignal = qt.pyqtSignal(object)
+    failedSignal = qt.pyqtSignal(object)
+    progressSignal = qt.pyqtSignal(int, int)
+    finishedSignal = qt.pyqtSignal(bool)
+
+    def __init__(self, readFunction, workers=4, batchSize=BATCH_SIZE, batchInterval=BATCH_INTERVAL, parent=None):
+        """
+        :param function readFunction: Reads a single file
+        :param int workers: Number of files read concurrently
+        :param int batchSize: Maximum number of items per emission of itemsReadySignal
+        :param float batchInterval: Maximum time in seconds between two emissions of itemsReadySignal
+        :param QObject parent: Parent object
+        """
+        qt.QObject.__init__(self, parent)
+        self.readFunction = readFunction
+        self.workers = workers
+        self.batchSize = batchSize
+        self.batchInterval = batchInterval
+        self._lock = Lock()
+        self._cancelEvent = Event()
+        self._pending = []
+        self._done = 0
+        self._total = 0
+        self._active = False
+        self._threads = []
+
+    def isRunning(self):
+        with self._lock:
+            return self._active
+
+    def ingest(self, fileNameList):
+        """
+        :param list fileNameList: Absolute names of the files to read
+
+        Queues the files for reading and starts the ingestion thread if it is not running.
+        """
+        fileNameList = list(fileNameList)
+        if not len(fileNameList):
+            return
+        with self._lock:
+            self._pending += fileNameList
+            self._total += len(fileNameList)
+            start = not self._active
+            if start:
+                self._active = True
+                self._cancelEvent = Event()
+            cancelEvent = self._cancelEvent
+        if not start:
+            return
+        # Threads of previous runs may still finish the files they were reading when the run was cancelled
+        self._threads = [thread for thread in self._threads if not thread.isFinished()]
+        thread = IngestionThread(lambda: self._work(cancelEvent))
+        self._threads += [thread]
+        self.startedSignal.emit()
+        thread.start()
+
+    def cancel(self):
+        """
+        Stops the current run. Files that are being read when the service is cancelled are finished, but their
+        items are discarded. Items delivered before remain untouched. The run ends immediately, files passed to
+        :func:`IngestionService.ingest` afterwards start a new run.
+        """
+        with self._lock:
+            self._cancelEvent.set()
+            self._reset()
+
+    def wait(self):
+        """
+        Blocks until all runs, including cancelled ones, are finished. Intended for scripts and tests.
+        """
+        for thread in list(self._threads):
+            thread.wait()
+
+    def _work(self, cancelEvent):
+        # cancelEvent belongs to this run. Once it is set, the shared state belongs to the next run and must
+        # not be touched anymore, c.f. IngestionService.cancel
+        pool = ThreadPool(self.workers)
+        batch, failures = [], []
+        lastEmit = time.time()
+        cancelled = False
+        fileNameList, processed = [], 0
+        try:
+            while not cancelled:
+                with self._lock:
+                    cancelled = cancelEvent.is_set()
+                    if cancelled:
+                        break
+                    fileNameList, self._pending = self._pending, []
+                    if not len(fileNameList):
+                        # Decided under the lock, files queued from now on start a new run
+                        self._reset()
+                        break
+                processed = 0
+                for fileName, itemList, error in pool.imap(self.readFunction, fileNameList):
+                    with self._lock:
+                        cancelled = cancelEvent.is_set()
+                        if cancelled:
+                            break
+                        self._done += 1
+                        done, total = self._done, self._total
+                    processed += 1
+                    if error is None:
+                        batch += itemList
+                    elif not isinstance(error, UnknownFileType):
+                        # Unknown file types are skipped silently, c.f. RixsProject.crawl
+                        failures += [(fileName, error)]
+                    now = time.time()
+                    if len(batch) >= self.batchSize or now - lastEmit >= self.batchInterval or done == total:
+                        self._deliver(batch, failures)
+                        batch, failures = [], []
+                        self.progressSignal.emit(done, total)
+                        lastEmit = now
+            if not cancelled:
+                self._deliver(batch, failures)
+        except Exception as error:
+            # Exceptions must not leave QThread.run. Every file of the run that was not read is reported as failed
+            if DEBUG >= 1:
+                print('IngestionService._work -- Run failed: %s' % str(error))
+            with self._lock:
+                cancelled = cancelEvent.is_set()
+                unread = fileNameList[processed:]
+                if not cancelled:
+                    unread += self._pending
+                    self._reset()
+            if not cancelled:
+                self._deliver(batch, failures + [(fileName, error) for fileName in unread])
+        finally:
+            pool.terminate()
+            pool.join()
+        if DEBUG >= 1:
+            print('IngestionService._work -- Finished (cancelled: %s)' % str(cancelled))
+        self.finishedSignal.emit(cancelled)
+
+    def _reset(self):
+        # Must be called holding self._lock
+        self._active = False
+        self._pending = []
+        self._done = 0
+        self._total = 0
+
+    def _deliver(self, batch, failures):
+        if len(batch):
+            self.itemsReadySignal.emit(batch)
+        if len(failures):
+            self.failedSignal.emit(failures)
+
+
+class IngestionProgressWidget(qt.QWidget):
+    __doc__ = """Progress bar and cancel button for an :class:`IngestionService`. The widget is only visible while
+    the service is running."""
+
+    def __init__(self, service, parent=None):
+        qt.QWidget.__init__(self, parent)
+        self.service = service
+
+        self.progressBar = qt.QProgressBar(self)
+        self.progressBar.setFormat('Reading files: %v / %m')
+        self.cancelButton = qt.QPushButton('Cancel', self)
+
+        layout = qt.QHBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.progressBar)
+        layout.addWidget(self.cancelButton)
+        self.setLayout(layout)
+
+        self.cancelButton.clicked[()].connect(self.service.cancel)
+        self.service.startedSignal.connect(self.handleStarted)
+        self.service.progressSignal.connect(self.handleProgress)
+        self.service.finishedSignal.connect(self.handleFinished)
+        self.hide()
+
+    def handleStarted(self):
+        self.progressBar.setRange(0, 0)  # Busy indicator until the first file is read
+        self.show()
+
+    def handleProgress(self, done, total):
+        self.progressBar.setRange(0, total)
+        self.progressBar.setValue(done)
+
+    def handleFinished(self, cancelled):
+        if not self.service.isRunning():
+            self.hide()
+
+
+def unitTest_IngestionService(numFiles=200):
+    from tempfile import mkdtemp
+    from shutil import rmtree
+    from os.path import join as OsPathJoin
+    import numpy
+    from RixsTool.Project import RixsProject
+
+    class DummyNotifier(qt.QObject):
+        def __init__(self):
+            qt.QObject.__init__(self)
+            self.items = []
+            self.batches = 0
+            self.progress = None
+
+        def itemsReady(self, itemList):
+            self.items += itemList
+            self.batches += 1
+
+        def progressChanged(self, done, total):
+            self.progress = (done, total)
+
+    app = qt.QApplication.instance() or qt.QApplication([])
+    directory = mkdtemp()
+    try:
+        fileNameList = []
+        for idx in range(numFiles):
+            fileName = OsPathJoin(directory, 'spectrum%04d.dat' % idx)
+            numpy.savetxt(fileName, numpy.vstack((numpy.arange(100.), numpy.arange(100.) * idx)).T)
+            fileNameList += [fileName]
+
+        project = RixsProject()
+        notifier = DummyNotifier()
+        service = IngestionService(project._readSafely)
+        service.itemsReadySignal.connect(notifier.itemsReady)
+        service.progressSignal.connect(notifier.progressChanged)
+        service.finishedSignal.connect(app.quit)
+        service.ingest(fileNameList)
+        app.exec_()
+    finally:
+        rmtree(directory)
+
+    success = len(notifier.items) == numFiles and notifier.progress == (numFiles, numFiles)
+    print('IngestionService.unitTest -- %d files in %d batches' % (len(notifier.items), notifier.batches))
+    print('\t%s' % ('Success' if success else 'Failure'))
+    return success
+
+
+def unitTest_IngestionServiceCancel(numFiles=20):
+    """
+    Cancels a run of slowly read files and ingests a second set of files right away, before the cancelled run has
+    left its work loop. All files of the second set must be delivered.
+    """
+    from tempfile import mkdtemp
+    from shutil import rmtree
+    from os.path import join as OsPathJoin
+    import numpy
+    from RixsTool.Project import RixsProject
+
+    project = RixsProject()
+
+    def slowRead(fileName):
+        if 'first' in fileName:
+            time.sleep(.05)
+        return project._readSafely(fileName)
+
+    app = qt.QApplication.instance() or qt.QApplication([])
+    service = IngestionService(slowRead, workers=2)
+    delivered = []
+    service.itemsReadySignal.connect(lambda itemList: delivered.extend(itemList))
+    service.finishedSignal.connect(lambda cancelled: service.isRunning() or app.quit())
+    directory = mkdtemp()
+    try:
+        first, second = [], []
+        for idx in range(numFiles):
+            for prefix, fileNameList in [('first', first), ('second', second)]:
+                fileName = OsPathJoin(directory, '%s%04d.dat' % (prefix, idx))
+                numpy.savetxt(fileName, numpy.vstack((numpy.arange(10.), numpy.arange(10.) * idx)).T)
+                fileNameList += [fileName]
+        service.ingest(first)
+        time.sleep(.1)
+        service.cancel()
+        service.ingest(second)
+        running = service.isRunning()
+        app.exec_()
+        service.wait()
+    finally:
+        rmtree(directory)
+
+    numSecond = len([item for item in delivered if 'second' in item.key()])
+    success = running and numSecond == numFiles and not service.isRunning()
+    print('IngestionService.unitTest -- %d of %d files ingested after cancel' % (numSecond, numFiles))
+    print('\t%s' % ('Success' if success else 'Failure'))
+    return success
+
+
+if __name__ == '__main__':
+    unitTest_IngestionService()
+    unitTest_IngestionServiceCancel()
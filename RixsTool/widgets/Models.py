@@ -31,16 +31,36 @@ __author__ = "Tonn Rueter - ESRF Data Analysis Unit"
 from RixsTool.Utils import unique as RixsUtilsUnique
 #from RixsTool.Datahandling import RixsProject
 from RixsTool.Project import RixsProject
+from RixsTool.Grouping import groupName
+from RixsTool.widgets.Ingestion import IngestionService
 from PyMca5.PyMcaGui import PyMcaQt as qt
 from os.path import normpath as OsPathNormpath
 
 DEBUG = 0
 
+#
+# Number of rows a ProjectModel exposes per call of fetchMore
+#
+FETCH_PAGESIZE = 256
+
 
 class ProjectModel(RixsProject, qt.QAbstractItemModel):
     __doc__ = """
     Tree model with :class:`datahandling.RixsProject` as underlying data structure. Implementation of
     the interface of :class:`QAbstractItemModel`.
+
+    Large groups are populated incrementally. Initially only the first :py:attr:`pageSize` children of a
+    container are exposed to the views, further pages are exposed by :func:`fetchMore` as the user scrolls.
+
+    .. py:attribute:: pageSize
+
+        Number of rows exposed per page. None exposes all rows at once
+
+    .. py:attribute:: cacheDisplay
+
+        If True, the strings displayed for a container are computed once and cached until dataChanged is emitted for
+        the container. Renaming through the model does so, code that modifies an item in place must call
+        :func:`itemChanged`
     """
 
     def __init__(self, parent=None):
@@ -51,14 +71,44 @@ class ProjectModel(RixsProject, qt.QAbstractItemModel):
         RixsProject.__init__(self)
         qt.QAbstractItemModel.__init__(self, parent)
 
+        #
+        # Number of exposed rows per container identifier, c.f. fetchMore
+        #
+        self.pageSize = FETCH_PAGESIZE
+        self._exposed = {}
+
+        #
+        # Display strings per container identifier, c.f. data
+        #
+        self.cacheDisplay = True
+        self._displayCache = {}
+        self.dataChanged.connect(self._invalidateDisplayCache)
+
+        #
+        # Files are read in the background, c.f. addFileInfoList
+        #
+        self.ingestion = IngestionService(self._readSafely, parent=self)
+        self.ingestion.itemsReadySignal.connect(self._addIngestedItems)
+        self.ingestion.failedSignal.connect(self._handleIngestionFailures)
+
     def removeContainer(self, modelIndex):
         if not modelIndex.isValid():
             print('Index is invalid')
             return
         container = self.containerAt(modelIndex)
         parentIndex = self.parent(modelIndex)
-
-        self.beginRemoveRows(parentIndex, container.childNumber(), container.childNumber())
+        parentContainer = container.parent
+        exposed = self._rowsExposed(parentContainer)
+        row = container.childNumber()
+
+        for descendant in container.preOrder():
+            self._exposed.pop(descendant.getID(), None)
+            self._displayCache.pop(descendant.getID(), None)
+        if row >= exposed:
+            # Row has not been fetched by the views yet
+            RixsProject.removeContainer(self, container.label)
+            return
+        self.beginRemoveRows(parentIndex, row, row)
 
         #if container.childCount():
         #    print('Has children')
@@ -71,6 +121,7 @@ class ProjectModel(RixsProject, qt.QAbstractItemModel):
         #del(parentContainer.children[idx])
 
         RixsProject.removeContainer(self, container.label)
+        self._exposed[parentContainer.getID()] = exposed - 1
         self.endRemoveRows()
 
     def addItem(self, item):
@@ -81,19 +132,94 @@ class ProjectModel(RixsProject, qt.QAbstractItemModel):
         if DEBUG >= 1:
             print('### ProjectModel.addItem -- called ###')
         try:
-            container = RixsProject.addItem(self, item)
+            RixsProject.addItem(self, item)
         except ValueError as error:
             # Catch ValueError from base class method RixsProject.addItem
             # caused by unknown item type (must be ScanItem, ImageItem, ...)
             if DEBUG >= 1:
                 print(error)
             return False
+        return True
 
-        modelIndex = self.createIndex(container.childNumber(), 0, container)
-        parentIndex = self.parent(modelIndex)
-        self.beginInsertRows(parentIndex, container.childNumber(), container.childNumber())
+    def _insertContainers(self, node, containerList):
+        """
+        :param ItemContainer node: Container the new containers are appended to
+        :param list containerList: New containers
+
+        Notifies the views about the insertion of all containers in a single pair of beginInsertRows and
+        endInsertRows, c.f. :func:`Project.RixsProject.addItems`
+        """
+        if not len(containerList):
+            return
+        first = node.childCount()
+        if self.pageSize is None:
+            last = first + len(containerList) - 1
+        elif self._rowsExposed(node) < first:
+            # Views learn about the new rows via canFetchMore
+            RixsProject._insertContainers(self, node, containerList)
+            return
+        else:
+            # All rows are exposed, the new rows are exposed up to one page
+            last = first + min(len(containerList), self.pageSize) - 1
+        self.beginInsertRows(self.indexOf(node), first, last)
+        try:
+            self._exposed[node.getID()] = last + 1
+            RixsProject._insertContainers(self, node, containerList)
+        finally:
+            self.endInsertRows()
+
+    def _rowsExposed(self, container):
+        """
+        :param ItemContainer container: Container in the model
+        :returns: Number of children of the container the views know about
+        :rtype: int
+        """
+        count = container.childCount()
+        if self.pageSize is None:
+            return count
+        exposed = self._exposed.get(container.getID())
+        if exposed is None:
+            exposed = min(count, self.pageSize)
+            self._exposed[container.getID()] = exposed
+        return min(exposed, count)
+
+    def canFetchMore(self, parentIndex):
+        """
+        :param parentIndex: Model index of a container in the model
+        :type parentIndex: QModelIndex
+        :returns: True if the container has children that are not exposed yet
+        :rtype: bool
+        """
+        parent = self.containerAt(parentIndex)
+        return self._rowsExposed(parent) < parent.childCount()
+
+    def fetchMore(self, parentIndex):
+        """
+        :param parentIndex: Model index of a container in the model
+        :type parentIndex: QModelIndex
+
+        Exposes the next page of children of the container
+        """
+        parent = self.containerAt(parentIndex)
+        exposed = self._rowsExposed(parent)
+        count = min(self.pageSize, parent.childCount() - exposed)
+        if count <= 0:
+            return
+        if DEBUG >= 1:
+            print('ProjectModel.fetchMore -- rows %d to %d of %s' % (exposed, exposed + count - 1, parent.label))
+        self.beginInsertRows(parentIndex, exposed, exposed + count - 1)
+        self._exposed[parent.getID()] = exposed + count
         self.endInsertRows()
-        return True
+
+    def indexOf(self, container):
+        """
+        :param ItemContainer container: Container in the model
+        :returns: Model index of the container. The index of the root is invalid
+        :rtype: QModelIndex
+        """
+        if container is self.projectRoot or container.parent is None:
+            return qt.QModelIndex()
+        return self.createIndex(container.childNumber(), 0, container)
 
     def addGroup(self, label, node=None):
         """
@@ -110,14 +236,23 @@ class ProjectModel(RixsProject, qt.QAbstractItemModel):
             if DEBUG >= 1:
                 print(error)
             return False
-
-        # TODO: calling self.createIndex creates RuntimeError! W\o calling it, the method works though..
-        #modelIndex = self.createIndex(container.childNumber(), 0, container)
-        #parentIndex = self.parent(modelIndex)
-        #self.beginInsertRows(parentIndex, container.childNumber(), container.childNumber())
-        #self.endInsertRows()
+        # Views are notified by _insertContainers
         return True
 
+    def load(self, fileName):
+        """
+        :param str fileName: Name of the HDF5 project file
+
+        Replaces the project tree by the tree stored in fileName, c.f. :func:`Project.RixsProject.load`
+        """
+        self.beginResetModel()
+        try:
+            self._exposed = {}
+            self._displayCache = {}
+            RixsProject.load(self, fileName)
+        finally:
+            self.endResetModel()
+
     def containerAt(self, modelIndex):
         """
         :param modelIndex: Model index of a container in the model
@@ -142,14 +277,57 @@ class ProjectModel(RixsProject, qt.QAbstractItemModel):
         """
         if not modelIndex.isValid():
             return None
-        container = self.containerAt(modelIndex)
         if role == qt.Qt.DisplayRole:
-            if not container.hasItem():
-                if modelIndex.column():
-                    # Not in the 0-th column..
-                    return ''
-                return str(container.label)
-            return str(container.data(modelIndex.column()))
+            container = modelIndex.internalPointer()
+            if not self.cacheDisplay:
+                return self._displayData(container)[modelIndex.column()]
+            display = self._displayCache.get(container.getID())
+            if display is None:
+                display = self._displayData(container)
+                self._displayCache[container.getID()] = display
+            return display[modelIndex.column()]
+
+    @staticmethod
+    def _displayData(container):
+        """
+        :param ItemContainer container: Container in the model
+        :returns: Strings displayed in the columns of the container
+        :rtype: tuple
+        """
+        if not container.hasItem():
+            # Groups only display the last level of their label in the 0-th column
+            return (groupName(container.label),) + ('',) * (container.columnCount() - 1)
+        return tuple(str(container.data(column)) for column in range(container.columnCount()))
+
+    def _invalidateDisplayCache(self, topLeft, bottomRight):
+        parent = self.containerAt(topLeft.parent())
+        for row in range(topLeft.row(), min(bottomRight.row() + 1, parent.childCount())):
+            self._displayCache.pop(parent.children[row].getID(), None)
+
+    def itemChanged(self, container):
+        """
+        :param ItemContainer container: Container whose item was modified
+
+        Notifies the views that the displayed attributes of the item may have changed.
+        """
+        self._displayCache.pop(container.getID(), None)
+        modelIndex = self.indexOf(container)
+        if not modelIndex.isValid() or modelIndex.row() >= self._rowsExposed(container.parent):
+            # Views do not know the row yet
+            return
+        lastIndex = self.createIndex(modelIndex.row(), container.columnCount() - 1, container)
+        self.dataChanged.emit(modelIndex, lastIndex)
+
+    def rename(self, label, newLabel):
+        """
+        Renames a container and notifies the views, c.f. :func:`Project.RixsProject.rename`
+
+        :returns: Renamed container
+        :rtype: ItemContainer
+        """
+        container = RixsProject.rename(self, label, newLabel)
+        self.itemChanged(container)
+        return container
 
     def setData(self, modelIndex, value, role=qt.Qt.DisplayRole):
         """
@@ -164,12 +342,20 @@ class ProjectModel(RixsProject, qt.QAbstractItemModel):
         if not container.hasItem():
             # Only ItemContainers that contain DataItem can be changed
             return False
-        if role == qt.Qt.DisplayRole:
-            if not modelIndex.column():
-                # Not the 0-th column, change key!
-                return False
-            container.label = str(value) # TODO: Changes label but not item key...
-        self.dataChanged.emit(modelIndex, modelIndex)
+        if role not in [qt.Qt.DisplayRole, qt.Qt.EditRole]:
+            return False
+        if modelIndex.column():
+            # Not the 0-th column, only the key can be changed
+            return False
+        try:
+            self.rename(container.label, qt.safe_str(value))
+        except ValueError as error:
+            # Catch ValueError from base class method RixsProject.rename
+            # caused by already present key
+            if DEBUG >= 1:
+                print(error)
+            return False
+        return True
 
     def headerData(self, section, orientation, role=qt.Qt.DisplayRole):
         """
@@ -195,13 +381,13 @@ class ProjectModel(RixsProject, qt.QAbstractItemModel):
         :param modelIndex: Model index of a container in the model
         :type modelIndex: QModelIndex
 
-        Number of children under the given model index
+        Number of children under the given model index that are exposed to the views, c.f. :func:`fetchMore`
 
         :returns: Number of rows
         :rtype: int
         """
         parent = self.containerAt(parentIndex)
-        return parent.childCount()
+        return self._rowsExposed(parent)
 
     def columnCount(self, parentIndex=qt.QModelIndex(), *args, **kwargs):
         """
@@ -277,15 +463,28 @@ class ProjectModel(RixsProject, qt.QAbstractItemModel):
         return self.createIndex(parentContainer.childNumber(), 0, parentContainer)
 
     def addFileInfoList(self, fileInfoList):
+        """
+        :param fileInfoList: Files to add to the project
+        :type fileInfoList: list of QFileInfo
+
+        The files are read in the background by :py:attr:`ingestion`, the items are added batch by batch as they
+        arrive. The method returns immediately.
+        """
         if DEBUG >= 1:
             print('ProjectView.addFileInfoList -- received fileInfoList (len: %d)' % len(fileInfoList))
-        itemList = []
-        for info in fileInfoList:
-            absFilePath = OsPathNormpath(str(info.canonicalFilePath()))
-            #self.read(absFilePath)
-            itemList += RixsProject.read(self, absFilePath)
-        for item in itemList:
-            self.addItem(item)
+        fileNameList = [OsPathNormpath(str(info.canonicalFilePath())) for info in fileInfoList]
+        self.ingestion.ingest(fileNameList)
+
+    def _addIngestedItems(self, itemList):
+        containerList, failures = self.addItems(itemList)
+        if DEBUG >= 1:
+            for item, error in failures:
+                print(error)
+
+    def _handleIngestionFailures(self, failures):
+        if DEBUG >= 1:
+            for fileName, error in failures:
+                print("ProjectModel.addFileInfoList -- failed to read '%s': %s" % (fileName, str(error)))
 
 
 class QDirListModel(qt.QAbstractListModel):
@@ -418,6 +617,85 @@ def unitTest_QDirListModel():
         return False
 
 
+def benchmark_ProjectModel(numItems=100000):
+    """
+    Measures the time a tree view needs to expand a group of numItems spectra, with and without paging.
+    """
+    import time
+    import numpy
+    from RixsTool.Items import SpecItem
+    app = qt.QApplication([])
+    itemList = [SpecItem('spectrum%06d' % idx, '', numpy.zeros(1), None) for idx in range(numItems)]
+    results = {}
+    for pageSize in [FETCH_PAGESIZE, None]:
+        model = ProjectModel()
+        model.pageSize = pageSize
+        view = qt.QTreeView()
+        view.setModel(model)
+        view.show()
+        model.addItems(itemList)
+        app.processEvents()
+        groupIndex = model.index(0, 0)
+        timeStart = time.time()
+        view.expand(groupIndex)
+        app.processEvents()
+        results[pageSize] = (time.time() - timeStart, model.rowCount(groupIndex))
+        view.close()
+    print('ProjectModel.benchmark -- expanding a group of %d spectra' % numItems)
+    print('\tpaged:     %.3f s (%d rows exposed)' % results[FETCH_PAGESIZE])
+    print('\tall rows:  %.3f s (%d rows exposed)' % results[None])
+    return results
+
+
+def benchmark_ProjectModelDisplay(numItems=50000, numPasses=2):
+    """
+    Measures the repaint cost of scrolling page by page through a tree view showing a group of numItems spectra,
+    with and without the display cache of :class:`ProjectModel`. The view is scrolled numPasses times from top to
+    bottom. In addition the time spent in :func:`ProjectModel.data` alone is measured by requesting the display
+    data of every cell numPasses times.
+    """
+    import time
+    import numpy
+    from RixsTool.Items import SpecItem
+    app = qt.QApplication([])
+    itemList = [SpecItem('spectrum%06d' % idx, '', numpy.zeros(1), None) for idx in range(numItems)]
+    results = {}
+    for cacheDisplay in [False, True]:
+        model = ProjectModel()
+        model.pageSize = None
+        model.cacheDisplay = cacheDisplay
+        model.addItems(itemList)
+        view = qt.QTreeView()
+        view.setUniformRowHeights(True)
+        view.setModel(model)
+        view.resize(600, 800)
+        view.show()
+        view.expand(model.index(0, 0))
+        app.processEvents()
+        scrollBar = view.verticalScrollBar()
+        step = max(1, scrollBar.pageStep())
+        timeStart = time.time()
+        for idx in range(numPasses):
+            for value in range(0, scrollBar.maximum() + step, step):
+                scrollBar.setValue(value)
+                view.viewport().repaint()
+        timeScroll = time.time() - timeStart
+        view.close()
+
+        groupIndex = model.index(0, 0)
+        indexList = [model.index(row, column, groupIndex)
+                     for row in range(numItems) for column in range(model.columnCount(groupIndex))]
+        timeStart = time.time()
+        for idx in range(numPasses):
+            for modelIndex in indexList:
+                model.data(modelIndex, qt.Qt.DisplayRole)
+        results[cacheDisplay] = (timeScroll, time.time() - timeStart)
+    print('ProjectModel.benchmarkDisplay -- %d passes through %d rows' % (numPasses, numItems))
+    print('\twithout cache: scrolling %.3f s, data() %.3f s' % results[False])
+    print('\twith cache:    scrolling %.3f s, data() %.3f s' % results[True])
+    return results
+
+
 def unitTest_ProjectModel():
     class DummyNotifier(qt.QObject):
         def signalReceived(self, val0=None, val1=None):
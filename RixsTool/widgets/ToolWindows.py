@@ -301,7 +301,7 @@ class ImageAlignmenWindow(AbstractToolWindow):
 
     def alignImage(self, image, params):
         func = FunctionItem('Slope Function', '')
-        expression = lambda x, a, b, c: a*x**2 + b*x + c
+        expression = 'lambda x, a, b, c: a*x**2 + b*x + c'
         params = self.getValues()
 
         params['a'] *= 10.**-5
@@ -399,7 +399,7 @@ class EnergyScaleTool(AbstractToolWindow):
         #
         # Set expression
         #
-        scale.setExpression(lambda x, a, b: a*x + b)
+        scale.setExpression('lambda x, a, b: a*x + b')
 
         #
         # Set parameters